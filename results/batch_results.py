@@ -0,0 +1,189 @@
+# Headless batch compression of every FBX file under a directory.
+#
+# Run with any Python interpreter; each FBX is processed by its own mayapy worker:
+#
+#   python batch_results.py path/to/fbx/tree path/to/output --mayapy /usr/autodesk/maya2018/bin/mayapy \
+#       --workers 8 --backend numpy --save-fbx --save-csv
+#
+# Outputs for "a/b/clip.fbx" are written to "output/a/b/clip/", along with a
+# done.json summary (or failed.json and worker.log when the worker fails).
+# Files with a done.json are skipped, so re-running the same command resumes an
+# interrupted batch. A manifest.json summarising every file is written at the end.
+#
+# Objects used for selection and reduction default to every joint in the scene;
+# pass --objects with a JSON file of the form
+#   { "selection" : ["mixamorig:Hips", ...], "reduction" : ["mixamorig:Hips", ...] }
+# to choose them explicitly.
+
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = os.path.join(os.path.dirname(HERE), "scripts")
+
+
+def find_fbx_files(root):
+    found = []
+    for (directory, _, filenames) in os.walk(root):
+        for filename in filenames:
+            if filename.lower().endswith(".fbx"):
+                found.append(os.path.relpath(os.path.join(directory, filename), root))
+    return sorted(found)
+
+
+def output_directory_for(output_root, relative_path):
+    return os.path.join(output_root, os.path.splitext(relative_path)[0])
+
+
+def write_json(filepath, data):
+    handle, temporary_filepath = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(filepath)))
+    with os.fdopen(handle, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(temporary_filepath, filepath)
+
+
+def read_json(filepath):
+    with open(filepath) as f:
+        return json.load(f)
+
+
+def run_worker(args, relative_path):
+    """
+    Processes one FBX file in a mayapy subprocess, returning its summary.
+    """
+    output_directory = output_directory_for(args.output_root, relative_path)
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+
+    command = [
+        args.mayapy, os.path.abspath(__file__), "--worker",
+        os.path.join(args.input_root, relative_path), output_directory,
+        "--name", relative_path, "--backend", args.backend, "--device", args.device, "--workers", str(args.workers),
+    ]
+    if args.objects is not None: command += ["--objects", args.objects]
+    if args.save_fbx: command.append("--save-fbx")
+    if args.save_maya_ascii: command.append("--save-maya-ascii")
+    if args.save_csv: command.append("--save-csv")
+    if args.save_npy: command.append("--save-npy")
+
+    began = time.time()
+    with open(os.path.join(output_directory, "worker.log"), "w") as log:
+        return_code = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT)
+
+    done_filepath = os.path.join(output_directory, "done.json")
+    if return_code == 0 and os.path.isfile(done_filepath):
+        summary = read_json(done_filepath)
+    else:
+        summary = { "fbx" : relative_path, "status" : "failed", "return_code" : return_code, "seconds" : time.time() - began }
+        write_json(os.path.join(output_directory, "failed.json"), summary)
+    return summary
+
+
+def run_batch(args):
+    fbx_files = find_fbx_files(args.input_root)
+    pending = [f for f in fbx_files if not os.path.isfile(os.path.join(output_directory_for(args.output_root, f), "done.json"))]
+    print("Found %d FBX files, %d already done, %d to process with %d workers" % (
+        len(fbx_files), len(fbx_files) - len(pending), len(pending), args.workers))
+
+    pool = ThreadPool(args.workers)
+    try:
+        for (i, summary) in enumerate(pool.imap_unordered(lambda f: run_worker(args, f), pending)):
+            print("[%d/%d] %s: %s (%.1fs)" % (i + 1, len(pending), summary["fbx"], summary["status"], summary["seconds"]))
+    finally:
+        pool.close()
+        pool.join()
+
+    # Summarise every file, including those completed by earlier runs
+    entries = []
+    for relative_path in fbx_files:
+        output_directory = output_directory_for(args.output_root, relative_path)
+        for name in ["done.json", "failed.json"]:
+            filepath = os.path.join(output_directory, name)
+            if os.path.isfile(filepath):
+                entries.append(read_json(filepath))
+                break
+    write_json(os.path.join(args.output_root, "manifest.json"), {
+        "input_root" : os.path.abspath(args.input_root),
+        "n_done" : len([e for e in entries if e["status"] == "done"]),
+        "n_failed" : len([e for e in entries if e["status"] != "done"]),
+        "files" : entries,
+    })
+
+
+def run_in_mayapy(args):
+    """
+    Entry point of a worker: imports, selects, and reduces one FBX file.
+    """
+    import maya.standalone
+    maya.standalone.initialize(name="python")
+
+    sys.path[:0] = [HERE, SCRIPTS]
+    import maya.cmds as cmds
+    import generate_results
+
+    began = time.time()
+    fbx_filepath = os.path.abspath(args.input_root)
+    failed_filepath = os.path.join(args.output_root, "failed.json")
+    try:
+        cmds.loadPlugin("fbxmaya", quiet=True)
+
+        # Without --objects, run_on_fbx_file uses every joint it imports
+        objects = { "selection" : None, "reduction" : None }
+        if args.objects is not None:
+            objects = read_json(args.objects)
+
+        # Files are processed args.workers at a time, so each has its share of the cores
+        workers = max(1, multiprocessing.cpu_count() // args.workers)
+
+        directory, filename = os.path.split(fbx_filepath)
+        summary = generate_results.run_on_fbx_file(
+            directory.replace("\\", "/"), filename, objects["selection"], objects["reduction"], args.device,
+            save_maya_ascii=args.save_maya_ascii, save_fbx=args.save_fbx, save_csv=args.save_csv, save_npy=args.save_npy,
+            backend=args.backend, output_directory=args.output_root.replace("\\", "/"), workers=workers)
+
+        summary["fbx"] = args.name
+        summary["status"] = "done"
+        summary["seconds"] = time.time() - began
+        if os.path.isfile(failed_filepath):
+            os.remove(failed_filepath)
+        write_json(os.path.join(args.output_root, "done.json"), summary)
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        maya.standalone.uninitialize()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Select and reduce keyframes for every FBX file under a directory.")
+    parser.add_argument("input_root", help="Directory searched (recursively) for FBX files")
+    parser.add_argument("output_root", help="Directory to write outputs, per-file summaries, and the manifest to")
+    parser.add_argument("--mayapy", default="mayapy", help="Path to Maya's Python interpreter used for workers")
+    parser.add_argument("--workers", type=int, default=max(1, multiprocessing.cpu_count() // 2), help="Number of files processed at once")
+    parser.add_argument("--backend", default="numpy", choices=["opencl", "numpy", "multicore"], help="Selection backend")
+    parser.add_argument("--device", default="1.1", help="OpenCL device as platform.device (for the opencl backend)")
+    parser.add_argument("--objects", default=None, help="JSON file listing the objects for selection and reduction")
+    parser.add_argument("--save-fbx", action="store_true")
+    parser.add_argument("--save-maya-ascii", action="store_true")
+    parser.add_argument("--save-csv", action="store_true")
+    parser.add_argument("--save-npy", action="store_true", help="With --save-csv, also save each table as a .npy file")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--name", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.worker:
+        # Workers are given the FBX file and its output directory in place of the roots
+        run_in_mayapy(args)
+    else:
+        run_batch(args)
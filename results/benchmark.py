@@ -0,0 +1,219 @@
+# Benchmarks the selection and reduction steps on synthetic motion, headless.
+#
+# Run with any Python interpreter that has NumPy (Maya is not needed; a minimal
+# stand-in for the maya modules is installed when they cannot be imported):
+#
+#   python benchmark.py --frames 250 500 1000 --joints 10 25 65 --backends numpy multicore \
+#       --repeats 3 --output benchmark.json
+#
+# Every combination of frames and joints is timed for each backend, reporting
+# the seconds taken (best of the repeats), throughput in frames per second, and
+# the peak memory allocated while running (traced with tracemalloc, which also
+# sees NumPy's buffers). The reduction step is timed by fitting the tangents of
+# six curves per joint over the selection of --reduce-keyframes keyframes.
+# Results are printed as a table, one row per run, and optionally written as
+# JSON so regressions can be tracked between versions.
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = os.path.join(os.path.dirname(HERE), "scripts")
+
+
+def install_maya_stand_in():
+    """
+    Installs empty maya, maya.cmds, and maya.api modules when Maya is not
+    available, providing only what importing salient_api needs. Benchmarks
+    pass sampled animation in directly, so nothing here is called on the hot path.
+    """
+    try:
+        import maya.cmds
+        return False
+    except ImportError:
+        pass
+
+    def error(message):
+        raise RuntimeError(message)
+
+    class MFnAnimCurve(object):
+        (kTangentGlobal, kTangentFixed, kTangentLinear, kTangentFlat, kTangentSmooth, kTangentStep,
+         kTangentClamped, kTangentPlateau, kTangentStepNext, kTangentAuto) = range(10)
+        kAnimCurveTA = 0
+
+    maya = types.ModuleType("maya")
+    cmds = types.ModuleType("maya.cmds")
+    cmds.error = error
+    cmds.internalVar = lambda **flags: tempfile.gettempdir()
+    api = types.ModuleType("maya.api")
+    om = types.ModuleType("maya.api.OpenMaya")
+    oma = types.ModuleType("maya.api.OpenMayaAnim")
+    oma.MFnAnimCurve = MFnAnimCurve
+
+    maya.cmds, maya.api, api.OpenMaya, api.OpenMayaAnim = cmds, api, om, oma
+    for module in [maya, cmds, api, om, oma]:
+        sys.modules[module.__name__] = module
+    return True
+
+
+def synthetic_motion(n_frames, n_joints, noise=0.01, seed=0):
+    """
+    Generates world-space joint positions for a chain of joints, where each
+    bone swings with a few random sinusoids (plus Gaussian noise) on top of a
+    root that wanders. Returns a (n_frames, n_joints, 3) array.
+    """
+    import numpy as np
+    rng = np.random.RandomState(seed)
+    t = np.arange(n_frames, dtype=np.float64)[:, None]
+
+    def swing(n_waves, amplitude):
+        frequencies = rng.uniform(0.005, 0.08, (n_waves, 3))
+        phases = rng.uniform(0, 2 * np.pi, (n_waves, 3))
+        amplitudes = rng.uniform(0.2, 1.0, (n_waves, 3)) * amplitude
+        return sum(amplitudes[i] * np.sin(2 * np.pi * frequencies[i] * t + phases[i]) for i in range(n_waves))
+
+    root = np.cumsum(rng.normal(0, 0.05, (n_frames, 3)), axis=0) + swing(3, 5.0)
+    positions = np.empty((n_frames, n_joints, 3))
+    positions[:, 0] = root
+    for j in range(1, n_joints):
+        positions[:, j] = positions[:, j - 1] + swing(3, 2.0) + rng.normal(0, noise, (n_frames, 3))
+    return positions
+
+
+def as_anim_data(positions, start=0):
+    """
+    Lays positions out as salientSelect's flat buffer ([time, x0, y0, z0, ...]
+    per frame), returning it with the matching dimensions.
+    """
+    import numpy as np
+    n_frames, n_joints, _ = positions.shape
+    frames = np.empty((n_frames, 1 + 3 * n_joints))
+    frames[:, 0] = np.arange(start, start + n_frames)
+    frames[:, 1:] = positions.reshape(n_frames, -1)
+    dimensions = ["time"] + ["joint%d.%s" % (j, axis) for j in range(n_joints) for axis in ["tx", "ty", "tz"]]
+    return frames.ravel().tolist(), dimensions
+
+
+def measure(fn, repeats):
+    """
+    Runs fn repeatedly, returning its last result, the best time in seconds,
+    and the peak memory allocated (in bytes, None without tracemalloc).
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+
+    best, peak, result = None, None, None
+    for _ in range(repeats):
+        if tracemalloc is not None:
+            tracemalloc.start()
+        began = time.time()
+        result = fn()
+        seconds = time.time() - began
+        if tracemalloc is not None:
+            peak = max(peak or 0, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        best = seconds if best is None else min(best, seconds)
+    return result, best, peak
+
+
+def run_case(n_frames, n_joints, backend, args):
+    import numpy as np
+    import salient_api
+    import salient_engine
+    import salient_reduce
+
+    positions = synthetic_motion(n_frames, n_joints, args.noise, args.seed)
+    anim_data, dimensions = as_anim_data(positions)
+    end = n_frames - 1
+
+    def select():
+        salient_engine.reset()
+        return salient_api.select_sampled(0, 0, 0, end, anim_data, dimensions, [], backend=backend, workers=args.workers,
+            use_cache=False, max_keyframes=args.max_keyframes, single_precision=args.single_precision, table_directory=args.table_directory,
+            prune=args.prune, min_keyframes=args.min_keyframes)
+
+    selections, select_seconds, select_peak = measure(select, args.repeats)
+
+    # Reduce six curves per joint (positions and stand-in rotations) to the selection
+    lowest, highest = selections.get_keyframe_range()
+    n_keyframes = max(lowest, min(args.reduce_keyframes, highest))
+    selection = np.array(selections.get_selection(n_keyframes))
+    curves = np.concatenate([positions.reshape(n_frames, -1), np.arctan(positions.reshape(n_frames, -1))], axis=1)
+    _, reduce_seconds, reduce_peak = measure(lambda: salient_reduce.fit_tangents(curves, selection, 1.0 / 24.0), args.repeats)
+
+    return {
+        "frames" : n_frames,
+        "joints" : n_joints,
+        "dimensions" : len(dimensions),
+        "backend" : backend,
+        "select_seconds" : select_seconds,
+        "select_frames_per_second" : n_frames / select_seconds,
+        "select_peak_bytes" : select_peak,
+        "reduce_curves" : curves.shape[1],
+        "reduce_keyframes" : n_keyframes,
+        "reduce_seconds" : reduce_seconds,
+        "reduce_curves_per_second" : curves.shape[1] / reduce_seconds,
+        "reduce_peak_bytes" : reduce_peak,
+    }
+
+
+def format_bytes(n):
+    if n is None:
+        return "n/a"
+    return "%.1f MB" % (n / (1024.0 * 1024.0))
+
+
+def run_benchmark(args):
+    sys.path[:0] = [SCRIPTS]
+    stand_in = install_maya_stand_in()
+    print("Benchmarking%s" % (" (with a stand-in for maya)" if stand_in else ""))
+
+    header = "%-10s %7s %7s %6s %10s %12s %12s %10s %12s" % (
+        "backend", "frames", "joints", "dims", "select s", "frames/s", "select mem", "reduce s", "reduce mem")
+    print(header)
+    print("-" * len(header))
+
+    rows = []
+    for backend in args.backends:
+        for n_joints in args.joints:
+            for n_frames in args.frames:
+                row = run_case(n_frames, n_joints, backend, args)
+                rows.append(row)
+                print("%-10s %7d %7d %6d %10.3f %12.1f %12s %10.4f %12s" % (
+                    backend, n_frames, n_joints, row["dimensions"], row["select_seconds"], row["select_frames_per_second"],
+                    format_bytes(row["select_peak_bytes"]), row["reduce_seconds"], format_bytes(row["reduce_peak_bytes"])))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({ "arguments" : vars(args), "runs" : rows }, f, indent=2, sort_keys=True)
+    return rows
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark keyframe selection and reduction on synthetic motion.")
+    parser.add_argument("--frames", type=int, nargs="+", default=[250, 500, 1000], help="Numbers of frames to benchmark")
+    parser.add_argument("--joints", type=int, nargs="+", default=[10, 25, 65], help="Numbers of joints to benchmark")
+    parser.add_argument("--noise", type=float, default=0.01, help="Standard deviation of the noise added to each joint")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backends", nargs="+", default=["numpy"], choices=["numpy", "multicore"], help="Selection backends")
+    parser.add_argument("--workers", type=int, default=None, help="Processes for the multicore backend (all cores by default)")
+    parser.add_argument("--max-keyframes", type=int, default=None, help="Stop each selection at this many keyframes")
+    parser.add_argument("--single-precision", action="store_true", help="Store the error table in single precision")
+    parser.add_argument("--table-directory", default=None, help="Keep the error table in a memory-mapped file in this directory")
+    parser.add_argument("--prune", action="store_true", help="Skip the error table entries no selection can use")
+    parser.add_argument("--min-keyframes", type=int, default=None, help="Fewest keyframes to select (lets --prune skip more)")
+    parser.add_argument("--reduce-keyframes", type=int, default=50, help="Keyframes kept when benchmarking the reduction")
+    parser.add_argument("--repeats", type=int, default=1, help="Runs per case, keeping the fastest")
+    parser.add_argument("--output", default=None, help="JSON file to write the results to")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    run_benchmark(parse_arguments())
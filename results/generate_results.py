@@ -8,6 +8,10 @@
 # r.run_on_directory(for_selection, for_reduction, save_fbx=True, save_maya_ascii=True, save_csv=True)
 #
 
+import array
+import os
+import struct
+import sys
 from os import listdir
 from os.path import isfile, join
 
@@ -33,59 +37,83 @@ def export_meta_information(filepath, start, end, title):
     f.close()
 
 
-def export_animation_data_as_csv(filepath, objects, start, end):
+def export_animation_data_as_csv(filepath, objects, start, end, save_npy=False):
     """
-    Gets the animation data as a table, where rows are frames and columns are dimensions
+    Gets the animation data as a table, where rows are frames and columns are dimensions.
+
+    The animation is sampled in one pass and written out row by row. With save_npy,
+    the same table is also saved next to the CSV as a .npy file (float64), which
+    NumPy can load or memory-map directly.
     """
-    # Attach proxies
-    proxies = []
-    for object in objects:
-        proxy = cmds.spaceLocator()[0]
-        cmds.parentConstraint(object, proxy)
-        proxies.append(proxy)
-
-    # Create the csv header (list of dimensions)
-    header = ""
-    for object in objects:
-        header += "%s.x,%s.y,%s.z," % (object, object, object)
-    header = header[:-1] + "\n"
-
-    # Create the csv body (world-space position of proxies)    
-    body = ""
-    for i in range(start, end + 1):
-        frame = ""
-        for object in proxies:
-            x, y, z = cmds.getAttr("%s.worldMatrix" % object, time=i)[12:15]
-            frame += "%2.7f,%2.7f,%2.7f," % (x, y, z)
-        body += frame[:-1] + "\n"
-    
-    # Clean up
-    cmds.delete(proxies)
+    anim_data = salient_api.SalientPoses.get_animation_data(start, end, objects)
+    width = 1 + 3 * len(objects)
 
-    # Combine the header and body and save to file
-    csv_string = header + body
-    f = open(filepath, "w")
-    f.write(csv_string)
-    f.close()
+    with open(filepath, "w") as f:
+        # Write the csv header (list of dimensions)
+        f.write(",".join("%s.x,%s.y,%s.z" % (object, object, object) for object in objects) + "\n")
 
-def run_on_fbx_file(directory, filename, objects_for_selection, objects_for_reduction, cl_selected_device_str="", save_maya_ascii=False, save_fbx=False, save_csv=False):
+        # Write the csv body (world-space positions, skipping the time of each frame)
+        row_format = ",".join(["%2.7f"] * (width - 1)) + "\n"
+        for ix in range(0, len(anim_data), width):
+            f.write(row_format % tuple(anim_data[ix + 1:ix + width]))
 
-    # Choose OpenCL device
-    if cl_selected_device_str == "":
-        cl_selected_device_str = salient_utils.Prompt.get_string("Choose OpenCL device", "Enter device index:")
-        if cl_selected_device_str is None:
-            return
-        else:
-            cl_selected_device_str = cl_selected_device_str
-    cl_platform_ix_str, cl_device_ix_str = cl_selected_device_str.split(".")
-    cl_platform_ix = int(cl_platform_ix_str)
-    cl_device_ix = int(cl_device_ix_str)
+    if save_npy:
+        table = array.array("d")
+        for ix in range(0, len(anim_data), width):
+            table.extend(anim_data[ix + 1:ix + width])
+        export_array_as_npy(os.path.splitext(filepath)[0] + ".npy", table, (end - start + 1, width - 1))
+
+def export_array_as_npy(filepath, values, shape):
+    """
+    Writes an array.array of doubles as a 2D .npy file (format version 1.0)
+    without requiring NumPy.
+    """
+    descr = "<f8" if sys.byteorder == "little" else ">f8"
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d, %d), }" % (descr, shape[0], shape[1])
+
+    # Pad the header with spaces so that the data starts on a 64-byte boundary
+    header += " " * (63 - (10 + len(header)) % 64) + "\n"
+    with open(filepath, "wb") as f:
+        f.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1"))
+        values.tofile(f)
+
+def run_on_fbx_file(directory, filename, objects_for_selection, objects_for_reduction, cl_selected_device_str="", save_maya_ascii=False, save_fbx=False, save_csv=False,
+    backend="opencl", output_directory=None, reimport=False, save_npy=False, workers=None):
+    """
+    Selects keyframes for the FBX file and saves reductions at four levels of
+    compression, writing outputs to output_directory (the FBX's own directory by
+    default). Returns a summary of the range and each reduction.
+
+    The FBX is imported and baked once, and the baked animation is restored from
+    an in-memory snapshot before each reduction (or, with reimport, the FBX is
+    imported again for each reduction). Objects given as None default to every
+    joint in the imported scene, and workers is passed to select_keyframes.
+    """
+    if output_directory is None:
+        output_directory = directory
+
+    # Choose OpenCL device (not needed for the CPU backends)
+    cl_platform_ix, cl_device_ix = 0, 0
+    if backend == "opencl":
+        if cl_selected_device_str == "":
+            cl_selected_device_str = salient_utils.Prompt.get_string("Choose OpenCL device", "Enter device index:")
+            if cl_selected_device_str is None:
+                return
+            else:
+                cl_selected_device_str = cl_selected_device_str
+        cl_platform_ix_str, cl_device_ix_str = cl_selected_device_str.split(".")
+        cl_platform_ix = int(cl_platform_ix_str)
+        cl_device_ix = int(cl_device_ix_str)
 
     # Start a new file
     cmds.file(new=True, force=True)
 
     # Import the fbx
     mel.eval("FBXImport -file \"%s/%s\"" % (directory, filename))
+    if objects_for_selection is None:
+        objects_for_selection = cmds.ls(type="joint")
+    if objects_for_reduction is None:
+        objects_for_reduction = cmds.ls(type="joint")
     
     # Get the start and end frame from the timeline
     start = int(cmds.playbackOptions(query=True, minTime=True))
@@ -93,24 +121,21 @@ def run_on_fbx_file(directory, filename, objects_for_selection, objects_for_redu
 
     if save_maya_ascii:
         # Save the original as a Maya ASCII file
-        cmds.file(rename=directory + "/%s-%d-keyframes.ma" % (filename, end - start + 1))
+        cmds.file(rename=output_directory + "/%s-%d-keyframes.ma" % (filename, end - start + 1))
         cmds.file(save=True, type='mayaAscii')
 
     cmds.bakeResults(objects_for_reduction, t=(start, end), sampleBy=1, minimizeRotation=True, preserveOutsideKeys=True)
+    snapshot = salient_api.AnimationSnapshot(objects_for_reduction)
 
     if save_csv:
         # Save the original as a CSV file
         title = filename.replace(".fbx", "").replace("_", " ")
-        export_meta_information(directory + "/meta.csv", start, end, title)
-        export_animation_data_as_csv(directory + "/%s-%d-keyframes.csv" % (filename, end - start + 1), objects_for_selection, start, end)
+        export_meta_information(output_directory + "/meta.csv", start, end, title)
+        export_animation_data_as_csv(output_directory + "/%s-%d-keyframes.csv" % (filename, end - start + 1), objects_for_selection, start, end, save_npy)
 
     if save_fbx:
         # Save the original version as an FBX    
-        mel.eval("FBXExport -f \"%s\"" % (directory + "/%s-%d-keyframes.fbx" % (filename, end - start + 1)))
-
-    # Perform selection
-    cmds.select(objects_for_selection, replace=True)
-    selections = salient_api.select_keyframes(cl_platform_ix, cl_device_ix, start, end, []) # no fixed keyframes
+        mel.eval("FBXExport -f \"%s\"" % (output_directory + "/%s-%d-keyframes.fbx" % (filename, end - start + 1)))
 
     # Set choices of keyframes for compression @ 80%, 90%, 95%, and 97.5%
     n_frames = end - start + 1
@@ -120,6 +145,12 @@ def run_on_fbx_file(directory, filename, objects_for_selection, objects_for_redu
         int(round(n_frames * 0.05)),
         int(round(n_frames * 0.025)),
     ]
+
+    # Perform selection, stopping at the largest number of keyframes needed
+    cmds.select(objects_for_selection, replace=True)
+    selections = salient_api.select_keyframes(cl_platform_ix, cl_device_ix, start, end, [], # no fixed keyframes
+        max_keyframes=max(choices_of_n_keyframes), backend=backend, workers=workers)
+    summary = { "start" : start, "end" : end, "n_frames" : n_frames, "reductions" : [] }
     
     # Perform each reduction
     for n_keyframes in choices_of_n_keyframes:
@@ -127,9 +158,13 @@ def run_on_fbx_file(directory, filename, objects_for_selection, objects_for_redu
         # Skip the selection if too few keyframes
         if n_keyframes <= 2: continue
 
-        # Create a new file and import the fbx
-        cmds.file(new=True, force=True)
-        mel.eval("FBXImport -file \"%s/%s\"" % (directory, filename))
+        if reimport:
+            # Create a new file and import the fbx
+            cmds.file(new=True, force=True)
+            mel.eval("FBXImport -file \"%s/%s\"" % (directory, filename))
+        else:
+            # Return to the baked animation
+            snapshot.restore()
         
         # Perform the reduction
         selection = selections[n_keyframes]["selection"]
@@ -143,7 +178,7 @@ def run_on_fbx_file(directory, filename, objects_for_selection, objects_for_redu
         
         if save_maya_ascii:
             # Save the compressed version as a Maya ASCII
-            cmds.file(rename=directory + "/%s-%d-keyframes.ma" % (filename, n_keyframes))
+            cmds.file(rename=output_directory + "/%s-%d-keyframes.ma" % (filename, n_keyframes))
             cmds.file(save=True, type='mayaAscii')
 
         # Bake the result
@@ -151,11 +186,15 @@ def run_on_fbx_file(directory, filename, objects_for_selection, objects_for_redu
 
         if save_csv:
             # Save the compressed version as a CSV
-            export_animation_data_as_csv(directory + "/%s-%d-keyframes.csv" % (filename, n_keyframes), objects_for_selection, start, end)
+            export_animation_data_as_csv(output_directory + "/%s-%d-keyframes.csv" % (filename, n_keyframes), objects_for_selection, start, end, save_npy)
 
         if save_fbx:
             # Save the compressed version as an FBX    
-            mel.eval("FBXExport -f \"%s\"" % (directory + "/%s-%d-keyframes.fbx" % (filename, n_keyframes)))
+            mel.eval("FBXExport -f \"%s\"" % (output_directory + "/%s-%d-keyframes.fbx" % (filename, n_keyframes)))
+
+        summary["reductions"].append({ "n_keyframes" : n_keyframes, "compression" : compression, "error" : selections[n_keyframes]["error"] })
+
+    return summary
 
 
 def run_on_directory(objects_for_selection, objects_for_reduction, directory="", cl_selected_device_str="",
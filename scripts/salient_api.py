@@ -1,4 +1,28 @@
+import array
+import collections
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+import time
+
 import maya.cmds as cmds
+import maya.api.OpenMaya as om
+import maya.api.OpenMayaAnim as oma
+
+import salient_cache
+import salient_curves
+import salient_selections
+
+CPU_BACKENDS = ["numpy", "multicore"]
+PLUGIN = "SalientPosesMaya"
+
+# NumPy is not bundled with every version of Maya, so numpy, salient_engine,
+# and salient_reduce are only imported inside the functions that use them
 
 class SalientPoses:
 
@@ -10,61 +34,800 @@ class SalientPoses:
         return dimensions
     
     @staticmethod
-    def get_animation_data(start, end):
-        sel = cmds.ls(selection=True)
-
-        # Attach proxies
-        proxies = []
-        for object in sel:
-            proxy = cmds.spaceLocator()[0]
-            cmds.parentConstraint(object, proxy)
-            proxies.append(proxy)
-
-        # Get world-space position of proxies
-        anim_data = []
+    def get_world_matrix_plugs(objects):
+        plugs = []
+        for object in objects:
+            node = om.MGlobal.getSelectionListByName(object).getDependNode(0)
+            plugs.append(om.MFnDependencyNode(node).findPlug("worldMatrix", False).elementByLogicalIndex(0))
+        return plugs
+
+    @staticmethod
+    def get_animation_data(start, end, objects=None):
+        """
+        Samples the world-space translation of every selected object (or of the
+        given objects), stepping through the frame range once and reading all
+        objects at each time-step.
+
+        The result is a preallocated flat list laid out frame by frame as
+        [time, x0, y0, z0, x1, y1, z1, ...], which is passed as-is to salientSelect.
+        """
+        plugs = SalientPoses.get_world_matrix_plugs(cmds.ls(selection=True) if objects is None else objects)
+        frame_width = 1 + 3 * len(plugs)
+        anim_data = [0.0] * ((end - start + 1) * frame_width)
+
+        time_unit = om.MTime.uiUnit()
+        ix = 0
         for i in range(start, end + 1):
-            anim_data += [float(i)]
-            for object in proxies:
-                anim_data += cmds.getAttr("%s.worldMatrix" % object, time=i)[12:15]
-        
-        # Clean up
-        cmds.delete(proxies)
-        cmds.select(sel, replace=True)
+            context = om.MDGContext(om.MTime(i, time_unit))
+            anim_data[ix] = float(i)
+            ix += 1
+            for plug in plugs:
+                matrix = om.MFnMatrixData(plug.asMObject(context)).matrix()
+                anim_data[ix:ix + 3] = matrix[12], matrix[13], matrix[14]
+                ix += 3
         return anim_data
 
-def select_keyframes(cl_platform_ix, cl_device_ix, start, end, fixed_keyframes):
-    anim_data = SalientPoses.get_animation_data(start, end)
-    dimensions = SalientPoses.get_dimensions()
-
-    # Select
-    cmds.loadPlugin("SalientPosesMaya")
-    result = cmds.salientSelect(
-        cl_platform_ix, cl_device_ix,
-        start, end,
-        anim_data, dimensions, fixed_keyframes
-    )
-    cmds.unloadPlugin("SalientPosesMaya")
-    
-    # Compile selections from result
-    selections = {}
-    for line in result.split("\n"):
-        if line != "":
-            errorString, selectionString = line.split("|")
-            error = float(errorString)
-            selection = [int(v) for v in selectionString.split(",")]
-            n_keyframes = len(selection)
-            selections[n_keyframes] = { "selection" : selection, "error" : error }
-    return selections
-
-def reduce_keyframes(selection):
+def internal_scale(fn):
+    """
+    Size of one of the scene's UI units in internal units, for the values of
+    the animation curve (radians per UI angle unit, centimetres per UI distance
+    unit, or 1 for unitless curves).
+    """
+    if fn.animCurveType == oma.MFnAnimCurve.kAnimCurveTA:
+        return om.MAngle(1.0, om.MAngle.uiUnit()).asRadians()
+    if fn.animCurveType == oma.MFnAnimCurve.kAnimCurveTL:
+        return om.MDistance(1.0, om.MDistance.uiUnit()).asCentimeters()
+    return 1.0
+
+class AnimationSnapshot:
+    """
+    In-memory copy of every key (time, value, tangents, and locks) on the
+    animation curves driving the given objects. Each property of a curve is
+    fetched with a single query, and each curve is rebuilt in one edit.
+    """
+
+    TANGENT_TYPES = {
+        "global" : oma.MFnAnimCurve.kTangentGlobal,
+        "fixed" : oma.MFnAnimCurve.kTangentFixed,
+        "linear" : oma.MFnAnimCurve.kTangentLinear,
+        "flat" : oma.MFnAnimCurve.kTangentFlat,
+        "spline" : oma.MFnAnimCurve.kTangentSmooth,
+        "step" : oma.MFnAnimCurve.kTangentStep,
+        "clamped" : oma.MFnAnimCurve.kTangentClamped,
+        "plateau" : oma.MFnAnimCurve.kTangentPlateau,
+        "stepnext" : oma.MFnAnimCurve.kTangentStepNext,
+        "auto" : oma.MFnAnimCurve.kTangentAuto,
+    }
+
+    def __init__(self, objects):
+        self.curves = {}
+        for object in objects:
+            for curve in cmds.listConnections(object, type="animCurve", source=True, destination=False) or []:
+                self.curves[curve] = AnimationSnapshot.save_curve(curve)
+
+    @staticmethod
+    def save_curve(curve):
+        times = cmds.keyframe(curve, query=True, timeChange=True)
+        if times is None:
+            return None
+
+        def tangents(**flags):
+            return cmds.keyTangent(curve, query=True, **flags)
+
+        return {
+            "times" : array.array("d", times),
+            "values" : array.array("d", cmds.keyframe(curve, query=True, valueChange=True)),
+            "in_angles" : array.array("d", tangents(inAngle=True)),
+            "out_angles" : array.array("d", tangents(outAngle=True)),
+            "in_weights" : array.array("d", tangents(inWeight=True)),
+            "out_weights" : array.array("d", tangents(outWeight=True)),
+            "in_types" : tangents(inTangentType=True),
+            "out_types" : tangents(outTangentType=True),
+            "locks" : tangents(lock=True),
+            "weight_locks" : tangents(weightLock=True),
+            "weighted" : tangents(weightedTangents=True)[0],
+        }
+
+    @staticmethod
+    def restore_curve(curve, data):
+        if data is None:
+            cmds.cutKey(curve, clear=True)
+            return
+
+        # The snapshot is in UI units, so values (and tangents' heights) are
+        # scaled to internal units, and angles are converted from the UI's unit
+        fn = oma.MFnAnimCurve(om.MGlobal.getSelectionListByName(curve).getDependNode(0))
+        time_unit = om.MTime.uiUnit()
+        angle_unit = om.MAngle.uiUnit()
+        scale = internal_scale(fn)
+
+        def tangents(angles, weights):
+            radians = [om.MAngle(a, angle_unit).asRadians() for a in angles]
+            return (om.MDoubleArray([w * math.cos(a) for (a, w) in zip(radians, weights)]),
+                om.MDoubleArray([w * math.sin(a) * scale for (a, w) in zip(radians, weights)]))
+
+        def types(names):
+            return om.MIntArray([AnimationSnapshot.TANGENT_TYPES.get(t, oma.MFnAnimCurve.kTangentFixed) for t in names])
+
+        # Replace every key, with its tangents and locks, in one edit
+        in_x, in_y = tangents(data["in_angles"], data["in_weights"])
+        out_x, out_y = tangents(data["out_angles"], data["out_weights"])
+        fn.setIsWeighted(data["weighted"])
+        fn.addKeysWithTangents(om.MTimeArray([om.MTime(t, time_unit) for t in data["times"]]),
+            om.MDoubleArray([v * scale for v in data["values"]]),
+            tangentInTypeArray=types(data["in_types"]), tangentOutTypeArray=types(data["out_types"]),
+            tangentInXArray=in_x, tangentInYArray=in_y, tangentOutXArray=out_x, tangentOutYArray=out_y,
+            tangentsLockArray=om.MIntArray([int(l) for l in data["locks"]]),
+            weightsLockArray=om.MIntArray([int(l) for l in data["weight_locks"]]),
+            convertUnits=False, keepExistingKeys=False)
+
+    def restore(self):
+        for (curve, data) in self.curves.items():
+            AnimationSnapshot.restore_curve(curve, data)
+
+    def nbytes(self):
+        """
+        Approximate memory held by the snapshot's keys.
+        """
+        total = 0
+        for data in self.curves.values():
+            if data is not None:
+                total += sum(v.itemsize * len(v) for v in data.values() if isinstance(v, array.array))
+                total += 8 * (len(data["in_types"]) + len(data["out_types"]) + len(data["locks"]) + len(data["weight_locks"]))
+        return total
+
+    def dump(self, path):
+        with open(path, "wb") as f:
+            pickle.dump(self.curves, f, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        snapshot = AnimationSnapshot([])
+        with open(path, "rb") as f:
+            snapshot.curves = pickle.load(f)
+        return snapshot
+
+class PluginSession:
+    """
+    Keeps the plug-in loaded across commands instead of loading and unloading
+    it around each one. While it is loaded, salientSelect keeps the OpenCL
+    platform and device it last used, so later evaluations on the same device
+    skip selecting them. Call acquire() before running a command and release()
+    to unload the plug-in.
+    """
+
+    _instance = None
+
+    @staticmethod
+    def get():
+        if PluginSession._instance is None:
+            PluginSession._instance = PluginSession()
+        return PluginSession._instance
+
+    def acquire(self):
+        if not cmds.pluginInfo(PLUGIN, query=True, loaded=True):
+            cmds.loadPlugin(PLUGIN)
+
+    def release(self):
+        if cmds.pluginInfo(PLUGIN, query=True, loaded=True):
+            cmds.unloadPlugin(PLUGIN)
+
+    def time_saved(self):
+        """
+        Seconds of OpenCL set-up (selecting the platform and device) that
+        salientSelect has skipped by reusing a device since the plug-in was loaded,
+        as measured by the plug-in.
+        """
+        if not cmds.pluginInfo(PLUGIN, query=True, loaded=True):
+            return 0.0
+        return cmds.salientOpenCLInfo(secondsSaved=True)
+
+class Profile:
+    """
+    Opt-in record of the time spent in (and bytes handled by) each stage of a
+    selection or reduction, e.g. { "sampling" : { "seconds" : 0.8, "bytes" : 960000 } },
+    along with a count of entries where a stage has one (e.g. error table entries skipped).
+    Stages timed inside the plug-in's commands are included under the command's
+    name (e.g. "salientSelect.analysis"). Pass a Profile to select_keyframes or
+    reduce_keyframes; with log, the commands also log their own summary.
+    """
+
+    def __init__(self, log=False, enabled=True):
+        self.log = log
+        self.enabled = enabled
+        self.stages = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        began = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, seconds=time.time() - began)
+
+    def add(self, name, seconds=0.0, bytes=0, entries=0):
+        entry = self.stages.setdefault(name, { "seconds" : 0.0, "bytes" : 0 })
+        entry["seconds"] += seconds
+        entry["bytes"] += bytes
+        if entries > 0:
+            entry["entries"] = entry.get("entries", 0) + entries
+
+    def merge(self, prefix, stages):
+        for (name, entry) in stages.items():
+            self.add("%s.%s" % (prefix, name), entry["seconds"], int(entry["bytes"]), int(entry.get("entries", 0)))
+
+    def level(self):
+        """
+        Profiling level passed to the plug-in's commands (0 when disabled).
+        """
+        if not self.enabled:
+            return 0
+        return 2 if self.log else 1
+
+    def as_dict(self):
+        return dict((name, dict(entry)) for (name, entry) in self.stages.items())
+
+    def summary(self):
+        lines = ["%-28s %10s %14s %14s" % ("stage", "seconds", "bytes", "entries")]
+        for (name, entry) in self.stages.items():
+            entries = "%14d" % entry["entries"] if "entries" in entry else "%14s" % "-"
+            lines.append("%-28s %10.4f %14d %s" % (name, entry["seconds"], entry["bytes"], entries))
+        return "\n".join(lines)
+
+_cache = None
+def get_cache():
+    """
+    Returns the selection cache, stored in the directory named by the
+    SALIENT_POSES_CACHE environment variable or otherwise in Maya's user directory.
+    """
+    global _cache
+    if _cache is None:
+        directory = os.environ.get("SALIENT_POSES_CACHE", "")
+        if directory == "":
+            directory = os.path.join(cmds.internalVar(userAppDir=True), "salientPosesCache")
+        _cache = salient_cache.SelectionCache(directory)
+    return _cache
+
+def select_keyframes(cl_platform_ix, cl_device_ix, start, end, fixed_keyframes, backend="opencl", workers=None, use_cache=True,
+    max_keyframes=None, max_error=None, window=None, overlap=None, profile=None, pca_variance=None, coarse_factor=None,
+    single_precision=False, table_directory=None, prune=False, min_keyframes=None):
+    """
+    Computes the selections for the selected objects over the range, returning a
+    SelectionTable. The backend is "opencl" (the plug-in, on the given OpenCL
+    platform and device), "numpy", or "multicore" (filling the error table across
+    `workers` processes); the other options are described in select_sampled.
+    """
+    profile = profile if profile is not None else Profile(enabled=False)
+    with profile.stage("sampling"):
+        anim_data = SalientPoses.get_animation_data(start, end)
+        dimensions = SalientPoses.get_dimensions()
+    profile.add("sampling", bytes=8 * len(anim_data))
+    return select_sampled(cl_platform_ix, cl_device_ix, start, end, anim_data, dimensions, fixed_keyframes, backend, workers, use_cache,
+        max_keyframes, max_error, window, overlap, profile=profile, pca_variance=pca_variance, coarse_factor=coarse_factor,
+        single_precision=single_precision, table_directory=table_directory, prune=prune, min_keyframes=min_keyframes)
+
+def select_sampled(cl_platform_ix, cl_device_ix, start, end, anim_data, dimensions, fixed_keyframes, backend="opencl", workers=None, use_cache=True,
+    max_keyframes=None, max_error=None, window=None, overlap=None, progress=None, profile=None, pca_variance=None, coarse_factor=None,
+    single_precision=False, table_directory=None, prune=False, min_keyframes=None):
+    """
+    As select_keyframes, but for animation already sampled with
+    SalientPoses.get_animation_data. With a CPU backend this makes no Maya calls
+    (once get_cache has been called), so it may run on a background thread,
+    reporting to `progress` (see salient_engine.report).
+
+    The selection stops at max_keyframes or at the first selection within
+    max_error. For the other options, see salient_selections.select_windowed
+    (window), salient_engine.principal_components (pca_variance),
+    salient_engine.select_multiresolution (coarse_factor), and compute_selections.
+    """
+    check_min_keyframes(min_keyframes, start, end)
+    width = len(dimensions)
+    profile = profile if profile is not None else Profile(enabled=False)
+    table = { "single_precision" : single_precision, "table_directory" : table_directory, "prune" : prune, "min_keyframes" : min_keyframes }
+
+    def select_range(range_start, range_end, range_fixed_keyframes, range_max_keyframes=None, range_max_error=None):
+        range_anim_data = anim_data[(range_start - start) * width:(range_end - start + 1) * width]
+
+        def compute():
+            if pca_variance is None and coarse_factor is None:
+                return compute_selections(cl_platform_ix, cl_device_ix, range_start, range_end, range_anim_data, dimensions, range_fixed_keyframes,
+                    backend, workers, range_max_keyframes, range_max_error, progress, profile, **table)
+
+            # The projection and the coarse grid understate the errors reported,
+            # so max_error is checked against those, selecting further until met
+            def compute_approximate(approximate_max_keyframes, approximate_max_error):
+                if coarse_factor is not None:
+                    return compute_refined(range_start, range_end, range_anim_data, range_fixed_keyframes, approximate_max_keyframes,
+                        approximate_max_error)
+                return compute_projected(range_start, range_end, range_anim_data, range_fixed_keyframes, approximate_max_keyframes,
+                    approximate_max_error)
+            return select_within_error(compute_approximate, range_end - range_start + 1, range_max_keyframes, range_max_error)
+
+        # Refined results are not cached, as their error bounds would not survive the cache
+        if not use_cache or coarse_factor is not None:
+            return compute()
+
+        with profile.stage("cache"):
+            key = cache_key(backend, range_anim_data, dimensions, range_start, range_end, range_fixed_keyframes, range_max_keyframes,
+                range_max_error, pca_variance, single_precision, table["min_keyframes"])
+            selections = get_cache().load(key)
+        if selections is None:
+            selections = compute()
+            with profile.stage("cache"):
+                get_cache().store(key, selections)
+        return selections
+
+    def compute_projected(range_start, range_end, range_anim_data, range_fixed_keyframes, range_max_keyframes, range_max_error):
+        # Select on the projection, then measure each selection's error over every dimension
+        import salient_engine
+        frames = salient_engine.as_frames(range_anim_data, dimensions)
+        with profile.stage("projection"):
+            projected, _ = salient_engine.principal_components(frames, pca_variance)
+        selections = compute_selections(cl_platform_ix, cl_device_ix, range_start, range_end, projected.ravel().tolist(),
+            projected_dimensions(projected.shape[1]), range_fixed_keyframes, backend, workers, range_max_keyframes, range_max_error, progress, profile,
+            **table)
+        with profile.stage("rescoring"):
+            return salient_engine.rescore(selections, frames, offset=range_start)
+
+    def compute_refined(range_start, range_end, range_anim_data, range_fixed_keyframes, range_max_keyframes, range_max_error):
+        import salient_engine
+        frames = salient_engine.as_frames(range_anim_data, dimensions)
+        selected_frames, selected_dimensions = frames, dimensions
+        if pca_variance is not None:
+            with profile.stage("projection"):
+                selected_frames, _ = salient_engine.principal_components(frames, pca_variance)
+            selected_dimensions = projected_dimensions(selected_frames.shape[1])
+
+        # Select on the grid's frames with any backend, with keyframes as indices into the grid
+        grid, grid_fixed_keyframes = salient_engine.coarse_grid(frames.shape[0], coarse_factor,
+            [f - range_start for f in range_fixed_keyframes])
+        coarse = compute_selections(cl_platform_ix, cl_device_ix, 0, len(grid) - 1, selected_frames[grid].ravel().tolist(),
+            selected_dimensions, grid_fixed_keyframes, backend, workers, range_max_keyframes, range_max_error, progress, profile, **table)
+        with profile.stage("refinement"):
+            selections = salient_engine.refine_selections(selected_frames, coarse, grid, coarse_factor, range_fixed_keyframes, range_start,
+                progress)
+        if pca_variance is None:
+            return selections
+
+        # The bounds hold for the projection only, so only the trivial bound is kept
+        with profile.stage("rescoring"):
+            rescored = salient_engine.rescore(selections, frames, offset=range_start)
+        rescored.lower_bounds = [0.0] * len(rescored.counts)
+        return rescored
+
+    if window is not None and end - start + 1 > window:
+        # The fewest keyframes wanted is over the whole take, not each chunk
+        table["min_keyframes"] = None
+        selections = salient_selections.select_windowed(select_range, anim_data, width, start, end, fixed_keyframes,
+            window, overlap, max_keyframes, max_error)
+        return selections if min_keyframes is None else selections.at_least(min_keyframes)
+    return select_range(start, end, fixed_keyframes, max_keyframes, max_error)
+
+def check_min_keyframes(min_keyframes, start, end):
+    if min_keyframes is not None and not 2 <= min_keyframes <= end - start + 1:
+        raise ValueError("min_keyframes must be from 2 to the %d frames of %d-%d, not %d" % (end - start + 1, start, end, min_keyframes))
+
+def select_within_error(select, n_frames, max_keyframes=None, max_error=None):
+    """
+    Runs select(max_keyframes, max_error), for a selection whose reported errors
+    can exceed those it stops on (e.g. a projection's, rescored over every
+    dimension). Until the last selection is within max_error, selections of
+    twice as many keyframes are made (up to max_keyframes), and the result ends
+    at the first within max_error, as an exact selection would.
+    """
+    selections = select(max_keyframes, max_error)
+    if max_error is None:
+        return selections
+    cap = min(max_keyframes or n_frames, n_frames)
+    last = selections.get_keyframe_range()[1]
+    while selections.get_error(last) > max_error and last < cap:
+        selections = select(min(2 * last, cap), None)
+        if selections.get_keyframe_range()[1] <= last:
+            break
+        last = selections.get_keyframe_range()[1]
+    return selections.up_to_error(max_error)
+
+def projected_dimensions(width):
+    return ["time"] + ["pc%d" % i for i in range(width - 1)]
+
+def compare_projection(start, end, fixed_keyframes, pca_variance=0.99, backend="numpy", workers=None, cl_platform_ix=0, cl_device_ix=0,
+    anim_data=None, dimensions=None):
+    """
+    Selects both on every dimension and on the principal components explaining
+    pca_variance of the sampled poses, reporting how much faster the projection
+    is and how much worse its selections are, e.g.
+
+        { "dimensions" : 193, "components" : 12, "explained_variance" : 0.991,
+          "full_seconds" : 8.1, "projected_seconds" : 0.9, "speedup" : 9.0,
+          "max_error_drift" : 0.08, "mean_error_drift" : 0.02 }
+
+    where the drift for each number of keyframes is the error of the projected
+    selection (measured over every dimension) relative to the optimal error.
+    """
+    import salient_engine
+    if anim_data is None:
+        anim_data = SalientPoses.get_animation_data(start, end)
+        dimensions = SalientPoses.get_dimensions()
+    frames = salient_engine.as_frames(anim_data, dimensions)
+
+    began = time.time()
+    full = compute_selections(cl_platform_ix, cl_device_ix, start, end, anim_data, dimensions, fixed_keyframes, backend, workers)
+    full_seconds = time.time() - began
+
+    began = time.time()
+    projected, explained = salient_engine.principal_components(frames, pca_variance)
+    selections = compute_selections(cl_platform_ix, cl_device_ix, start, end, projected.ravel().tolist(), projected_dimensions(projected.shape[1]),
+        fixed_keyframes, backend, workers)
+    projected_seconds = time.time() - began
+    rescored = salient_engine.rescore(selections, frames, offset=start)
+
+    drifts = []
+    for n in full.keys():
+        if n in rescored and full.get_error(n) > 0:
+            drifts.append(rescored.get_error(n) / full.get_error(n) - 1.0)
+    return {
+        "dimensions" : frames.shape[1] - 1,
+        "components" : projected.shape[1] - 1,
+        "explained_variance" : explained,
+        "full_seconds" : full_seconds,
+        "projected_seconds" : projected_seconds,
+        "speedup" : full_seconds / max(projected_seconds, 1e-9),
+        "max_error_drift" : max(drifts) if len(drifts) > 0 else 0.0,
+        "mean_error_drift" : sum(drifts) / len(drifts) if len(drifts) > 0 else 0.0,
+    }
+
+def iter_selections(cl_platform_ix, cl_device_ix, start, end, fixed_keyframes, backend="numpy", workers=None, use_cache=True,
+    max_keyframes=None, max_error=None, anim_data=None, dimensions=None, progress=None, single_precision=False, table_directory=None,
+    prune=False, min_keyframes=None, window=None, overlap=None, pca_variance=None, coarse_factor=None):
+    """
+    Yields (n_keyframes, error, selection) for the selected objects as each
+    selection is computed, from the fewest keyframes up, so results can be
+    shown (or the selection abandoned) before the whole run ends. The options
+    are those of select_sampled, and give the same selections.
+
+    Give anim_data and dimensions to use animation already sampled with
+    SalientPoses, in which case a CPU backend makes no Maya calls (once
+    get_cache has been called). Only a CPU selection of the whole range on
+    every dimension is streamed: with the "opencl" backend, a window,
+    pca_variance or coarse_factor, or when the result is cached, every
+    selection is computed first (by select_sampled) and then yielded in turn.
+    Completed runs are stored in the cache.
+    """
+    check_min_keyframes(min_keyframes, start, end)
+    if anim_data is None:
+        anim_data = SalientPoses.get_animation_data(start, end)
+        dimensions = SalientPoses.get_dimensions()
+
+    windowed = window is not None and end - start + 1 > window
+    if backend not in CPU_BACKENDS or windowed or pca_variance is not None or coarse_factor is not None:
+        selections = select_sampled(cl_platform_ix, cl_device_ix, start, end, anim_data, dimensions, fixed_keyframes, backend, workers,
+            use_cache, max_keyframes, max_error, window, overlap, progress, pca_variance=pca_variance, coarse_factor=coarse_factor,
+            single_precision=single_precision, table_directory=table_directory, prune=prune, min_keyframes=min_keyframes)
+        for n in selections.keys():
+            yield n, selections.get_error(n), selections.get_selection(n)
+        return
+
+    key = cache_key(backend, anim_data, dimensions, start, end, fixed_keyframes, max_keyframes, max_error,
+        single_precision=single_precision, min_keyframes=min_keyframes)
+    selections = get_cache().load(key) if use_cache else None
+    if selections is not None:
+        for n in selections.keys():
+            yield n, selections.get_error(n), selections.get_selection(n)
+        return
+
+    import salient_engine
+    selections = salient_selections.SelectionTable.empty()
+    for (n, error, selection) in salient_engine.iter_selections(anim_data, dimensions, start, end, fixed_keyframes,
+        cpu_workers(backend, workers), max_keyframes, max_error, progress, dtype=table_dtype(single_precision), directory=table_directory,
+        prune=prune, min_keyframes=min_keyframes):
+        selections.append(n, error, selection)
+        yield n, error, selection
+    if use_cache:
+        get_cache().store(key, selections)
+
+def cache_key(backend, anim_data, dimensions, start, end, fixed_keyframes, max_keyframes=None, max_error=None, pca_variance=None,
+    single_precision=False, min_keyframes=None):
+    """
+    Key of the selections over a range in the cache, shared by select_sampled
+    and iter_selections so that either finds what the other stored. Results of
+    the OpenCL backend are kept apart from those of the CPU backends, as ties
+    can be broken differently in single precision.
+    """
+    return salient_cache.make_key(anim_data, dimensions, start, end, fixed_keyframes, max_keyframes, max_error, pca_variance,
+        single_precision, min_keyframes, backend)
+
+def release_error_table():
+    """
+    Frees the error table the CPU backends keep from the last selection so the
+    next can reuse its entries (see salient_engine.prepare). The table can take
+    hundreds of megabytes of memory or disk, so call this once done selecting.
+    """
+    salient_engine = sys.modules.get("salient_engine")
+    if salient_engine is not None:
+        salient_engine.reset()
+
+def multicore_available():
+    """
+    Whether the "multicore" backend can run inside Maya's interface, which needs
+    its workers spawned rather than forked (see salient_engine.spawns_workers).
+    """
+    try:
+        import salient_engine
+    except ImportError:
+        return False
+    return salient_engine.spawns_workers()
+
+def cpu_workers(backend, workers=None):
+    """
+    Number of processes used by a CPU backend to fill the error table.
+    """
+    if backend == "numpy":
+        return 1
+    return workers if workers is not None else multiprocessing.cpu_count()
+
+def table_dtype(single_precision):
+    """
+    NumPy type of the entries of the error table filled by a CPU backend.
+    """
+    import numpy as np
+    return np.float32 if single_precision else np.float64
+
+def compute_selections(cl_platform_ix, cl_device_ix, start, end, anim_data, dimensions, fixed_keyframes, backend="opencl", workers=None,
+    max_keyframes=None, max_error=None, progress=None, profile=None, single_precision=False, table_directory=None, prune=False,
+    min_keyframes=None):
+    """
+    Selects over the range on one backend. The CPU backends hold the error table
+    in double precision, or single_precision to halve its size, in memory or in
+    a memory-mapped file in table_directory; with prune they skip the entries no
+    selection can use, most of all when selections of fewer than min_keyframes
+    are left out (see salient_engine.prepare). The "opencl" backend does neither.
+    """
+    profile = profile if profile is not None else Profile(enabled=False)
+    if backend in CPU_BACKENDS:
+        import salient_engine
+        with profile.stage("analysis"):
+            manager = salient_engine.prepare(anim_data, dimensions, start, end, fixed_keyframes, cpu_workers(backend, workers), progress,
+                dtype=table_dtype(single_precision), directory=table_directory, prune=prune, min_keyframes=min_keyframes)
+        profile.add("analysis", bytes=manager.table.nbytes)
+        if prune:
+            profile.add("analysis.skipped", entries=manager.skipped_entries)
+        with profile.stage("selection"):
+            manager.increment_until_n_keyframes(max_keyframes or manager.n_frames, max_error, progress)
+        with profile.stage("output"):
+            return manager.as_table(offset=start)
+    elif backend != "opencl":
+        cmds.error("Unknown selection backend '%s'" % backend)
+
+    # Select, with the plug-in writing the selections to a binary file
+    handle, output_path = tempfile.mkstemp(suffix=".sel")
+    os.close(handle)
+    profile_path = output_path + ".profile.json"
+    try:
+        with profile.stage("command"):
+            PluginSession.get().acquire()
+            cmds.salientSelect(
+                cl_platform_ix, cl_device_ix,
+                start, end,
+                anim_data, dimensions, fixed_keyframes,
+                output_path,
+                max_keyframes or -1,
+                -1.0 if max_error is None else max_error,
+                profile.level()
+            )
+        if os.path.isfile(profile_path):
+            with open(profile_path) as f:
+                profile.merge("salientSelect", json.load(f))
+        with profile.stage("parsing"):
+            with open(output_path, "rb") as f:
+                selections = salient_selections.SelectionTable.read(f)
+        profile.add("parsing", bytes=os.path.getsize(output_path))
+        return selections
+    finally:
+        os.remove(output_path)
+        if os.path.isfile(profile_path):
+            os.remove(profile_path)
+
+def reduce_keyframes(selection, batched=False, profile=None):
+    """
+    Bakes the selected objects over the selection's range and keeps only the
+    selected keyframes, fitting the tangents of each segment to the baked curves.
+
+    By default this runs the salientReduce command, which fits each curve in
+    turn. With `batched`, every curve is sampled into one matrix and all curves
+    are fitted at once with NumPy (see salient_reduce), which is much faster
+    for full-body rigs.
+
+    Give a Profile to record how long each stage takes.
+    """
+    profile = profile if profile is not None else Profile(enabled=False)
+    selection = sorted(set(selection))
     start = selection[0]
     end = selection[-1]
 
     # Bake
     objects = cmds.ls(selection=True)
-    cmds.bakeResults(objects, t=(start, end), sampleBy=1, minimizeRotation=True, preserveOutsideKeys=True)
+    with profile.stage("bake"):
+        cmds.bakeResults(objects, t=(start, end), sampleBy=1, minimizeRotation=True, preserveOutsideKeys=True)
 
     # Reduce
-    cmds.loadPlugin("SalientPosesMaya")
-    cmds.salientReduce(start=start, finish=end, selection=selection)
-    cmds.unloadPlugin("SalientPosesMaya")
+    if batched:
+        reduce_curves_batched(objects, selection, profile)
+        return
+    with profile.stage("command"):
+        PluginSession.get().acquire()
+        if profile.level() > 0:
+            profile.merge("salientReduce", json.loads(cmds.salientReduce(start=start, finish=end, selection=selection, profile=profile.level())))
+        else:
+            cmds.salientReduce(start=start, finish=end, selection=selection)
+
+def compare_reduction(selection, objects=None):
+    """
+    Reduces the objects (the selected ones by default) to the selection both
+    with salientReduce and with the batched NumPy fit (which salient_reduce
+    also uses offline), restoring their animation after each, and reports how
+    far apart the two results are over every curve, e.g.
+
+        { "curves" : 180, "max_value_difference" : 0.0,
+          "max_curve_difference" : 2e-05, "max_angle_difference" : 3e-07,
+          "max_weight_difference" : 1e-06 }
+
+    where the curve difference is the largest gap between the two reduced
+    curves at any frame of the range, angles are in radians, and values and
+    curves are in internal units (radians for rotations).
+    """
+    objects = cmds.ls(selection=True) if objects is None else objects
+    selection = sorted(set(selection))
+    start, end = selection[0], selection[-1]
+    time_unit = om.MTime.uiUnit()
+
+    def reduced_curves():
+        curves = {}
+        for object in objects:
+            for curve in cmds.listConnections(object, type="animCurve", source=True, destination=False) or []:
+                fn = oma.MFnAnimCurve(om.MGlobal.getSelectionListByName(curve).getDependNode(0))
+                first = fn.find(om.MTime(start, time_unit))
+                keys = range(first, first + len(selection))
+                curves[curve] = {
+                    "values" : [fn.value(i) for i in keys],
+                    "curve" : [fn.evaluate(om.MTime(t, time_unit)) for t in range(start, end + 1)],
+                    "angles" : [fn.getTangentAngleWeight(i, is_in)[0].asRadians() for i in keys for is_in in (True, False)],
+                    "weights" : [fn.getTangentAngleWeight(i, is_in)[1] for i in keys for is_in in (True, False)],
+                }
+        return curves
+
+    cmds.select(objects, replace=True)
+    snapshot = AnimationSnapshot(objects)
+    try:
+        reduce_keyframes(selection)
+        plugin = reduced_curves()
+        snapshot.restore()
+        reduce_keyframes(selection, batched=True)
+        batched = reduced_curves()
+    finally:
+        snapshot.restore()
+
+    differences = dict((field, 0.0) for field in ["values", "curve", "angles", "weights"])
+    for (curve, fitted) in plugin.items():
+        for field in differences:
+            gaps = [abs(u - v) for (u, v) in zip(fitted[field], batched[curve][field])]
+            differences[field] = max([differences[field]] + gaps)
+    return {
+        "curves" : len(plugin),
+        "max_value_difference" : differences["values"],
+        "max_curve_difference" : differences["curve"],
+        "max_angle_difference" : differences["angles"],
+        "max_weight_difference" : differences["weights"],
+    }
+
+def reduce_curves_batched(objects, selection, profile=None):
+    """
+    Reduces the (baked) curves driving the objects to the selection, with the
+    tangents of every curve fitted together.
+    """
+    import numpy as np
+    import salient_reduce
+
+    profile = profile if profile is not None else Profile(enabled=False)
+    start = selection[0]
+    end = selection[-1]
+    curves = []
+    for object in objects:
+        curves += cmds.listConnections(object, type="animCurve", source=True, destination=False) or []
+    if len(curves) == 0:
+        return
+
+    # Having been baked, each curve has one key per frame over the range, whose
+    # values are read in internal units (radians for rotations) as salientReduce reads them
+    n_frames = end - start + 1
+    data = np.empty((n_frames, len(curves)))
+    time_unit = om.MTime.uiUnit()
+    with profile.stage("sampling"):
+        for (k, curve) in enumerate(curves):
+            fn = oma.MFnAnimCurve(om.MGlobal.getSelectionListByName(curve).getDependNode(0))
+            try:
+                first = fn.find(om.MTime(start, time_unit))
+            except RuntimeError:
+                first = None
+            last = None if first is None else first + n_frames - 1
+            if last is None or last >= fn.numKeys or abs(fn.input(last).asUnits(time_unit) - end) > 1e-6:
+                cmds.error("Expected %d baked keys on %s over %d-%d" % (n_frames, curve, start, end))
+            data[:, k] = [fn.value(i) for i in range(first, last + 1)]
+    profile.add("sampling", bytes=data.nbytes)
+
+    with profile.stage("fitting"):
+        seconds_per_frame = om.MTime(1.0, om.MTime.uiUnit()).asUnits(om.MTime.kSeconds)
+        keys = np.asarray(selection) - start
+        (out_angles, out_weights), (in_angles, in_weights) = salient_reduce.fit_tangents(data, keys, seconds_per_frame)
+
+    with profile.stage("apply"):
+        apply_fitted_tangents(curves, selection, out_angles, out_weights, in_angles, in_weights)
+
+def apply_fitted_tangents(curves, selection, out_angles, out_weights, in_angles, in_weights):
+    """
+    Removes the keys between the selected keyframes of each (baked) curve and
+    sets the keyframes' tangents, given per segment and curve as returned by
+    salient_reduce.fit_tangents.
+    """
+    start = selection[0]
+
+    # Remove every non-keyframe with one edit per curve
+    gaps = [(s + 1, e - 1) for (s, e) in zip(selection[:-1], selection[1:]) if e - s > 1]
+    time_unit = om.MTime.uiUnit()
+    for (k, curve) in enumerate(curves):
+        if len(gaps) > 0:
+            cmds.cutKey(curve, time=gaps, clear=True)
+
+        # Keys in the range are now exactly the selection, so they are consecutive
+        fn = oma.MFnAnimCurve(om.MGlobal.getSelectionListByName(curve).getDependNode(0))
+        set_fitted_tangents(fn, fn.find(om.MTime(start, time_unit)),
+            out_angles[:, k], out_weights[:, k], in_angles[:, k], in_weights[:, k])
+
+def set_fitted_tangents(fn, first, out_angles, out_weights, in_angles, in_weights):
+    """
+    Sets the tangents of one curve's consecutive keyframes, from index `first`,
+    given each segment's out-tangent (of its left keyframe) and in-tangent (of
+    its right keyframe) as angles in radians and weights.
+    """
+    for i in range(len(out_angles)):
+        for (ix, is_in, angle, weight) in [
+            (first + i, False, out_angles[i], out_weights[i]),
+            (first + i + 1, True, in_angles[i], in_weights[i]),
+        ]:
+            fn.setWeightsLocked(ix, False)
+            fn.setTangentsLocked(ix, False)
+            fn.setAngle(ix, om.MAngle(float(angle), om.MAngle.kRadians), is_in)
+            fn.setWeight(ix, float(weight), is_in)
+
+def apply_reduced_curves(reduced):
+    """
+    Applies curves reduced offline (see salient_reduce.reduce_channels), given
+    as ReducedCurves or the path of a file holding them, where each channel
+    names an attribute (e.g. "mixamorig:Hips.rotateX") and values are in
+    internal units (radians for rotations).
+
+    Over the keyframes' range, each attribute's keys are replaced by the
+    keyframes (added in one edit per curve) with their fitted tangents; keys
+    outside the range are kept.
+    """
+    if not isinstance(reduced, salient_curves.ReducedCurves):
+        with open(reduced, "rb") as f:
+            reduced = salient_curves.ReducedCurves.read(f)
+
+    time_unit = om.MTime.uiUnit()
+    if abs(om.MTime(1.0, time_unit).asUnits(om.MTime.kSeconds) - reduced.seconds_per_frame) > 1e-9:
+        cmds.warning("The curves were reduced at %.3f fps, which differs from the scene's frame rate" % (1.0 / reduced.seconds_per_frame))
+
+    start, end = reduced.times[0], reduced.times[-1]
+    times = om.MTimeArray([om.MTime(t, time_unit) for t in reduced.times])
+    for channel in reduced.channels:
+        values, out_angles, out_weights, in_angles, in_weights = reduced.channel(channel)
+
+        curves = cmds.listConnections(channel, type="animCurve", source=True, destination=False)
+        if not curves:
+            cmds.setKeyframe(channel, time=start)
+            curves = cmds.listConnections(channel, type="animCurve", source=True, destination=False)
+        cmds.cutKey(curves[0], time=(start, end), clear=True)
+
+        fn = oma.MFnAnimCurve(om.MGlobal.getSelectionListByName(curves[0]).getDependNode(0))
+        fn.addKeys(times, om.MDoubleArray(values), oma.MFnAnimCurve.kTangentFixed, oma.MFnAnimCurve.kTangentFixed, True)
+        set_fitted_tangents(fn, fn.find(om.MTime(start, time_unit)), out_angles, out_weights, in_angles, in_weights)
@@ -0,0 +1,135 @@
+"""
+A persistent on-disk cache of selection results, keyed by a hash of the sampled
+animation and the parameters used for the selection.
+
+Each entry is one compact binary file holding the selections in the layout of
+salient_selections. The total size of the cache is bounded, evicting the least
+recently used entries first.
+
+Several processes may share a cache (e.g. the workers of batch_results), so an
+entry can disappear at any point, being evicted by another process; that entry
+is then a miss.
+"""
+import array
+import hashlib
+import os
+import struct
+import tempfile
+
+import salient_selections
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def _to_bytes(values):
+    # array.tostring was renamed to tobytes in Python 3
+    return values.tobytes() if hasattr(values, "tobytes") else values.tostring()
+
+
+def _remove(path):
+    # Another process may have removed the entry already
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# Backends giving identical selections share cache entries: the CPU backends
+# all compute in double precision, but the OpenCL kernels in single precision
+BACKEND_PRECISIONS = {
+    "numpy" : b"cpu",
+    "multicore" : b"cpu",
+    "opencl" : b"opencl",
+}
+
+
+def make_key(anim_data, dimensions, start, end, fixed_keyframes, max_keyframes=None, max_error=None, pca_variance=None, single_precision=False,
+    min_keyframes=None, backend="opencl"):
+    digest = hashlib.sha1()
+    digest.update(BACKEND_PRECISIONS.get(backend, backend.encode("utf-8")))
+    digest.update(_to_bytes(array.array("d", anim_data)))
+    digest.update("|".join(dimensions).encode("utf-8"))
+    digest.update(struct.pack("=ii", start, end))
+    digest.update(_to_bytes(array.array("i", sorted(fixed_keyframes))))
+    digest.update(struct.pack("=id", max_keyframes or -1, -1.0 if max_error is None else max_error))
+    if pca_variance is not None:
+        digest.update(struct.pack("=d", pca_variance))
+    if single_precision:
+        digest.update(b"single")
+    if min_keyframes is not None:
+        digest.update(struct.pack("=i", min_keyframes))
+    return digest.hexdigest()
+
+
+class SelectionCache:
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".sel")
+
+    def load(self, key):
+        """
+        Returns the cached SelectionTable for the key, or None on a miss.
+        """
+        path = self.path(key)
+        try:
+            # Touch the entry so that eviction sees it as recently used
+            os.utime(path, None)
+            with open(path, "rb") as f:
+                return salient_selections.SelectionTable.read(f)
+        except (IOError, OSError):
+            return None
+
+    def store(self, key, selections):
+        """
+        Stores a SelectionTable (or a dictionary of selections) under the key.
+        """
+        if not isinstance(selections, salient_selections.SelectionTable):
+            selections = salient_selections.SelectionTable.from_dict(selections)
+
+        # Write to a temporary file of this process first, so a partially written
+        # entry is never read, then replace the entry in one step
+        handle, temporary_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(handle, "wb") as f:
+                selections.write(f)
+            os.replace(temporary_path, self.path(key))
+        except Exception:
+            os.remove(temporary_path)
+            raise
+        self.evict()
+
+    def entries(self):
+        """
+        Lists (last used time, size, path) for every entry, oldest first.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".sel"):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, path) in entries:
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+    def clear(self):
+        for (_, _, path) in self.entries():
+            _remove(path)
@@ -0,0 +1,76 @@
+"""
+Compact storage for curves reduced offline (see salient_reduce.reduce_channels).
+
+A file holds, for every channel, the values at the selected keyframes and the
+fitted tangents of each segment, so that the Maya side can rebuild each curve
+in one pass (see salient_api.apply_reduced_curves) without NumPy.
+"""
+import array
+import struct
+
+MAGIC = b"SPRC"
+VERSION = 1
+
+# magic, version, number of keyframes, number of channels, seconds per frame, bytes of channel names
+HEADER = struct.Struct("=4sIIIdI")
+
+
+class ReducedCurves:
+    """
+    Keyframe times (n_keyframes) and, for every channel, the keyframe values
+    (n_keyframes x n_channels) and the out-tangents of each segment's left
+    keyframe and in-tangents of its right keyframe (n_keyframes - 1 x
+    n_channels), as angles in radians and weights, with time in seconds.
+
+    Two-dimensional values are stored row-major in flat arrays, which may be
+    array.array or NumPy arrays (of int32 for the times and float64 otherwise).
+    """
+
+    FIELDS = ["values", "out_angles", "out_weights", "in_angles", "in_weights"]
+
+    def __init__(self, channels, times, values, out_angles, out_weights, in_angles, in_weights, seconds_per_frame):
+        self.channels = list(channels)
+        self.times = times
+        self.values = values
+        self.out_angles = out_angles
+        self.out_weights = out_weights
+        self.in_angles = in_angles
+        self.in_weights = in_weights
+        self.seconds_per_frame = seconds_per_frame
+
+    @staticmethod
+    def read(f):
+        magic, version, n_keyframes, n_channels, seconds_per_frame, names_size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise IOError("Not a reduced curves file (or written by another version)")
+
+        channels = f.read(names_size).decode("utf-8").split("\n") if n_channels > 0 else []
+        times = array.array("i")
+        times.fromfile(f, n_keyframes)
+
+        fields = {}
+        for name in ReducedCurves.FIELDS:
+            values = array.array("d")
+            values.fromfile(f, (n_keyframes if name == "values" else n_keyframes - 1) * n_channels)
+            fields[name] = values
+        return ReducedCurves(channels, times, seconds_per_frame=seconds_per_frame, **fields)
+
+    def write(self, f):
+        names = "\n".join(self.channels).encode("utf-8")
+        f.write(HEADER.pack(MAGIC, VERSION, len(self.times), len(self.channels), self.seconds_per_frame, len(names)))
+        f.write(names)
+        self.times.tofile(f)
+        for name in ReducedCurves.FIELDS:
+            getattr(self, name).tofile(f)
+
+    def channel(self, name):
+        """
+        Returns the keyframe values and the tangents of one channel as lists:
+        (values, out_angles, out_weights, in_angles, in_weights).
+        """
+        c = self.channels.index(name)
+        stride = len(self.channels)
+        return tuple([float(v) for v in getattr(self, field)[c::stride]] for field in ReducedCurves.FIELDS)
+
+    def __len__(self):
+        return len(self.channels)
@@ -0,0 +1,915 @@
+"""
+A NumPy implementation of the Salient Poses analysis and selection steps.
+
+This mirrors the ErrorTable and SelectionManager used by the salientSelect
+command, but runs on the CPU without Maya, the plug-in, or an OpenCL device,
+so selections can be computed headless (e.g. on farm nodes).
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+import salient_selections
+
+# Number of segment ends evaluated together when filling a row of the table;
+# bounds the size of the temporary (ends x frames) arrays.
+BLOCK_SIZE = 64
+
+# Size of the (starts x ends) tiles handed to each worker by the multi-core fill
+TILE_STARTS = 64
+TILE_ENDS = 1024
+
+# Number of error table entries the selection processes together; bounds the
+# size of the temporary arrays of each increment.
+COLUMN_BLOCK_ENTRIES = 1 << 20
+
+# When pruning: the number of frames kept to bound the errors of later
+# segments, the fraction of the threshold a row's errors must reach before
+# its later segments are checked, and the relative margin left for rounding
+PRUNE_WITNESSES = 8
+PRUNE_TRIGGER = 0.5
+PRUNE_MARGIN = 1e-9
+
+# Decimation of the coarse-to-fine selection bounding the pruning threshold
+PRUNE_FACTOR = 8
+
+
+class Cancelled(Exception):
+    """
+    Raised when a progress callback asks for the selection to stop.
+    """
+    pass
+
+
+def report(progress, stage, count, total, error=None):
+    """
+    Calls the progress callback, if any, as progress(stage, count, total, error),
+    where stage is "table" (count of total tiles of the error table filled) or
+    "selection" (count keyframes reached of at most total, with the error of that
+    selection). The callback returns False to cancel.
+    """
+    if progress is not None and progress(stage, count, total, error) is False:
+        raise Cancelled()
+
+
+def as_frames(anim_data, dimensions):
+    """
+    Reshapes the flat buffer given to salientSelect ([time, x0, y0, z0, ...] per
+    frame) into a (n_frames, n_dimensions) array.
+    """
+    return np.asarray(anim_data, dtype=np.float64).reshape(-1, len(dimensions))
+
+
+def range_frames(anim_data, dimensions, start, end):
+    """
+    As as_frames, checking that the buffer holds one frame per frame of the range.
+    """
+    frames = as_frames(anim_data, dimensions)
+    if frames.shape[0] != end - start + 1:
+        raise ValueError("Animation data has %d frames but the range %d-%d has %d" % (frames.shape[0], start, end, end - start + 1))
+    return frames
+
+
+def segment_errors(frames, start, ends, farthest=False):
+    """
+    Computes the error of the segments (start, end) for each of `ends`, being
+    the maximum distance of any frame strictly between the two keyframes to the
+    line segment joining them (as in the max_distance_to_polyline kernel).
+    With farthest, also returns the frame at that distance from each segment.
+    """
+    ends = np.asarray(ends)
+    spans = ends - start
+
+    # Work relative to the start pose; row 0 is the start itself
+    between = frames[start:ends[-1] + 1] - frames[start]
+    segments = between[spans]
+
+    # Project every frame onto every segment, clamped to the segment's ends, and
+    # take the squared distance |v|^2 - t (2 v.u - t |u|^2) (in place, as this is hot)
+    distances = np.dot(segments, between.T)
+    segment_lengths = np.einsum("ij,ij->i", segments, segments)[:, None]
+    t = distances / segment_lengths
+    np.clip(t, 0.0, 1.0, out=t)
+    distances *= -2.0
+    distances += t * segment_lengths
+    distances *= t
+    distances += np.einsum("ij,ij->i", between, between)[None, :]
+
+    # Only frames strictly inside a segment contribute to its error (the start
+    # itself is always at distance zero)
+    offsets = np.arange(between.shape[0])[None, :]
+    distances[offsets >= spans[:, None]] = 0.0
+    if farthest:
+        frames_at = distances.argmax(axis=1)
+        return np.sqrt(np.maximum(distances[np.arange(len(ends)), frames_at], 0.0)), start + frames_at
+    return np.sqrt(np.maximum(distances.max(axis=1), 0.0))
+
+
+def principal_components(frames, variance=0.99):
+    """
+    Projects the frames onto the leading principal components of their pose
+    dimensions, keeping as few as explain at least `variance` of their total
+    variance. Time (the first dimension) is kept as it is.
+
+    Distances between poses are preserved up to the variance dropped, so
+    selecting on the projection approximates selecting on every dimension.
+    Returns the projected frames and the fraction of variance they explain.
+    """
+    poses = frames[:, 1:] - frames[:, 1:].mean(axis=0)
+    u, singular_values, _ = np.linalg.svd(poses, full_matrices=False)
+    explained = singular_values ** 2
+    total = explained.sum()
+    if total == 0:
+        return frames[:, :1].copy(), 1.0
+
+    fractions = np.cumsum(explained) / total
+    n_components = min(int(np.searchsorted(fractions, variance)) + 1, len(fractions))
+    projected = np.empty((frames.shape[0], 1 + n_components))
+    projected[:, 0] = frames[:, 0]
+    projected[:, 1:] = u[:, :n_components] * singular_values[:n_components]
+    return projected, float(fractions[n_components - 1])
+
+
+def selection_error(frames, selection):
+    """
+    Computes the error of one selection (given as indices into the frames):
+    the largest distance of any frame to the segment joining the keyframes
+    either side of it.
+    """
+    selection = np.asarray(selection)
+    indices = np.arange(selection[0], selection[-1] + 1)
+    segments = np.clip(np.searchsorted(selection, indices, side="right") - 1, 0, len(selection) - 2)
+    a = frames[selection[segments]]
+    u = frames[selection[segments + 1]] - a
+    v = frames[indices] - a
+    t = np.clip(np.einsum("ij,ij->i", v, u) / np.einsum("ij,ij->i", u, u), 0.0, 1.0)
+    return float(np.sqrt(np.einsum("ij,ij->i", v - t[:, None] * u, v - t[:, None] * u).max()))
+
+
+def rescore(selections, frames, offset=0):
+    """
+    Returns a copy of a SelectionTable where each error is recomputed on the
+    given frames (whose first row is frame `offset`), e.g. to report the error
+    of selections made on a projection in terms of every dimension.
+    """
+    errors = np.array([selection_error(frames, np.asarray(selections.get_selection(n)) - offset) for n in selections.keys()])
+    counts = np.array(selections.keys(), dtype=np.int32)
+    packed = np.concatenate([selections.get_selection(n) for n in selections.keys()]).astype(np.int32)
+    return salient_selections.SelectionTable(counts, errors, packed)
+
+
+class PackedTable:
+    """
+    The upper triangle (s < e) of a square table, stored column by column so
+    that the entries of every start for one end are contiguous: entry (s, e) is
+    at e (e - 1) / 2 + s. This is under half the size of the square table, and
+    is held as float64 or float32 either in memory, in shared memory (for the
+    multi-core fill), or in a memory-mapped file.
+    """
+
+    def __init__(self, n_frames, data, buffer=None, path=None, owner=False):
+        self.n_frames = n_frames
+        self.data = data
+        self.buffer = buffer
+        self.path = path
+        self.owner = owner
+
+    @staticmethod
+    def allocate(n_frames, dtype=np.float64, directory=None, shared=False):
+        """
+        Allocates a table, in a temporary file in the directory when given
+        (removed when the table is closed), or else in shared memory if asked.
+        """
+        size = max(n_frames * (n_frames - 1) // 2, 1)
+        if directory is not None:
+            handle, path = tempfile.mkstemp(suffix=".table", dir=directory)
+            os.close(handle)
+            return PackedTable(n_frames, np.memmap(path, dtype=dtype, mode="w+", shape=(size,)), path=path, owner=True)
+        if shared:
+            buffer, data = _shared_array(size, dtype)
+            return PackedTable(n_frames, data, buffer=buffer)
+        return PackedTable(n_frames, np.empty(size, dtype=dtype))
+
+    def close(self):
+        if self.owner and self.path is not None:
+            self.data = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                # Still mapped by a view elsewhere (which Windows does not allow removing)
+                pass
+            self.path = None
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def set_row(self, s, ends, errors):
+        self.data[_offsets(ends) + s] = errors
+
+    def row(self, s):
+        """
+        Entries (s, e) for every end e after s.
+        """
+        return self.data[_offsets(np.arange(s + 1, self.n_frames)) + s]
+
+    def column(self, e):
+        """
+        Entries (s, e) for every start s before e.
+        """
+        return self.data[e * (e - 1) // 2:(e + 1) * e // 2]
+
+    def columns(self, e0, e1):
+        """
+        Entries of the ends e0 .. e1 - 1, one column after another.
+        """
+        return self.data[e0 * (e0 - 1) // 2:e1 * (e1 - 1) // 2]
+
+    def column_blocks(self, first=1, entries=COLUMN_BLOCK_ENTRIES):
+        """
+        Splits the ends from `first` into consecutive (e0, e1) blocks of about
+        `entries` entries each.
+        """
+        blocks = []
+        e0 = max(first, 1)
+        while e0 < self.n_frames:
+            e1 = min(max(e0 + 1, int(np.sqrt(2.0 * entries + e0 * e0))), self.n_frames)
+            blocks.append((e0, e1))
+            e0 = e1
+        return blocks
+
+
+def _offsets(ends):
+    ends = np.asarray(ends, dtype=np.int64)
+    return ends * (ends - 1) // 2
+
+
+class ErrorTable:
+    """
+    Table where entry (s, e) holds the error of keeping frames s and e as
+    consecutive keyframes, for s < e. Only those entries are stored (see
+    PackedTable), as float64 or, to halve the memory again, float32; give a
+    directory to hold the table in a memory-mapped file there rather than in
+    memory, for takes too long for the table to fit otherwise.
+
+    With more than one worker the table is filled by a process pool, where the
+    animation and the table live in shared memory (or the table's file) and
+    each task is a tile of (start, end) pairs.
+
+    Given the previous table (and the frame each table starts at), entries over
+    frames the two share unchanged are copied rather than recomputed, as an
+    entry only depends on the frames from its start to its end. Tables of
+    different precision share nothing.
+
+    Given a threshold (see pruning_threshold), entries whose error is certainly
+    above it are skipped and left infinite (see _hopeless). Selections whose
+    error is within the threshold cannot be changed by this, and SelectionManager
+    fills the skipped entries (see complete) before reporting any other.
+    """
+
+    def __init__(self, frames, workers=1, progress=None, start=0, previous=None, dtype=np.float64, directory=None, threshold=None):
+        self.frames = frames
+        self.n_frames = frames.shape[0]
+        self.start = start
+        self.table = PackedTable.allocate(self.n_frames, dtype, directory, shared=workers > 1)
+        self.threshold = threshold
+
+        overlap = self.reuse(previous) if previous is not None else None
+        self.reused_entries = 0 if overlap is None else (overlap[1] - overlap[0] + 1) * (overlap[1] - overlap[0]) // 2
+
+        # Entries skipped by the previous table are copied too, and count as
+        # skipped here, which holds for the lower of the two thresholds
+        copied_skipped = 0
+        if overlap is not None and previous.threshold is not None:
+            copied_skipped = self.count_skipped(*overlap)
+        if copied_skipped > 0 and threshold is not None:
+            self.threshold = min(threshold, previous.threshold)
+
+        tiles = _tiles(self.n_frames, overlap)
+        if workers > 1:
+            self.skipped_entries = copied_skipped + self.fill_in_parallel(workers, tiles, progress)
+        else:
+            self.skipped_entries = copied_skipped + self.fill(tiles, progress)
+
+        # Without a threshold the table is dense, so the copied skipped entries are filled
+        if copied_skipped > 0 and threshold is None:
+            self.complete()
+
+    def reuse(self, previous):
+        """
+        Copies the entries shared with the previous table, returning the first
+        and last shared rows of this table, or None when nothing can be reused.
+        """
+        first = max(self.start, previous.start)
+        last = min(self.start + self.n_frames, previous.start + previous.n_frames) - 1
+        if last - first < 1 or previous.frames.shape[1] != self.frames.shape[1] or previous.table.data is None:
+            return None
+        if previous.table.dtype != self.table.dtype:
+            # Entries rounded to another precision would differ from those computed here
+            return None
+
+        lo, hi = first - self.start, last - self.start + 1
+        previous_lo, previous_hi = first - previous.start, last - previous.start + 1
+        if not np.array_equal(self.frames[lo:hi], previous.frames[previous_lo:previous_hi]):
+            return None
+        for e in range(lo + 1, hi):
+            self.table.column(e)[lo:e] = previous.table.column(e - lo + previous_lo)[previous_lo:previous_lo + e - lo]
+        return lo, hi - 1
+
+    def fill(self, tiles=None, progress=None):
+        """
+        Fills the tiles, returning the number of entries skipped.
+        """
+        tiles = _tiles(self.n_frames) if tiles is None else tiles
+        skipped = 0
+        for (i, tile) in enumerate(tiles):
+            skipped += _fill_tile(self.frames, self.table, *tile, threshold=self.threshold)
+            report(progress, "table", i + 1, len(tiles))
+        return skipped
+
+    def fill_in_parallel(self, workers, tiles=None, progress=None):
+        tiles = _tiles(self.n_frames) if tiles is None else tiles
+        frames_buffer, frames = _shared_array(self.frames.shape)
+        frames[:] = self.frames
+
+        # Workers attach to the table's shared memory, or open its file
+        storage = self.table.buffer if self.table.path is None else self.table.path
+        pool = _pool_context().Pool(workers, _init_worker,
+            (frames_buffer, self.frames.shape, storage, self.table.dtype.str, self.threshold))
+        skipped = 0
+        try:
+            for (i, tile_skipped) in enumerate(pool.imap_unordered(_fill_shared_tile, tiles)):
+                skipped += tile_skipped
+                report(progress, "table", i + 1, len(tiles))
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        if self.table.path is not None:
+            self.table.data.flush()
+        return skipped
+
+    def count_skipped(self, first, last):
+        """
+        Number of entries skipped (left infinite) with both ends within rows
+        first to last.
+        """
+        return sum(int(np.count_nonzero(np.isinf(self.table.column(e)[first:e]))) for e in range(first + 1, last + 1))
+
+    def complete(self):
+        """
+        Fills the entries skipped by pruning, after which the table is complete.
+        """
+        if self.skipped_entries == 0:
+            self.threshold = None
+            return
+        for s in range(self.n_frames - 1):
+            missing = s + 1 + np.flatnonzero(np.isinf(self.table.row(s)))
+            for block_start in range(0, len(missing), BLOCK_SIZE):
+                ends = missing[block_start:block_start + BLOCK_SIZE]
+                self.table.set_row(s, ends, segment_errors(self.frames, s, ends))
+        self.threshold = None
+        self.skipped_entries = 0
+
+
+def pruning_threshold(frames, fixed_keyframes=(), min_keyframes=None):
+    """
+    Error of the selection with the fewest keyframes, being the first and last
+    frames and the fixed keyframes (given as indices), raised by a margin for
+    rounding. Selections with more keyframes almost always do better, so
+    entries above this are rarely needed.
+
+    When selections of fewer than min_keyframes are not wanted, the threshold
+    is instead the error of a coarse-to-fine selection of min_keyframes (see
+    select_multiresolution), which is at least that of the best one but far
+    lower than with the fewest keyframes, so many more entries are skipped.
+    """
+    last = frames.shape[0] - 1
+    fixed = sorted(set(f for f in fixed_keyframes if 0 < f < last))
+    keyframes = [0] + fixed + [last]
+    error = max(segment_errors(frames, s, [e])[0] for (s, e) in zip(keyframes[:-1], keyframes[1:]))
+
+    if min_keyframes is not None and min_keyframes > len(keyframes):
+        grid, grid_fixed_keyframes = coarse_grid(frames.shape[0], PRUNE_FACTOR, fixed)
+        if len(grid) >= min_keyframes:
+            coarse = SelectionManager(ErrorTable(frames[grid]), grid_fixed_keyframes)
+            coarse.increment_until_n_keyframes(min_keyframes)
+            refined = refine_selections(frames, coarse.as_table(), grid, PRUNE_FACTOR, fixed)
+            if min_keyframes in refined.indices:
+                error = refined.get_error(min_keyframes)
+    return error * (1.0 + PRUNE_MARGIN)
+
+
+def _tiles(n_frames, overlap=None):
+    """
+    Splits the upper triangle of the table into (s0, s1, e0, e1) tiles, leaving
+    out the entries with both ends within the overlap (first, last), if given.
+    """
+    groups = [(0, n_frames - 1, 0)]
+    if overlap is not None:
+        first, last = overlap
+        groups = [(0, first, 0), (first, last + 1, last + 1), (last + 1, n_frames - 1, 0)]
+
+    tiles = []
+    for (rows_lo, rows_hi, ends_lo) in groups:
+        for s0 in range(rows_lo, rows_hi, TILE_STARTS):
+            s1 = min(s0 + TILE_STARTS, rows_hi)
+            for e0 in range(max(s0 + 1, ends_lo), n_frames, TILE_ENDS):
+                tiles.append((s0, s1, e0, min(e0 + TILE_ENDS, n_frames)))
+    return tiles
+
+
+def _fill_tile(frames, table, s0, s1, e0, e1, threshold=None):
+    """
+    Fills a tile of the table, returning the number of entries skipped for
+    certainly being above the threshold, if given.
+    """
+    skipped = 0
+    witnesses = []
+    for s in range(s0, s1):
+        witnesses = [m for m in witnesses if m > s]
+        worst = 0.0
+        for block_start in range(max(e0, s + 1), e1, BLOCK_SIZE):
+            ends = np.arange(block_start, min(block_start + BLOCK_SIZE, e1))
+            if threshold is None:
+                table.set_row(s, ends, segment_errors(frames, s, ends))
+                continue
+
+            # Only whole blocks are skipped, so that every error computed is
+            # computed exactly as without pruning (rounding depends on the block).
+            # Segments far below the threshold are rarely followed by hopeless ones.
+            if worst > PRUNE_TRIGGER * threshold and _hopeless(frames, s, ends, witnesses, threshold).all():
+                table.set_row(s, ends, np.inf)
+                skipped += len(ends)
+                continue
+            errors, farthest = segment_errors(frames, s, ends, farthest=True)
+            table.set_row(s, ends, errors)
+            worst = max(worst, errors.max())
+
+            # Keep the frames farthest from the worst and the longest segments,
+            # which are likely to be far from the next (and the next start's) too
+            for m in [int(farthest[errors.argmax()]), int(farthest[-1])]:
+                if m > s and m not in witnesses:
+                    witnesses.append(m)
+            witnesses = witnesses[-PRUNE_WITNESSES:]
+    return skipped
+
+
+def _hopeless(frames, s, ends, witnesses, threshold):
+    """
+    Flags the ends whose segment from s certainly has an error above the
+    threshold, as one of the witnesses (frames found to be far from earlier
+    segments) lies strictly inside it and further than that from it. This
+    costs a small fraction of computing the errors.
+    """
+    if len(witnesses) == 0:
+        return np.zeros(len(ends), dtype=bool)
+    start = frames[s]
+    segments = frames[ends] - start
+    lengths = np.einsum("ij,ij->i", segments, segments)
+    offsets = frames[witnesses] - start
+    projections = np.dot(offsets, segments.T)
+    t = np.clip(projections / lengths[None, :], 0.0, 1.0)
+    distances = np.einsum("ij,ij->i", offsets, offsets)[:, None] - t * (2.0 * projections - t * lengths[None, :])
+    inside = np.array(witnesses)[:, None] < ends[None, :]
+    return (inside & (distances > threshold * threshold)).any(axis=0)
+
+
+def _shared_array(shape, dtype=np.float64):
+    """
+    Allocates a float64 (or float32) array in shared memory, returning both the
+    raw buffer (which is handed to the pool's workers once, when they start) and a view of it.
+    """
+    dtype = np.dtype(dtype)
+    buffer = _pool_context().RawArray("f" if dtype == np.float32 else "d", int(np.prod(shape)))
+    return buffer, np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+
+def spawns_workers():
+    """
+    Whether the pool's workers are started as new interpreters. Otherwise (with
+    Python 2 outside Windows) they are forked, which is unsafe from a process
+    running other threads, such as Maya's interface.
+    """
+    return hasattr(multiprocessing, "get_context") or sys.platform == "win32"
+
+
+def _pool_context():
+    # Spawn workers rather than fork them wherever possible: a fork copies the
+    # state of every thread of the calling process (e.g. Qt's, inside Maya)
+    context = multiprocessing.get_context("spawn") if hasattr(multiprocessing, "get_context") else multiprocessing
+
+    # Inside an interactive Maya session sys.executable is Maya itself, so
+    # spawned workers must be started with the mayapy interpreter instead.
+    executable = os.path.basename(sys.executable).lower()
+    if executable.startswith("maya") and not executable.startswith("mayapy"):
+        directory = os.path.dirname(sys.executable)
+        context.set_executable(os.path.join(directory, "mayapy" + os.path.splitext(executable)[1]))
+    return context
+
+
+_worker_frames = None
+_worker_table = None
+_worker_threshold = None
+
+
+def _init_worker(frames_buffer, shape, table_storage, table_dtype, threshold):
+    global _worker_frames, _worker_table, _worker_threshold
+    _worker_threshold = threshold
+    _worker_frames = np.frombuffer(frames_buffer, dtype=np.float64).reshape(shape)
+    if isinstance(table_storage, str):
+        data = np.memmap(table_storage, dtype=table_dtype, mode="r+")
+    else:
+        data = np.frombuffer(table_storage, dtype=table_dtype)
+    _worker_table = PackedTable(shape[0], data)
+
+
+def _fill_shared_tile(tile):
+    return _fill_tile(_worker_frames, _worker_table, *tile, threshold=_worker_threshold)
+
+
+class SelectionManager:
+    """
+    Incrementally computes the optimal selection for each number of keyframes,
+    where a selection always keeps the first and last frames and is optimal
+    when the largest error of its segments is as small as possible. Segments
+    may not span over any of the fixed keyframes (given as indices into the table).
+
+    Selections of fewer than min_keyframes are not reported.
+
+    When the error table was pruned, any selection with an error above its
+    threshold may differ from the one the complete table gives, so the table
+    is completed and the selection redone before such a selection is kept.
+    """
+
+    def __init__(self, error_table, fixed_keyframes=(), min_keyframes=2):
+        self.error_table = error_table
+        self.table = error_table.table
+        self.n_frames = error_table.n_frames
+
+        # Segments ending at e may not start before the last fixed keyframe before e
+        fixed = np.zeros(self.n_frames, dtype=np.int64)
+        fixed[[f for f in fixed_keyframes if 0 < f < self.n_frames - 1]] = 1
+        self.first_starts = np.zeros(self.n_frames, dtype=np.int64)
+        self.first_starts[1:] = np.maximum.accumulate(np.where(fixed, np.arange(self.n_frames), 0))[:-1]
+        self.constrained = bool(fixed.any())
+
+        # Fewer keyframes than this cannot keep every fixed keyframe
+        self.min_keyframes = max(2 + int(fixed.sum()), min_keyframes)
+
+        self.restart()
+        if self.exceeds_threshold():
+            self.complete()
+
+        # Entries of the error table taken from a previous table (see prepare)
+        self.reused_entries = 0
+
+    @property
+    def skipped_entries(self):
+        """
+        Entries of the error table skipped by pruning (and not filled since).
+        """
+        return self.error_table.skipped_entries
+
+    def restart(self):
+        """
+        Goes back to the selection of two keyframes.
+        """
+        # Best error of any selection of n keyframes from frame 0 up to each frame
+        self.costs = np.full(self.n_frames, np.inf)
+        self.costs[1:] = self.table.row(0)
+        self.costs[self.first_starts > 0] = np.inf
+        self.n_keyframes = 2
+        self.parents = {}
+        self.errors = {2: self.costs[-1]}
+
+    def exceeds_threshold(self):
+        threshold = self.error_table.threshold
+        return threshold is not None and self.n_keyframes >= self.min_keyframes and self.errors[self.n_keyframes] > threshold
+
+    def complete(self):
+        """
+        Fills the entries of the error table skipped by pruning and selects
+        again up to the current number of keyframes.
+        """
+        n = self.n_keyframes
+        self.error_table.complete()
+        self.restart()
+        while self.n_keyframes < n:
+            self.step()
+
+    def increment(self):
+        self.step()
+        if self.exceeds_threshold():
+            self.complete()
+
+    def step(self):
+        n = self.n_keyframes + 1
+        lo = n - 2
+        costs = np.full(self.n_frames, np.inf)
+        parents = np.zeros(self.n_frames, dtype=np.int32)
+
+        # Costs before lo are infinite, so whole columns can be taken from the table
+        for (e0, e1) in self.table.column_blocks(lo + 1):
+            lengths = np.arange(e0, e1)
+            offsets = _offsets(lengths) - _offsets(e0)
+            starts = np.arange(offsets[-1] + lengths[-1]) - np.repeat(offsets, lengths)
+            candidates = np.maximum(self.costs[starts], self.table.columns(e0, e1))
+            if self.constrained:
+                candidates[starts < np.repeat(self.first_starts[e0:e1], lengths)] = np.inf
+
+            # Take the first start with the least error of each end
+            best = np.minimum.reduceat(candidates, offsets)
+            ties = np.flatnonzero(candidates == np.repeat(best, lengths))
+            costs[e0:e1] = best
+            parents[e0:e1] = starts[ties[np.searchsorted(ties, offsets)]]
+
+        self.costs = costs
+        self.parents[n] = parents
+        self.errors[n] = costs[-1]
+        self.n_keyframes = n
+
+    def increment_until_n_keyframes(self, n_keyframes, max_error=None, progress=None):
+        """
+        Increments until reaching n_keyframes or, when max_error is given, until
+        the error of the latest selection is within it (whichever comes first).
+        """
+        limit = min(n_keyframes, self.n_frames)
+        while self.n_keyframes < limit:
+            if max_error is not None and self.n_keyframes >= self.min_keyframes and self.errors[self.n_keyframes] <= max_error:
+                break
+            self.increment()
+            report(progress, "selection", self.n_keyframes, limit, float(self.errors[self.n_keyframes]))
+
+    def get_selection(self, n_keyframes):
+        selection = [self.n_frames - 1]
+        for n in range(n_keyframes, 2, -1):
+            selection.append(int(self.parents[n][selection[-1]]))
+        selection.append(0)
+        return selection[::-1]
+
+    def as_selections(self, offset=0):
+        """
+        Returns the selections in the same form as salient_api.select_keyframes,
+        skipping keyframe counts that cannot satisfy the fixed keyframes (or
+        are below min_keyframes).
+        """
+        selections = {}
+        for n in sorted(self.errors.keys()):
+            error = float(self.errors[n])
+            if error == np.inf or n < self.min_keyframes:
+                continue
+            selection = [f + offset for f in self.get_selection(n)]
+            selections[n] = { "selection" : selection, "error" : error }
+        return selections
+
+    def as_table(self, offset=0):
+        """
+        Returns the selections packed into a SelectionTable.
+        """
+        counts = [n for n in sorted(self.errors.keys()) if self.errors[n] != np.inf and n >= self.min_keyframes]
+        frames = np.empty(sum(counts), dtype=np.int32)
+        ix = 0
+        for n in counts:
+            frames[ix:ix + n] = self.get_selection(n)
+            ix += n
+        frames += offset
+        errors = np.array([self.errors[n] for n in counts], dtype=np.float64)
+        return salient_selections.SelectionTable(np.array(counts, dtype=np.int32), errors, frames)
+
+
+def select(anim_data, dimensions, start, end, fixed_keyframes, workers=1, max_keyframes=None, max_error=None, progress=None, reuse=True,
+    dtype=np.float64, directory=None, prune=False, min_keyframes=None):
+    """
+    Builds the error table and runs the selection up to one keyframe per frame,
+    returning the SelectionManager holding every selection. The selection stops
+    early at max_keyframes or at the first selection whose error is within
+    max_error, when given.
+
+    Progress is reported to the optional callback (see report), which may
+    cancel by returning False, in which case Cancelled is raised. The error
+    table of the previous call is reused where possible (see prepare).
+
+    The dtype and directory choose how the error table is stored (see
+    ErrorTable), and with prune, entries no selection can use are skipped
+    (see prepare).
+    """
+    manager = prepare(anim_data, dimensions, start, end, fixed_keyframes, workers, progress, reuse, dtype, directory, prune, min_keyframes)
+    manager.increment_until_n_keyframes(max_keyframes or manager.n_frames, max_error, progress)
+    return manager
+
+
+# The error table of the last selection, kept so that re-evaluating after only
+# changing the range or the fixed keyframes reuses its entries
+_last_table = None
+
+
+def reset():
+    """
+    Forgets the error table kept from the last selection.
+    """
+    global _last_table
+    _last_table = None
+
+
+def prepare(anim_data, dimensions, start, end, fixed_keyframes, workers=1, progress=None, reuse=True, dtype=np.float64, directory=None,
+    prune=False, min_keyframes=None):
+    """
+    Builds the error table, returning a SelectionManager ready to increment.
+
+    Unless reuse is False, entries are taken from the previous call's table
+    wherever the two share unchanged frames (e.g. when the range is narrowed,
+    or when only the fixed keyframes differ), and the table is kept for the next.
+
+    With prune, entries whose error is certainly above that of the selection
+    with the fewest keyframes are skipped (see pruning_threshold), which gives
+    the same selections; the manager's skipped_entries counts them. Give
+    min_keyframes to report no selections with fewer keyframes, which lets
+    far more entries be skipped.
+    """
+    global _last_table
+    frames = range_frames(anim_data, dimensions, start, end)
+
+    fixed = [f - start for f in fixed_keyframes]
+    error_table = ErrorTable(frames, workers=workers, progress=progress, start=start, previous=_last_table if reuse else None,
+        dtype=dtype, directory=directory, threshold=pruning_threshold(frames, fixed, min_keyframes) if prune else None)
+    if reuse:
+        _last_table = error_table
+
+    manager = SelectionManager(error_table, fixed, min_keyframes or 2)
+    manager.reused_entries = error_table.reused_entries
+    return manager
+
+
+def iter_selections(anim_data, dimensions, start, end, fixed_keyframes, workers=1, max_keyframes=None, max_error=None, progress=None, reuse=True,
+    dtype=np.float64, directory=None, prune=False, min_keyframes=None):
+    """
+    As select, but yields (n_keyframes, error, selection) for each number of
+    keyframes as soon as it is computed, in increasing order, skipping counts
+    that cannot satisfy the fixed keyframes (or are below min_keyframes).
+    Stopping iteration early stops the selection.
+    """
+    manager = prepare(anim_data, dimensions, start, end, fixed_keyframes, workers, progress, reuse, dtype, directory, prune, min_keyframes)
+    limit = min(max_keyframes or manager.n_frames, manager.n_frames)
+    while True:
+        n = manager.n_keyframes
+        error = float(manager.errors[n])
+        reported = error != np.inf and n >= manager.min_keyframes
+        if reported:
+            yield n, error, [f + start for f in manager.get_selection(n)]
+        if n >= limit or (reported and max_error is not None and error <= max_error):
+            break
+        manager.increment()
+        report(progress, "selection", manager.n_keyframes, limit, float(manager.errors[manager.n_keyframes]))
+
+
+def select_keyframes(anim_data, dimensions, start, end, fixed_keyframes, workers=1, max_keyframes=None, max_error=None, dtype=np.float64,
+    directory=None, prune=False, min_keyframes=None):
+    """
+    Drop-in equivalent of salientSelect: takes the same animation buffer,
+    dimensions, range, and fixed keyframes and returns selections keyed by the
+    number of keyframes, e.g. { n_keyframes : { "selection" : [...], "error" : e } }.
+
+    Setting `workers` above one fills the error table across that many
+    processes, the dtype and directory choose how it is stored (see ErrorTable),
+    and prune skips the entries no selection can use (see prepare), most of
+    them when selections below min_keyframes are not wanted.
+    """
+    manager = select(anim_data, dimensions, start, end, fixed_keyframes, workers, max_keyframes, max_error, dtype=dtype, directory=directory,
+        prune=prune, min_keyframes=min_keyframes)
+    return manager.as_selections(offset=start)
+
+
+# Upper limit on the pairs of windows whose segment errors are remembered while
+# refining multi-resolution selections (each under a kilobyte at the default radius)
+REFINE_MEMO_SIZE = 100000
+
+
+def select_multiresolution(anim_data, dimensions, start, end, fixed_keyframes, factor=4, radius=None, workers=1,
+    max_keyframes=None, max_error=None, progress=None, dtype=np.float64, directory=None, prune=False):
+    """
+    Approximates the selections by selecting on every `factor`-th frame (see
+    coarse_grid) and then refining each selection at full resolution (see
+    refine_selections), which is much faster than selecting on every frame.
+    """
+    frames = range_frames(anim_data, dimensions, start, end)
+    grid, grid_fixed_keyframes = coarse_grid(frames.shape[0], factor, [f - start for f in fixed_keyframes])
+    threshold = pruning_threshold(frames[grid], grid_fixed_keyframes) if prune else None
+    error_table = ErrorTable(frames[grid], workers=workers, progress=progress, dtype=dtype, directory=directory, threshold=threshold)
+    coarse = SelectionManager(error_table, grid_fixed_keyframes)
+    coarse.increment_until_n_keyframes(max_keyframes or len(grid), max_error)
+    return refine_selections(frames, coarse.as_table(), grid, radius or factor, fixed_keyframes, start, progress)
+
+
+def coarse_grid(n_frames, factor, fixed_keyframes):
+    """
+    Frames (as indices) kept when decimating by `factor`: every factor-th frame,
+    the last frame, and the fixed keyframes, which are returned as indices into the grid.
+    """
+    fixed = set(f for f in fixed_keyframes if 0 < f < n_frames - 1)
+    grid = np.array(sorted(set(range(0, n_frames, factor)) | set([n_frames - 1]) | fixed))
+    return grid, [int(ix) for ix in np.searchsorted(grid, sorted(fixed))]
+
+
+def refine_selections(frames, coarse, grid, radius, fixed_keyframes=(), start=0, progress=None):
+    """
+    Refines selections made on the frames of the grid (a SelectionTable whose
+    keyframes are indices into it) at full resolution, letting every keyframe
+    other than the first, last, and fixed keyframes move by up to `radius`
+    frames to minimise the selection's error.
+
+    Returns a SelectionTable of the refined selections (as frames from start)
+    with their errors over every frame, whose lower_bounds hold, for each number
+    of keyframes, a lower bound on the error of the exact selection: the exact
+    error lies between the two.
+    """
+    n_frames = frames.shape[0]
+    fixed = set(f - start for f in fixed_keyframes)
+
+    # Each keyframe on the grid may move within its window, except the ends and fixed keyframes
+    windows = {}
+    for f in grid:
+        if f == 0 or f == n_frames - 1 or f in fixed:
+            windows[f] = np.array([f])
+        else:
+            windows[f] = np.arange(max(f - radius, 1), min(f + radius, n_frames - 2) + 1)
+
+    # Refine each selection, remembering the errors between windows as
+    # neighbouring counts share most of their segments
+    memo = {}
+    counts, errors, lower_bounds, packed = [], [], [], []
+    for n in coarse.keys():
+        if coarse.get_error(n) == np.inf:
+            continue
+        if len(memo) > REFINE_MEMO_SIZE:
+            memo = {}
+        selection, error = _refine(frames, grid[np.asarray(coarse.get_selection(n))], windows, memo)
+        counts.append(n)
+        errors.append(error)
+        lower_bounds.append(coarse.get_error(n))
+        packed.extend(f + start for f in selection)
+        report(progress, "selection", n, len(grid), error)
+
+    # Snapping the exact selection's keyframes to the grid moves each by at most
+    # half a grid step, which changes its error by at most twice the largest
+    # distance between poses that close; as the coarse selection is optimal on
+    # the grid, it can be worse than the exact selection by no more than that.
+    half_step = int(np.diff(grid).max()) // 2 if len(grid) > 1 else 0
+    slack = 0.0
+    for k in range(1, half_step + 1):
+        slack = max(slack, float(np.sqrt(((frames[k:] - frames[:-k]) ** 2).sum(axis=1)).max()))
+    lower_bounds = np.minimum(np.maximum(np.array(lower_bounds) - 2.0 * slack, 0.0), errors)
+
+    table = salient_selections.SelectionTable(np.array(counts, dtype=np.int32), np.array(errors), np.array(packed, dtype=np.int32))
+    table.lower_bounds = lower_bounds
+    return table
+
+
+def _refine(frames, selection, windows, memo):
+    """
+    Finds the best selection (as in SelectionManager) where each keyframe lies
+    in the window of the given selection's keyframe. Returns the selection and its error.
+    """
+    costs = np.zeros(1)
+    parents = []
+    for (a, b) in zip(selection[:-1], selection[1:]):
+        errors = memo.get((a, b))
+        if errors is None:
+            errors = _window_errors(frames, windows[a], windows[b])
+            memo[(a, b)] = errors
+        candidates = np.maximum(costs[:, None], errors)
+        best = candidates.argmin(axis=0)
+        costs = candidates[best, np.arange(errors.shape[1])]
+        parents.append(best)
+
+    ix = 0
+    refined = [int(windows[selection[-1]][0])]
+    for k in range(len(parents) - 1, -1, -1):
+        ix = parents[k][ix]
+        refined.append(int(windows[selection[k]][ix]))
+    return refined[::-1], float(costs[0])
+
+
+def _window_errors(frames, starts, ends):
+    """
+    Errors of the segments from each start to each end (infinite where the end
+    does not come after the start).
+    """
+    errors = np.full((len(starts), len(ends)), np.inf)
+    for (i, s) in enumerate(starts):
+        later = ends > s
+        if later.any():
+            errors[i, later] = segment_errors(frames, s, ends[later])
+    return errors
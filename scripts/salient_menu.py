@@ -1,4 +1,7 @@
 import math
+import os
+import tempfile
+import time
 
 from PySide2 import QtGui, QtCore, QtWidgets
 from shiboken2 import wrapInstance
@@ -11,79 +14,151 @@ import maya.mel as mel
 
 import salient_utils
 import salient_api
+import salient_selections
 
 def _reload():
     reload(salient_utils)
     reload(salient_api)
 
+# Entries listed after the OpenCL devices, mapped to the CPU backend they select
+CPU_DEVICES = {
+    "CPU (NumPy)" : "numpy",
+    "CPU (multi-core)" : "multicore",
+}
+
+# Memory kept by the undo history before its oldest entries are moved to disk
+UNDO_MEMORY_BYTES = 512 * 1024 * 1024
+
 class SavedAnimation:
+    """
+    The animation of the objects before a reduction, held as a bulk snapshot of
+    their curves (see salient_api.AnimationSnapshot). A snapshot can be spilled
+    to a file to free memory, and is read back when reverted.
+    """
 
     def __init__(self, objects, start, end):
         self.objects = objects
         self.start = start
         self.end = end
+        self.path = None
 
         self.save()
 
     def save(self):
-        self.animation = {}
-        for object in self.objects:
-            data = {}
-            connections = cmds.listConnections(object)
-            if connections is None:
-                return
-
-            curves = [x for x in connections if "animCurve" in cmds.nodeType(x)]
-            for curve in curves:
-                
-                times = cmds.keyframe(curve, query=True, time=(self.start, self.end))
-                if times is None:
-                    data[curve] = None
-                else:                    
-                    values = [cmds.keyframe(curve, time=(t, t), eval=True, query=True)[0] for t in times]
-                    inWeights = [cmds.keyTangent(curve, query=True, time=(t, t), inWeight=True)[0] for t in times]
-                    inAngles = [cmds.keyTangent(curve, query=True, time=(t, t), inAngle=True)[0] for t in times]
-                    outWeights = [cmds.keyTangent(curve, query=True, time=(t, t), outWeight=True)[0] for t in times]
-                    outAngles = [cmds.keyTangent(curve, query=True, time=(t, t), outAngle=True)[0] for t in times]
-
-                    data[curve] = {
-                        "keys" : list(zip(times, values)),
-                        "ins" : list(zip(inWeights, inAngles)),
-                        "outs" : list(zip(outWeights, outAngles))
-                    }
-
-            self.animation[object] = data
+        self.snapshot = salient_api.AnimationSnapshot(self.objects)
+        self.nbytes = self.snapshot.nbytes()
+
+    def spill(self, directory):
+        handle, self.path = tempfile.mkstemp(suffix=".snapshot", dir=directory)
+        os.close(handle)
+        self.snapshot.dump(self.path)
+        self.snapshot = None
 
     def revert(self):
-        for object in self.animation.keys():
-            data = self.animation[object]
-            curves = data.keys()
-            for curve in curves:
-
-                # Curve contained no keyframe data when saved, so cut whatever is there now
-                if data[curve] == None:
-                    cmds.cutKey(curve, time=(self.start, self.end))
-                    return
-
-                keys = data[curve]["keys"]
-                times = [k[0] for k in keys]
-                ins = data[curve]["ins"]
-                outs = data[curve]["outs"]
-                curve_data = list(zip(keys, ins, outs))
-
-                start = times[0]
-                end = times[-1]
-
-                # Remove all frames in section
-                for (s, e) in zip(times[:-1], times[1:]):
-                    if e - s > 1:
-                        cmds.cutKey(curve, time=(s + 1, e - 1))
-
-                # Rebuild the animation
-                for ((time, value), (inWeight, inAngle), (outWeight, outAngle)) in curve_data:
-                    cmds.setKeyframe(curve, value=value, time=time)
-                    cmds.keyTangent(curve, edit=True, time=(time, time), inWeight=inWeight, inAngle=inAngle, absolute=True)
-                    cmds.keyTangent(curve, edit=True, time=(time, time), outWeight=outWeight, outAngle=outAngle, absolute=True)
+        if self.snapshot is None:
+            self.snapshot = salient_api.AnimationSnapshot.load(self.path)
+        self.snapshot.restore()
+        self.discard()
+
+    def discard(self):
+        if self.path is not None and os.path.isfile(self.path):
+            os.remove(self.path)
+        self.path = None
+
+class UndoHistory:
+    """
+    Stack of saved animations that keeps at most max_bytes of snapshots in
+    memory, spilling the oldest ones to a temporary directory beyond that.
+    """
+
+    def __init__(self, max_bytes=UNDO_MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = []
+        self.directory = None
+
+    def push(self, saved):
+        self.entries.append(saved)
+        in_memory = [e for e in self.entries if e.snapshot is not None]
+        total = sum(e.nbytes for e in in_memory)
+        for entry in in_memory[:-1]:
+            if total <= self.max_bytes:
+                break
+            if self.directory is None:
+                self.directory = tempfile.mkdtemp(prefix="salientPosesUndo")
+            entry.spill(self.directory)
+            total -= entry.nbytes
+
+    def pop(self):
+        return self.entries.pop()
+
+    def clear(self):
+        for entry in self.entries:
+            entry.discard()
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+class SelectionWorker(QtCore.QThread):
+    """
+    Computes selections on a CPU backend in the background, from animation that
+    has already been sampled on the main thread. Progress is emitted at most
+    every PROGRESS_INTERVAL seconds and new selections, in batches, at most
+    every PUBLISH_INTERVAL seconds. cancel() stops the computation at the next
+    report, keeping the selections published so far.
+    """
+
+    PROGRESS_INTERVAL = 0.1
+    PUBLISH_INTERVAL = 0.25
+
+    progressed = QtCore.Signal(str, int, int, float)
+    selected = QtCore.Signal(object)
+    succeeded = QtCore.Signal()
+    failed = QtCore.Signal(str)
+    cancelled = QtCore.Signal()
+
+    def __init__(self, arguments, parent=None):
+        super(SelectionWorker, self).__init__(parent)
+        self.arguments = arguments
+        self.cancel_requested = False
+        self.last_report = 0.0
+        self.last_publish = 0.0
+        self.batch = []
+
+    def publish(self, force=False):
+        now = time.time()
+        if len(self.batch) > 0 and (force or now - self.last_publish >= SelectionWorker.PUBLISH_INTERVAL):
+            self.last_publish = now
+            self.selected.emit(self.batch)
+            self.batch = []
+
+    def cancel(self):
+        self.cancel_requested = True
+
+    def report(self, stage, count, total, error):
+        now = time.time()
+        if now - self.last_report >= SelectionWorker.PROGRESS_INTERVAL or count == total:
+            self.last_report = now
+            self.progressed.emit(stage, count, total, -1.0 if error is None else error)
+        return not self.cancel_requested
+
+    def run(self):
+        import salient_engine
+        try:
+            for result in salient_api.iter_selections(progress=self.report, **self.arguments):
+                self.batch.append(result)
+                self.publish()
+                if self.cancel_requested:
+                    raise salient_engine.Cancelled()
+        except salient_engine.Cancelled:
+            self.publish(force=True)
+            self.cancelled.emit()
+        except Exception as e:
+            self.publish(force=True)
+            self.failed.emit(str(e))
+        else:
+            self.publish(force=True)
+            self.succeeded.emit()
 
 def getMayaMainWindow():
     mayaPtr = omui.MQtUtil.mainWindow()
@@ -102,8 +177,9 @@ class SalientPosesDialog(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         super(SalientPosesDialog, self).__init__(parent)
         self.my_parent = parent
         
-        self.selections = {}
-        self.saved_animations = []
+        self.selections = None
+        self.saved_animations = UndoHistory()
+        self.worker = None
 
         def init_ui(): 
             start = int(cmds.playbackOptions(query=True, minTime=True))
@@ -112,11 +188,12 @@ class SalientPosesDialog(MayaQWidgetDockableMixin, QtWidgets.QWidget):
             vbox = salient_utils.UIBuilder.vertical_box(parent=self)
 
             # OpenCL device choice
-            cmds.loadPlugin("SalientPosesMaya")
+            salient_api.PluginSession.get().acquire()
             listed_devices = [v for v in cmds.salientOpenCLInfo().split("\n") if v != ""]
-            cmds.unloadPlugin("SalientPosesMaya")
+            listed_devices += sorted(name for (name, backend) in CPU_DEVICES.items()
+                if backend != "multicore" or salient_api.multicore_available())
             hbox = salient_utils.UIBuilder.horizontal_box(add_to=vbox)
-            salient_utils.UIBuilder.label(hbox, "OpenCL Device")
+            salient_utils.UIBuilder.label(hbox, "Device")
             self.opencl_device_combo = salient_utils.UIBuilder.make_combo(hbox, listed_devices)
             
             # Start frame box
@@ -156,16 +233,40 @@ class SalientPosesDialog(MayaQWidgetDockableMixin, QtWidgets.QWidget):
             # Actions
             hbox = salient_utils.UIBuilder.horizontal_box(add_to=vbox)
             salient_utils.UIBuilder.label(hbox, "Actions")
-            salient_utils.UIBuilder.button(hbox, "Evaluate", fn=self.do_select)
+            self.evaluate_button = salient_utils.UIBuilder.button(hbox, "Evaluate", fn=self.do_select)
             salient_utils.UIBuilder.button(hbox, "Reduce", fn=self.do_reduce)
             self.undo_button = salient_utils.UIBuilder.button(hbox, "Undo (0)", fn=self.revert_to_saved)
 
+            # Progress of a background evaluation
+            hbox = salient_utils.UIBuilder.horizontal_box(add_to=vbox)
+            salient_utils.UIBuilder.label(hbox, "Status")
+            self.status_label = salient_utils.UIBuilder.label(hbox, "Idle", size=int(salient_utils.WINDOW_QUARTER * 2))
+            self.cancel_button = salient_utils.UIBuilder.button(hbox, "Cancel", fn=self.cancel_select)
+            self.cancel_button.setEnabled(False)
+
         init_ui()
         self.setWindowTitle('Salient Poses')
 
+    def release(self):
+        """
+        Stops any evaluation and frees the error table kept for re-evaluating.
+        """
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker.wait()
+            self.worker = None
+        salient_api.release_error_table()
+
+    def closeEvent(self, event):
+        self.release()
+        super(SalientPosesDialog, self).closeEvent(event)
+
+    def dockCloseEventTriggered(self):
+        self.release()
+
     def save_animation(self, objects, start, end):
         saved = SavedAnimation(objects, start, end)
-        self.saved_animations.append(saved)
+        self.saved_animations.push(saved)
         self.undo_button.setText("Undo (%d)" % len(self.saved_animations))
 
     def revert_to_saved(self):
@@ -177,9 +278,12 @@ class SalientPosesDialog(MayaQWidgetDockableMixin, QtWidgets.QWidget):
 
     def do_select(self):
         opencl_device_info_str = self.opencl_device_combo.currentText()
-        cl_platform_ix_str, cl_device_ix_str = opencl_device_info_str.split(" ")[0].split(".")
-        cl_platform_ix = int(cl_platform_ix_str)
-        cl_device_ix = int(cl_device_ix_str)
+        backend = CPU_DEVICES.get(opencl_device_info_str, "opencl")
+        cl_platform_ix, cl_device_ix = 0, 0
+        if backend == "opencl":
+            cl_platform_ix_str, cl_device_ix_str = opencl_device_info_str.split(" ")[0].split(".")
+            cl_platform_ix = int(cl_platform_ix_str)
+            cl_device_ix = int(cl_device_ix_str)
 
         fixed_keyframes = []
         fixed_keyframes_text = self.fixed_keyframes_edit.text().strip()
@@ -188,13 +292,73 @@ class SalientPosesDialog(MayaQWidgetDockableMixin, QtWidgets.QWidget):
 
         start = int(self.start_edit.text())
         end = int(self.end_edit.text())
-        self.selections = salient_api.select_keyframes(cl_platform_ix, cl_device_ix, start, end, fixed_keyframes)
 
-        # Update slider bounds
-        self.n_keyframes_slider.setRange(*self.get_keyframe_range())
+        # The plug-in runs Maya commands, so only CPU backends can run in the background
+        if backend not in salient_api.CPU_BACKENDS:
+            self.set_selections(salient_api.select_keyframes(cl_platform_ix, cl_device_ix, start, end, fixed_keyframes, backend=backend))
+            self.status_label.setText("Done (%.2fs of OpenCL set-up saved so far)" % salient_api.PluginSession.get().time_saved())
+            return
+
+        if self.worker is not None:
+            cmds.error("An evaluation is already running")
+
+        # Sample on the main thread (as Maya requires), then select in the
+        # background, showing selections as they arrive
+        salient_api.get_cache()
+        self.selections = None
+        self.worker = SelectionWorker({
+            "cl_platform_ix" : cl_platform_ix, "cl_device_ix" : cl_device_ix, "start" : start, "end" : end,
+            "anim_data" : salient_api.SalientPoses.get_animation_data(start, end),
+            "dimensions" : salient_api.SalientPoses.get_dimensions(),
+            "fixed_keyframes" : fixed_keyframes, "backend" : backend,
+        }, parent=self)
+        self.worker.progressed.connect(self.show_progress)
+        self.worker.selected.connect(self.add_selections)
+        self.worker.succeeded.connect(lambda: self.finish_select("Done"))
+        self.worker.failed.connect(lambda message: self.finish_select("Failed: %s" % message))
+        self.worker.cancelled.connect(lambda: self.finish_select("Cancelled"))
+        self.evaluate_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.status_label.setText("Sampled, analysing")
+        self.worker.start()
+
+    def cancel_select(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.status_label.setText("Cancelling")
+
+    def show_progress(self, stage, count, total, error):
+        if stage == "table":
+            self.status_label.setText("Analysing %d%%" % (100 * count // max(total, 1)))
+        else:
+            self.status_label.setText("%d keyframes, error %2.4f" % (count, error))
+
+    def finish_select(self, status):
+        if self.worker is not None:
+            self.worker.wait()
+            self.worker = None
+        self.evaluate_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        self.status_label.setText(status)
+
+    def add_selections(self, results):
+        if self.selections is None:
+            self.selections = salient_selections.SelectionTable.empty()
+        for (n_keyframes, error, selection) in results:
+            self.selections.append(n_keyframes, error, selection)
 
+        self.n_keyframes_slider.setRange(*self.get_keyframe_range())
         self.update_visualization()
 
+    def set_selections(self, selections):
+        self.finish_select("Done" if len(selections) > 0 else "No selections")
+        self.selections = selections
+
+        # Update slider bounds
+        if len(selections) > 0:
+            self.n_keyframes_slider.setRange(*self.get_keyframe_range())
+            self.update_visualization()
+
     def do_reduce(self):
         objects = cmds.ls(selection=True)
 
@@ -209,7 +373,7 @@ class SalientPosesDialog(MayaQWidgetDockableMixin, QtWidgets.QWidget):
 
         # Get configuration of selection
         n_keyframes = self.n_keyframes_slider.value()
-        selection = self.selections[n_keyframes]["selection"]
+        selection = self.get_selection_of_n_keyframes(n_keyframes)
         start = selection[0]
         end = selection[-1]
 
@@ -229,26 +393,23 @@ class SalientPosesDialog(MayaQWidgetDockableMixin, QtWidgets.QWidget):
         n = n_keyframes if n_keyframes != -1 else self.n_keyframes_slider.value()
 
         if normalized:
-            min_n = min(self.selections.keys())
-            return self.selections[n]["error"] / self.selections[min_n]["error"]
+            min_n = self.get_keyframe_range()[0]
+            return self.selections.get_error(n) / self.selections.get_error(min_n)
         else:
-            return self.selections[n]["error"]
+            return self.selections.get_error(n)
 
     def get_selection_of_n_keyframes(self, n_keyframes):
-        return self.selections[n_keyframes]["selection"]
+        return self.selections.get_selection(n_keyframes)
 
     def get_keyframe_range(self):
-        return min(self.selections.keys()), max(self.selections.keys())
+        return self.selections.get_keyframe_range()
 
     def update_visualization(self):
         
-        # Get data for error graph
+        # Get data for error graph (computed once per evaluation)
         n_keyframes = self.n_keyframes_slider.value()
         self.error_edit.setText("%2.4f" % self.get_error(n_keyframes, normalized=False))
-        min_keyframes, max_keyframes = self.get_keyframe_range()
-        xs = [float(n - min_keyframes) / float(max_keyframes - min_keyframes) for n in range(min_keyframes, max_keyframes + 1)]
-        ys = [self.get_error(n, normalized=True) for n in range(min_keyframes, max_keyframes + 1)]
-        points = list(zip(xs, ys))
+        points = self.selections.get_error_curve()
 
         # Submit data to make error graph
         self.painter.reset_drawing_fns()
@@ -274,14 +435,14 @@ class SalientPosesDialog(MayaQWidgetDockableMixin, QtWidgets.QWidget):
     def set_n_keyframes_via_text(self):
         value = int(self.n_keyframes_edit.text())
         self.n_keyframes_slider.setValue(value)
-        if len(self.selections) > 0:
+        if self.selections is not None:
             self.error_edit.setText("%2.4f" % self.get_error(self.n_keyframes_slider.value(), normalized=False))
             self.update_visualization()
             self.repaint()
 
     def set_n_keyframes_via_slider(self, value):
         self.n_keyframes_edit.setText(str(value))
-        if len(self.selections) > 0:
+        if self.selections is not None:
             self.error_edit.setText("%2.4f" % self.get_error(self.n_keyframes_slider.value(), normalized=False))
             self.update_visualization()
             self.repaint()
@@ -0,0 +1,140 @@
+"""
+Batched curve fitting for the reduction step, using NumPy.
+
+Given every curve sampled at every frame and a selection of keyframes, each
+segment between consecutive keyframes is fitted with a cubic Bezier that passes
+through the two keyframes' values, with its inner control points at a third and
+two thirds of the way along in time. Because the selection is shared, the fit
+for a segment of a given length is the same linear map for every curve, so all
+curves (and all segments of that length) are solved at once.
+
+This reproduces the fit of the plug-in's salientReduce, which samples each
+curve in single precision before fitting it (keeping the keyframe values in
+double precision), whereas every step here is in double precision. So the
+keyframe values of the two should match exactly and their tangents differ by
+about single-precision rounding of the curves' values; anything more means
+the fits disagree. salient_api.compare_reduction measures the difference on a
+rig in Maya.
+"""
+import numpy as np
+
+import salient_curves
+
+
+def bezier_basis(length):
+    """
+    Bernstein basis (length + 1 rows, 4 columns) for the frames of a segment.
+    """
+    u = np.arange(length + 1, dtype=np.float64) / length
+    v = 1.0 - u
+    return np.stack([v * v * v, 3.0 * u * v * v, 3.0 * u * u * v, u * u * u], axis=1)
+
+
+def fit_segments(data, selection):
+    """
+    Fits every segment of the selection for every curve, where data holds the
+    curves sampled at each frame (n_frames x n_curves) and the selection gives
+    keyframes as indices into its rows.
+
+    Returns the inner control values (n_segments x n_curves each) of the
+    Bezier for each segment.
+    """
+    selection = np.asarray(selection)
+    starts, ends = selection[:-1], selection[1:]
+    lengths = ends - starts
+    inner_left = np.empty((len(starts), data.shape[1]))
+    inner_right = np.empty((len(starts), data.shape[1]))
+
+    for length in np.unique(lengths):
+        segments = np.nonzero(lengths == length)[0]
+        left = data[starts[segments]]
+        right = data[ends[segments]]
+
+        # Fit the deviation from a straight line through the keyframes, as the
+        # minimum-norm least-squares solution (segments of length one or two
+        # leave the inner control points under-determined)
+        basis = bezier_basis(length)[1:-1]
+        offsets = np.zeros((len(segments), 2, data.shape[1]))
+        if length > 1:
+            frames = starts[segments][:, None] + np.arange(1, length)[None, :]
+            u = (np.arange(1, length, dtype=np.float64) / length)[None, :, None]
+            residuals = data[frames] - (left[:, None, :] + u * (right - left)[:, None, :])
+            offsets = np.einsum("ki,gic->gkc", np.linalg.pinv(basis[:, 1:3]), residuals)
+
+        inner_left[segments] = left + (right - left) / 3.0 + offsets[:, 0]
+        inner_right[segments] = left + 2.0 * (right - left) / 3.0 + offsets[:, 1]
+    return inner_left, inner_right
+
+
+def fit_tangents(data, selection, seconds_per_frame):
+    """
+    Fits the curves and converts each segment's Bezier handles into Maya
+    tangents: angles in radians and weights being the handle's length, both
+    measured with time in seconds (as expected by MFnAnimCurve).
+
+    Returns the out-tangents of each segment's left keyframe and the in-tangents
+    of its right keyframe as (angles, weights) pairs of n_segments x n_curves.
+    """
+    selection = np.asarray(selection)
+    inner_left, inner_right = fit_segments(data, selection)
+
+    handle_times = ((selection[1:] - selection[:-1]) * seconds_per_frame / 3.0)[:, None]
+    out_rise = inner_left - data[selection[:-1]]
+    in_rise = data[selection[1:]] - inner_right
+
+    outs = (np.arctan2(out_rise, handle_times), np.hypot(out_rise, handle_times))
+    ins = (np.arctan2(in_rise, handle_times), np.hypot(in_rise, handle_times))
+    return outs, ins
+
+
+def reduce_channels(data, selection, start=0, seconds_per_frame=1.0 / 24.0, channels=None):
+    """
+    Reduces every channel of data (n_frames x n_channels, sampled at each frame
+    from `start`, in internal units as salientReduce fits them) to the selection of
+    keyframes (given as frames), without Maya.
+
+    Returns ReducedCurves holding the keyframe times and, for each channel, the
+    keyframe values and fitted tangents, ready to be written to a file and
+    applied with salient_api.apply_reduced_curves.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    if data.ndim == 1:
+        data = data[:, None]
+    keys = np.asarray(selection, dtype=np.int32) - start
+    if keys[0] < 0 or keys[-1] >= data.shape[0]:
+        raise ValueError("The selection %d-%d is outside the %d frames from %d" % (selection[0], selection[-1], data.shape[0], start))
+    if channels is None:
+        channels = ["channel%d" % c for c in range(data.shape[1])]
+
+    (out_angles, out_weights), (in_angles, in_weights) = fit_tangents(data, keys, seconds_per_frame)
+    return salient_curves.ReducedCurves(
+        channels, np.asarray(selection, dtype=np.int32), data[keys].ravel(),
+        out_angles.ravel(), out_weights.ravel(), in_angles.ravel(), in_weights.ravel(), seconds_per_frame)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Reduce curves sampled at every frame to a selection of keyframes.")
+    parser.add_argument("data", help=".npy file of n_frames x n_channels values")
+    parser.add_argument("selection", help="Comma-separated keyframes, or a JSON file holding a list of them")
+    parser.add_argument("output", help="Reduced curves file to write")
+    parser.add_argument("--start", type=int, default=0, help="Frame of the first row of the data")
+    parser.add_argument("--fps", type=float, default=24.0, help="Frames per second of the data")
+    parser.add_argument("--channels", default=None, help="JSON file listing a name per channel (e.g. joint.rotateX)")
+    args = parser.parse_args()
+
+    if args.selection.endswith(".json"):
+        with open(args.selection) as f:
+            selection = json.load(f)
+    else:
+        selection = [int(v) for v in args.selection.split(",")]
+    channels = None
+    if args.channels is not None:
+        with open(args.channels) as f:
+            channels = json.load(f)
+
+    reduced = reduce_channels(np.load(args.data, mmap_mode="r"), selection, args.start, 1.0 / args.fps, channels)
+    with open(args.output, "wb") as f:
+        reduced.write(f)
@@ -0,0 +1,337 @@
+"""
+Compact storage for the selections produced by salientSelect.
+
+All selections are kept in one flat int32 buffer (the selection of n keyframes
+occupies n consecutive entries) with one error per keyframe count, and a
+selection is only turned into a Python list when it is asked for. The same
+binary layout is written by salientSelect and used by the selection cache.
+"""
+import array
+import copy
+import struct
+
+MAGIC = b"SPSC"
+VERSION = 1
+
+# magic, version, number of selections, and a reserved field (always 0)
+HEADER = struct.Struct("=4sIII")
+
+
+class SelectionTable:
+    """
+    Read-only mapping from the number of keyframes to { "selection", "error" },
+    behaving like the dictionary that select_keyframes used to return.
+
+    The counts, errors, and frames may be array.array or NumPy arrays (of int32,
+    float64, and int32 respectively).
+    """
+
+    def __init__(self, counts, errors, frames):
+        self.counts = counts
+        self.errors = errors
+        self.frames = frames
+        self.error_curves = {}
+
+        # For approximate selections, a lower bound on each exact error (aligned with counts)
+        self.lower_bounds = None
+
+        self.indices = {}
+        self.offsets = []
+        offset = 0
+        for (i, n) in enumerate(counts):
+            self.indices[int(n)] = i
+            self.offsets.append(offset)
+            offset += int(n)
+
+    @staticmethod
+    def empty():
+        return SelectionTable(array.array("i"), array.array("d"), array.array("i"))
+
+    @staticmethod
+    def from_dict(selections):
+        counts = sorted(selections.keys())
+        frames = array.array("i")
+        for n in counts:
+            frames.extend(selections[n]["selection"])
+        errors = array.array("d", [selections[n]["error"] for n in counts])
+        return SelectionTable(array.array("i", counts), errors, frames)
+
+    @staticmethod
+    def read(f):
+        magic, version, n_selections, _ = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise IOError("Not a selection file (or written by another version)")
+
+        counts = array.array("i")
+        counts.fromfile(f, n_selections)
+        errors = array.array("d")
+        errors.fromfile(f, n_selections)
+        frames = array.array("i")
+        frames.fromfile(f, sum(counts))
+        return SelectionTable(counts, errors, frames)
+
+    def write(self, f):
+        """
+        Writes the table to an open binary file.
+        """
+        f.write(HEADER.pack(MAGIC, VERSION, len(self.counts), 0))
+        self.counts.tofile(f)
+        self.errors.tofile(f)
+        self.frames.tofile(f)
+
+    def append(self, n_keyframes, error, selection):
+        """
+        Adds the selection for one more number of keyframes (larger than any
+        already held), for tables being filled as selections are computed.
+        The table's arrays must be array.array.
+        """
+        self.indices[n_keyframes] = len(self.counts)
+        self.offsets.append(len(self.frames))
+        self.counts.append(n_keyframes)
+        self.errors.append(error)
+        self.frames.extend(selection)
+        self.error_curves = {}
+
+    def get_selection(self, n_keyframes):
+        offset = self.offsets[self.indices[n_keyframes]]
+        return [int(v) for v in self.frames[offset:offset + n_keyframes]]
+
+    def get_error(self, n_keyframes):
+        return float(self.errors[self.indices[n_keyframes]])
+
+    def get_error_bound(self, n_keyframes):
+        """
+        Returns the range (lower, upper) within which the error of the exact
+        selection of n keyframes lies; both are the error for exact tables.
+        """
+        error = self.get_error(n_keyframes)
+        if self.lower_bounds is None:
+            return error, error
+        return float(self.lower_bounds[self.indices[n_keyframes]]), error
+
+    def get_keyframe_range(self):
+        """
+        Returns the fewest and most keyframes selected, or None when the table
+        holds no selections.
+        """
+        if len(self.counts) == 0:
+            return None
+        return int(self.counts[0]), int(self.counts[-1])
+
+    def at_least(self, min_keyframes):
+        """
+        Returns the table from its first selection of at least min_keyframes
+        keyframes, or the table itself when every selection has that many.
+        """
+        first = len([n for n in self.counts if n < min_keyframes])
+        if first == 0:
+            return self
+        frames = self.frames[self.offsets[first]:] if first < len(self.counts) else self.frames[:0]
+        table = SelectionTable(self.counts[first:], self.errors[first:], frames)
+        if self.lower_bounds is not None:
+            table.lower_bounds = self.lower_bounds[first:]
+        return table
+
+    def up_to_error(self, max_error):
+        """
+        Returns the table up to and including its first selection whose error is
+        within max_error (where a selection stopping at max_error ends), or the
+        table itself when that is its last selection or there is none.
+        """
+        within = [i for (i, error) in enumerate(self.errors) if error <= max_error]
+        if len(within) == 0 or within[0] == len(self.counts) - 1:
+            return self
+        last = within[0]
+        table = SelectionTable(self.counts[:last + 1], self.errors[:last + 1], self.frames[:self.offsets[last] + int(self.counts[last])])
+        if self.lower_bounds is not None:
+            table.lower_bounds = self.lower_bounds[:last + 1]
+        return table
+
+    def get_error_curve(self, max_points=512):
+        """
+        Returns points (x, y) of the error against the number of keyframes, where
+        x spans [0, 1] over the keyframe range and y is the error relative to that
+        of the fewest keyframes. Long curves are thinned to at most max_points.
+        """
+        if len(self.counts) == 0:
+            return []
+        if max_points not in self.error_curves:
+            n = len(self.counts)
+            stride = max(1, -(-n // max_points))
+            ixs = list(range(0, n, stride))
+            if ixs[-1] != n - 1:
+                ixs.append(n - 1)
+
+            min_n, max_n = self.get_keyframe_range()
+            span = float(max(max_n - min_n, 1))
+            base = float(self.errors[0]) if self.errors[0] != 0 else 1.0
+            self.error_curves[max_points] = [((int(self.counts[i]) - min_n) / span, float(self.errors[i]) / base) for i in ixs]
+        return self.error_curves[max_points]
+
+    def to_dict(self):
+        return dict((n, self[n]) for n in self.keys())
+
+    def keys(self):
+        return sorted(self.indices.keys())
+
+    def __getitem__(self, n_keyframes):
+        return { "selection" : self.get_selection(n_keyframes), "error" : self.get_error(n_keyframes) }
+
+    def __contains__(self, n_keyframes):
+        return n_keyframes in self.indices
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class StitchedSelectionTable(SelectionTable):
+    """
+    Selections over consecutive chunks of a take, where each chunk's last frame
+    is the next chunk's first frame (so these seams are always keyframes).
+
+    Starting from the fewest keyframes in every chunk, each additional keyframe
+    goes to the chunk with the largest error, giving one selection per total
+    number of keyframes. Only the order of these increments is stored, and a
+    selection is assembled from the chunks' own tables when it is asked for.
+    When any chunk is approximate, each step's lower bound is the largest of
+    the chunks' lower bounds.
+    """
+
+    def __init__(self, chunks, max_keyframes=None):
+        self.chunks = chunks
+        self.base_counts = [chunk.get_keyframe_range()[0] for chunk in chunks]
+        first = sum(self.base_counts) - (len(chunks) - 1)
+        n_keyframes = first
+
+        current = list(self.base_counts)
+        chunk_errors = [chunk.get_error(n) for (chunk, n) in zip(chunks, current)]
+        chunk_lower_bounds = [chunk.get_error_bound(n)[0] for (chunk, n) in zip(chunks, current)]
+        errors = array.array("d", [max(chunk_errors)])
+        lower_bounds = array.array("d", [max(chunk_lower_bounds)])
+        self.steps = array.array("i")
+        while max_keyframes is None or n_keyframes < max_keyframes:
+            growable = [k for k in range(len(chunks)) if current[k] < chunks[k].get_keyframe_range()[1]]
+            if len(growable) == 0:
+                break
+            k = max(growable, key=lambda k: chunk_errors[k])
+            current[k] += 1
+            chunk_errors[k] = chunks[k].get_error(current[k])
+            chunk_lower_bounds[k] = chunks[k].get_error_bound(current[k])[0]
+            self.steps.append(k)
+            errors.append(max(chunk_errors))
+            lower_bounds.append(max(chunk_lower_bounds))
+            n_keyframes += 1
+
+        counts = array.array("i", range(first, first + len(errors)))
+        SelectionTable.__init__(self, counts, errors, None)
+        if any(chunk.lower_bounds is not None for chunk in chunks):
+            self.lower_bounds = lower_bounds
+
+    def get_selection(self, n_keyframes):
+        current = list(self.base_counts)
+        for k in self.steps[:self.indices[n_keyframes]]:
+            current[k] += 1
+
+        selection = self.chunks[0].get_selection(current[0])
+        for (chunk, n) in zip(self.chunks[1:], current[1:]):
+            selection += chunk.get_selection(n)[1:]
+        return selection
+
+    def at_least(self, min_keyframes):
+        first = len([n for n in self.counts if n < min_keyframes])
+        if first == 0:
+            return self
+
+        # Start from the chunks' counts after the increments dropped
+        table = copy.copy(self)
+        table.base_counts = list(self.base_counts)
+        for k in self.steps[:first]:
+            table.base_counts[k] += 1
+        table.steps = self.steps[first:]
+        SelectionTable.__init__(table, self.counts[first:], self.errors[first:], None)
+        if self.lower_bounds is not None:
+            table.lower_bounds = self.lower_bounds[first:]
+        return table
+
+    def to_table(self):
+        """
+        Returns the selections materialised as a plain SelectionTable.
+        """
+        table = SelectionTable.from_dict(self.to_dict())
+        table.lower_bounds = self.lower_bounds
+        return table
+
+    def write(self, f):
+        self.to_table().write(f)
+
+
+def choose_seam(anim_data, width, start, lo, hi):
+    """
+    Chooses the frame in lo + 1 .. hi - 1 farthest from the segment joining the
+    poses at lo and hi (the pose most likely to be kept as a keyframe), given the
+    flat animation buffer with `width` values per frame beginning at `start`.
+    """
+    def pose(frame):
+        ix = (frame - start) * width
+        return anim_data[ix:ix + width]
+
+    a = pose(lo)
+    u = [v - w for (v, w) in zip(pose(hi), a)]
+    uu = sum(v * v for v in u)
+
+    best, best_distance = (lo + hi) // 2, -1.0
+    for frame in range(lo + 1, hi):
+        d = [v - w for (v, w) in zip(pose(frame), a)]
+        t = min(max(sum(v * w for (v, w) in zip(d, u)) / uu, 0.0), 1.0)
+        distance = sum((v - t * w) ** 2 for (v, w) in zip(d, u))
+        if distance > best_distance:
+            best, best_distance = frame, distance
+    return best
+
+
+def select_windowed(select_range, anim_data, width, start, end, fixed_keyframes, window, overlap=None, max_keyframes=None, max_error=None):
+    """
+    Selects keyframes over a long take one chunk at a time, so that memory is
+    bounded by the window rather than the length of the take.
+
+    Chunks are up to `window` frames long. The last `overlap` frames of each
+    chunk (a quarter of the window by default) are where the seam with the next
+    chunk is chosen, except when a fixed keyframe already lies there. Each chunk
+    is selected by select_range(chunk_start, chunk_end, fixed_keyframes,
+    max_keyframes, max_error), which returns a SelectionTable, and the results
+    are stitched together.
+
+    Each chunk stops at the most keyframes it could have in a stitched selection
+    of max_keyframes (with every other chunk at its fewest), and at its first
+    selection within max_error, as the stitched error is the largest of the
+    chunks' errors.
+    """
+    if window < 3:
+        raise ValueError("The window must be at least three frames long")
+    if overlap is None:
+        overlap = window // 4
+    overlap = max(1, min(overlap, window // 2))
+
+    # Choose every seam first, as each chunk's budget depends on the others
+    ranges = []
+    lo = start
+    while lo < end:
+        hi = min(lo + window - 1, end)
+        if hi < end:
+            zone = [f for f in fixed_keyframes if hi - overlap < f < hi]
+            hi = max(zone) if len(zone) > 0 else choose_seam(anim_data, width, start, hi - overlap, hi)
+        ranges.append((lo, hi, [f for f in fixed_keyframes if lo < f < hi]))
+        lo = hi
+
+    # Seams are shared, so a stitched selection has one keyframe fewer per seam
+    fewest = [2 + len(fixed) for (_, _, fixed) in ranges]
+    chunks = []
+    for (k, (lo, hi, fixed)) in enumerate(ranges):
+        chunk_max_keyframes = None
+        if max_keyframes is not None:
+            chunk_max_keyframes = max(fewest[k], max_keyframes + len(ranges) - 1 - (sum(fewest) - fewest[k]))
+        chunks.append(select_range(lo, hi, fixed, chunk_max_keyframes, max_error))
+    return StitchedSelectionTable(chunks, max_keyframes)
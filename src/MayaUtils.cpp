@@ -5,6 +5,7 @@
 //  Created by Richard Roberts on 3/04/18.
 //
 
+#include <iomanip>
 #include <sstream>
 
 #include <maya/MGlobal.h>
@@ -117,3 +118,52 @@ MAngle::Unit MayaConfig::getCurrentAngleUnit() {
     return MAngle::uiUnit();
 }
 
+
+Profiler::Stage& Profiler::stage(const std::string& name) {
+    for (int i = 0; i < _stages.size(); i++) {
+        if (_stages[i].name == name) { return _stages[i]; }
+    }
+    Stage added = { name, 0.0, 0.0 };
+    _stages.push_back(added);
+    return _stages.back();
+}
+
+void Profiler::begin(const std::string& name) {
+    end();
+    stage(name);
+    _current = name;
+    _began = std::chrono::steady_clock::now();
+}
+
+void Profiler::end() {
+    if (_current.empty()) { return; }
+    std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - _began;
+    stage(_current).seconds += elapsed.count();
+    _current.clear();
+}
+
+void Profiler::addBytes(const std::string& name, double bytes) {
+    stage(name).bytes += bytes;
+}
+
+std::string Profiler::asJson() const {
+    std::ostringstream os;
+    os << std::setprecision(9) << "{";
+    for (int i = 0; i < _stages.size(); i++) {
+        if (i > 0) { os << ", "; }
+        os << "\"" << _stages[i].name << "\": {\"seconds\": " << _stages[i].seconds << ", \"bytes\": " << _stages[i].bytes << "}";
+    }
+    os << "}";
+    return os.str();
+}
+
+void Profiler::logSummary(const std::string& title) const {
+    std::ostringstream os;
+    os << title << " profile:" << std::setprecision(4) << std::fixed;
+    for (int i = 0; i < _stages.size(); i++) {
+        os << "\n  " << std::left << std::setw(12) << _stages[i].name << std::right
+           << std::setw(10) << _stages[i].seconds << "s" << std::setw(14) << std::setprecision(0) << _stages[i].bytes << " bytes"
+           << std::setprecision(4);
+    }
+    Log::print(os.str());
+}
@@ -8,6 +8,10 @@
 #ifndef MayaUtils_hpp
 #define MayaUtils_hpp
 
+#include <chrono>
+#include <string>
+#include <vector>
+
 #include <maya/MString.h>
 #include <maya/MObject.h>
 #include <maya/MStatus.h>
@@ -60,5 +64,28 @@ public:
     static MAngle::Unit getCurrentAngleUnit();
 };
 
+// Accumulates the time spent in (and bytes handled by) named stages of a command,
+// for the opt-in profiling mode of salientSelect and salientReduce.
+class Profiler {
+public:
+    Profiler() {}
+    void begin(const std::string& name);
+    void end();
+    void addBytes(const std::string& name, double bytes);
+    std::string asJson() const;
+    void logSummary(const std::string& title) const;
+    
+private:
+    struct Stage {
+        std::string name;
+        double seconds;
+        double bytes;
+    };
+    std::vector<Stage> _stages;
+    std::string _current;
+    std::chrono::steady_clock::time_point _began;
+    Stage& stage(const std::string& name);
+};
+
 
 #endif /* MayaUtils_hpp */
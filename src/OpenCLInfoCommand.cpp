@@ -9,15 +9,29 @@
 #include <vector>
 
 #include <maya/MGlobal.h>
+#include <maya/MArgDatabase.h>
 
 #include "../SalientPosesPerformance/src/OpenCLProcess.hpp"
 #include "OpenCLInfoCommand.hpp"
+#include "SelectCommand.hpp"
 
 // Set name and flags
 const char* OpenCLInfoCommand::kName = "salientOpenCLInfo";
+const char* OpenCLInfoCommand::kSecondsSavedFlagShort = "-ss";
+const char* OpenCLInfoCommand::kSecondsSavedFlagLong = "-secondsSaved";
 
 MStatus OpenCLInfoCommand::doIt(const MArgList& args) {
     MStatus status;
+    
+    // With -secondsSaved, return the OpenCL set-up time that salientSelect has
+    // avoided by keeping the platform and device it last used
+    MArgDatabase argData(syntax(), args, &status);
+    CHECK_MSTATUS_AND_RETURN_IT(status);
+    if (argData.isFlagSet(kSecondsSavedFlagShort)) {
+        setResult(SelectCommand::secondsSaved);
+        return MS::kSuccess;
+    }
+    
     std::vector<std::string> info = OpenCLProcessManager::getInfo();
     std::string ret = "";
     for (int i = 0; i < info.size(); i++) {
@@ -29,5 +43,6 @@ MStatus OpenCLInfoCommand::doIt(const MArgList& args) {
 
 MSyntax OpenCLInfoCommand::newSyntax() {
     MSyntax syntax;
+    syntax.addFlag(kSecondsSavedFlagShort, kSecondsSavedFlagLong);
     return syntax;
 }
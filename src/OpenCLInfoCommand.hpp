@@ -25,6 +25,8 @@ public:
     static MSyntax newSyntax();
     
     const static char* kName;
+    const static char* kSecondsSavedFlagShort;
+    const static char* kSecondsSavedFlagLong;
 };
 
 
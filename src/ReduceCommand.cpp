@@ -5,6 +5,7 @@
 //  Created by Richard Roberts on 3/04/18.
 //
 
+#include <algorithm>
 #include <sstream>
 #include <vector>
 
@@ -22,6 +23,8 @@
 #include <maya/MDataHandle.h>
 #include <maya/MFnTypedAttribute.h>
 #include <maya/MAngle.h>
+#include <maya/MTimeArray.h>
+#include <maya/MDoubleArray.h>
 
 #include "../eigen-git-mirror/Eigen/Eigen"
 
@@ -40,13 +43,56 @@ const char* ReduceCommand::kFinishFlagShort = "-f";
 const char* ReduceCommand::kFinishFlagLong = "-finish";
 const char* ReduceCommand::kSelectionFlagShort = "-sel";
 const char* ReduceCommand::kSelectionFlagLong = "-selection";
+const char* ReduceCommand::kProfileFlagShort = "-p";
+const char* ReduceCommand::kProfileFlagLong = "-profile";
 const char* ReduceCommand::kHelpFlagShort = "-h";
 const char* ReduceCommand::kHelpFlagLong = "-help";
 
+// A key outside of the reduced range, saved so it survives rebuilding the curve
+struct OutsideKey {
+    MTime time;
+    double value;
+    MFnAnimCurve::TangentType inType;
+    MFnAnimCurve::TangentType outType;
+    MAngle inAngle;
+    MAngle outAngle;
+    double inWeight;
+    double outWeight;
+    bool tangentsLocked;
+    bool weightsLocked;
+    
+    static OutsideKey fromCurve(MFnAnimCurve& curve, unsigned int ix) {
+        OutsideKey key;
+        key.time = curve.time(ix);
+        key.value = curve.value(ix);
+        key.inType = curve.inTangentType(ix);
+        key.outType = curve.outTangentType(ix);
+        curve.getTangent(ix, key.inAngle, key.inWeight, true);
+        curve.getTangent(ix, key.outAngle, key.outWeight, false);
+        key.tangentsLocked = curve.tangentsLocked(ix);
+        key.weightsLocked = curve.weightsLocked(ix);
+        return key;
+    }
+    
+    void restore(MFnAnimCurve& curve, unsigned int ix) const {
+        curve.setTangentsLocked(ix, false);
+        curve.setWeightsLocked(ix, false);
+        curve.setAngle(ix, inAngle, true);
+        curve.setAngle(ix, outAngle, false);
+        curve.setWeight(ix, inWeight, true);
+        curve.setWeight(ix, outWeight, false);
+        curve.setInTangentType(ix, inType);
+        curve.setOutTangentType(ix, outType);
+        curve.setTangentsLocked(ix, tangentsLocked);
+        curve.setWeightsLocked(ix, weightsLocked);
+    }
+};
+
 void DisplayHelp() {
     MString help;
     help += "Flags:\n";
     help += "-inputs (-i)         N/A        Inputs to the command.\n";
+    help += "-profile (-p)        Int        1 returns the time spent in each stage as JSON, 2 also logs it.\n";
     help += "-help   (-h)         N/A        Display this text.\n";
     MGlobal::displayInfo(help);
 }
@@ -55,6 +101,8 @@ MStatus ReduceCommand::doIt(const MArgList& args) {
     MStatus status;
     
     // Process arguments
+    Profiler profiler;
+    profiler.begin("arguments");
     status = GatherCommandArguments(args);
     CHECK_MSTATUS_AND_RETURN_IT(status);
     
@@ -77,17 +125,36 @@ MStatus ReduceCommand::doIt(const MArgList& args) {
         return MS::kFailure;
     }
     
-    // Ensure the selection contains at least two keyframes
+    // Keyframes are rebuilt in order, so sort the selection and drop repeated frames
+    std::sort(_selection.begin(), _selection.end());
+    _selection.erase(std::unique(_selection.begin(), _selection.end()), _selection.end());
+    
+    // Ensure the selection contains at least two keyframes, all within the range
     if (_selection.size() < 2) {
         Log::error("At least two keyframes must be selected.");
         return MS::kFailure;
     }
+    if (_selection.front() < _start || _selection.back() > _finish) {
+        std::ostringstream os;
+        os << "The selection (" << _selection.front() << "-" << _selection.back() << ") must lie within the range (" << _start << "-" << _finish << ")";
+        Log::error(os.str());
+        return MS::kFailure;
+    }
     
     int nFrames = _finish - _start + 1;
     
+    // Mark which frames of the range are keyframes once, rather than searching
+    // the selection for every frame of every curve
+    std::vector<bool> isKeyframe(nFrames, false);
+    for (int s : _selection) {
+        isKeyframe[s - _start] = true;
+    }
+    
     MTime::Unit timeUnit = MayaConfig::getCurrentFPS();
     MAngle::Unit angleUnit = MayaConfig::getCurrentAngleUnit();
     bool usingDegrees = angleUnit == MAngle::kDegrees;
+    MTime startTime((double) _start, timeUnit);
+    MTime finishTime((double) _finish, timeUnit);
     
     while (!iter.isDone()) {
         MObject mobj;
@@ -105,53 +172,86 @@ MStatus ReduceCommand::doIt(const MArgList& args) {
             
             bool isAngluar = curve.animCurveType() == MFnAnimCurve::kAnimCurveTA;
             
-            // Cache the curve data
+            // Cache the curve data, keeping the values (in internal units) of the keyframes
+            // in double precision, as stored on the (baked) keys, so that they do not move
+            profiler.begin("sampling");
             std::vector<float> data;
+            std::vector<double> keyframeValues;
             for (int i = _start; i < _finish + 1; i++) {
                 MTime time((double) (i), timeUnit);
-                float v = curve.evaluate(time);
+                double v;
+                unsigned int keyIx;
+                if (curve.find(time, keyIx)) {
+                    v = curve.value(keyIx);
+                } else {
+                    curve.evaluate(time, v);
+                }
+                
+                if (isKeyframe[i - _start]) {
+                    keyframeValues.push_back(v);
+                }
                 
                 if (isAngluar && usingDegrees) {
-                    data.push_back(v * RAD_TO_DEG);
+                    data.push_back((float) (v * RAD_TO_DEG));
                 } else {
-                    data.push_back(v);
+                    data.push_back((float) v);
                 }
                 
             }
             
+            profiler.addBytes("sampling", (double) (data.size() * sizeof(float)));
+            
+            profiler.begin("fitting");
             std::string name = curve.name().asChar();
             Interpolator interpolator = Interpolator::fromData(name, data, _selection, nFrames, _start);
             std::vector<Cubic> cubics = interpolator.getCubics();
             
-            // Remove non-keyframes
-            for (int j = _start; j < _finish; j++) {
-                bool j_in_sel = std::find(_selection.begin(), _selection.end(), j) != _selection.end();
-                if (!j_in_sel) {
-                    MTime t((double) j,timeUnit);
-                    unsigned int ix = curve.findClosest(t);
-                    curve.remove(ix);
+            // Keep the keys outside of the range as they are
+            profiler.begin("rebuild");
+            std::vector<OutsideKey> before;
+            std::vector<OutsideKey> after;
+            for (unsigned int i = 0; i < curve.numKeys(); i++) {
+                MTime t = curve.time(i);
+                if (t < startTime) {
+                    before.push_back(OutsideKey::fromCurve(curve, i));
+                } else if (t > finishTime) {
+                    after.push_back(OutsideKey::fromCurve(curve, i));
+                }
+            }
+            
+            // Rebuild the curve's keys in one edit, with only the keyframes left in the range
+            MTimeArray times;
+            MDoubleArray values;
+            for (const OutsideKey& key : before) { times.append(key.time); values.append(key.value); }
+            int keyframeIx = 0;
+            for (int i = _start; i < _finish + 1; i++) {
+                if (isKeyframe[i - _start]) {
+                    times.append(MTime((double) i, timeUnit));
+                    values.append(keyframeValues[keyframeIx++]);
                 }
             }
+            for (const OutsideKey& key : after) { times.append(key.time); values.append(key.value); }
+            curve.addKeys(&times, &values, MFnAnimCurve::kTangentFixed, MFnAnimCurve::kTangentFixed, false);
+            
+            unsigned int firstKeyframeIx = (unsigned int) before.size();
+            unsigned int firstAfterIx = firstKeyframeIx + (unsigned int) keyframeValues.size();
+            for (unsigned int i = 0; i < before.size(); i++) { before[i].restore(curve, i); }
+            for (unsigned int i = 0; i < after.size(); i++) { after[i].restore(curve, firstAfterIx + i); }
             
             // Update tangents based on fitting
+            profiler.begin("tangents");
             for (int i = 0; i < _selection.size() - 1; i++) {
                 Cubic cubic = cubics.at(i);
-                int s = _selection[i];
-                int e = _selection[i + 1];
                 
                 // Set outgoing for left keyframe
-                uint ixLeft;
-                MTime timeLeft((double) s, timeUnit);
-                curve.find(timeLeft, ixLeft);
+                uint ixLeft = firstKeyframeIx + i;
                 curve.setWeightsLocked(ixLeft, false);
                 curve.setTangentsLocked(ixLeft, false);
                 curve.setAngle(ixLeft, MAngle(cubic.angleLeft(), MAngle::kRadians), false);
                 curve.setWeight(ixLeft, cubic.weightLeft(), false);
                 
                 // Set incoming for right keyframe
-                uint ixRight;
-                MTime timeRight((double) e, timeUnit);
-                curve.find(timeRight, ixRight);
+                uint ixRight = firstKeyframeIx + i + 1;
                 curve.setWeightsLocked(ixRight, false);
                 curve.setTangentsLocked(ixRight, false);
                 
@@ -161,6 +261,13 @@ MStatus ReduceCommand::doIt(const MArgList& args) {
         }
     }
     
+    profiler.end();
+    if (_profile > 0) {
+        setResult(MString(profiler.asJson().c_str()));
+    }
+    if (_profile > 1) {
+        profiler.logSummary(kName);
+    }
     return MS::kSuccess;
 }
 
@@ -169,6 +276,7 @@ MSyntax ReduceCommand::newSyntax() {
     syntax.addFlag(kHelpFlagShort, kHelpFlagLong);
     syntax.addFlag(kStartFlagShort, kStartFlagLong, MSyntax::kLong);
     syntax.addFlag(kFinishFlagShort, kFinishFlagLong, MSyntax::kLong);
+    syntax.addFlag(kProfileFlagShort, kProfileFlagLong, MSyntax::kLong);
     syntax.addFlag(kSelectionFlagShort, kSelectionFlagLong, MSyntax::kLong);
     syntax.makeFlagMultiUse(kSelectionFlagShort);
     syntax.setObjectType(MSyntax::kSelectionList, 0, 255);
@@ -193,6 +301,10 @@ MStatus ReduceCommand::GatherCommandArguments(const MArgList& args) {
         _finish = argData.flagArgumentInt(kFinishFlagShort, 0, &status);
     }
     
+    if (argData.isFlagSet(kProfileFlagShort)) {
+        _profile = argData.flagArgumentInt(kProfileFlagShort, 0, &status);
+    }
+    
     if (argData.isFlagSet(kSelectionFlagShort)) {
         
         uint numUses = argData.numberOfFlagUses(kSelectionFlagShort);
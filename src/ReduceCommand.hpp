@@ -35,11 +35,14 @@ public:
     const static char* kFinishFlagLong;
     const static char* kSelectionFlagShort;
     const static char* kSelectionFlagLong;
+    const static char* kProfileFlagShort;
+    const static char* kProfileFlagLong;
     
 private:
     
     int _start = -1;
     int _finish = -1;
+    int _profile = 0;
     std::vector<int> _selection;
     MStatus GatherCommandArguments(const MArgList& args);
 };
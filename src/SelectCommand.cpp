@@ -5,6 +5,10 @@
 //  Created by Richard Roberts on 12/09/18.
 //
 
+#include <algorithm>
+#include <chrono>
+#include <cstdint>
+#include <fstream>
 #include <iomanip>
 #include <sstream>
 #include <vector>
@@ -24,15 +28,19 @@
 #include <maya/MFnTypedAttribute.h>
 #include <maya/MAngle.h>
 
-#include "../SalientPosesPerformance/src/OpenCLProcess.hpp"
 #include "SelectCommand.hpp"
 #include "MayaUtils.hpp"
+#include "../SalientPosesPerformance/src/OpenCLProcess.hpp"
 #include "../SalientPosesPerformance/src/ErrorTable.hpp"
 #include "../SalientPosesPerformance/src/SelectionManager.hpp"
 
 #define RAD_TO_DEG 57.2958279088
 
 MString SelectCommand::openCLDirectory;
+int SelectCommand::activePlatformIndex = -1;
+int SelectCommand::activeDeviceIndex = -1;
+double SelectCommand::deviceSetupSeconds = 0.0;
+double SelectCommand::secondsSaved = 0.0;
 
 // Set name and flags
 const char* SelectCommand::kName = "salientSelect";
@@ -56,13 +64,10 @@ MStatus SelectCommand::doIt(const MArgList& args) {
     MStatus status;
     
     // Process arguments
+    _profiler.begin("arguments");
     status = GatherCommandArguments(args);
     CHECK_MSTATUS_AND_RETURN_IT(status);
     
-    // Set OpenCL platform and device
-    OpenCLProcessManager::setPlatformIdToPlatformAtIndex(openCLPlatformIndex - 1);
-    OpenCLProcessManager::setDeviceIdToDeviceAtIndex(openCLDeviceIndex - 1);
-    
     // Ensure the start and end frames are given as argumetns
     if (_start == -1 || _finish == -1) {
 		std::ostringstream os;
@@ -71,14 +76,62 @@ MStatus SelectCommand::doIt(const MArgList& args) {
         return MS::kFailure;
     }
     
+    // Set the OpenCL platform and device, unless an earlier call (the plug-in
+    // stays loaded between evaluations) already set them, in which case the
+    // time that took is counted as saved
+    _profiler.begin("setup");
+    if (openCLPlatformIndex != activePlatformIndex || openCLDeviceIndex != activeDeviceIndex) {
+        std::chrono::steady_clock::time_point began = std::chrono::steady_clock::now();
+        OpenCLProcessManager::setPlatformIdToPlatformAtIndex(openCLPlatformIndex - 1);
+        OpenCLProcessManager::setDeviceIdToDeviceAtIndex(openCLDeviceIndex - 1);
+        std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - began;
+        deviceSetupSeconds = elapsed.count();
+        activePlatformIndex = openCLPlatformIndex;
+        activeDeviceIndex = openCLDeviceIndex;
+    } else {
+        secondsSaved += deviceSetupSeconds;
+    }
+    
     // Perform the selection
+    _profiler.begin("analysis");
     std::string openclProgramPath = openCLDirectory.asChar() + std::string("/kernel.cl");
     std::string openclProgramName = "max_distance_to_polyline";
 	AnimationProxy anim = AnimationProxy::fromData(_animData, _dimensions, _start, _finish);
     SelectionManager manager = SelectionManager(anim, _fixedKeyframes.data(), _fixedKeyframes.size(),
                                                 openclProgramPath, openclProgramName);
-    manager.incrementUntilNKeyframes(anim.nFrames);
+    _profiler.begin("selection");
+    int maxKeyframes = anim.nFrames;
+    if (_maxKeyframes > 0 && _maxKeyframes < anim.nFrames) {
+        maxKeyframes = _maxKeyframes;
+    }
+    
+    if (_maxError < 0) {
+        manager.incrementUntilNKeyframes(maxKeyframes);
+    } else {
+        // Double the number of keyframes until the latest selection is within the
+        // error threshold; selections past the threshold are dropped from the result.
+        int nKeyframes = 2;
+        while (true) {
+            manager.incrementUntilNKeyframes(nKeyframes);
+            SelectionProxy * proxy = manager.asProxy();
+            double error = proxy->getErrorByIndex(proxy->numberOfSelections() - 1);
+            delete proxy;
+            if (error <= _maxError || nKeyframes == maxKeyframes) { break; }
+            nKeyframes = std::min(nKeyframes * 2, maxKeyframes);
+        }
+    }
     SelectionProxy * selectionProxy = manager.asProxy();
+    int nSelections = NumberOfSelectionsToReturn(selectionProxy);
+
+    // When given an output path, write the selections in binary and return the path
+    _profiler.begin("output");
+    if (!_outputPath.empty()) {
+        status = WriteSelections(selectionProxy, nSelections);
+        delete selectionProxy;
+        CHECK_MSTATUS_AND_RETURN_IT(status);
+        setResult(MString(_outputPath.c_str()));
+        return FinishProfile();
+    }
 
     // Build string containing result (precise to four decimal places)
     std::ostringstream ret;
@@ -88,7 +141,7 @@ MStatus SelectCommand::doIt(const MArgList& args) {
     //   e|a,b,c
     //     where e is error, | is a delimiter, and a,b,c are the selection (wthout spaces).
     // Each error-selection pair is delimited by a new line.
-    for (int i = 0; i < selectionProxy->numberOfSelections(); i++) {
+    for (int i = 0; i < nSelections; i++) {
         std::vector<int> selection = selectionProxy->getSelectionByIndex(i);
         ret << selectionProxy->getErrorByIndex(i) << "|";
         ret << selection[0];
@@ -99,9 +152,10 @@ MStatus SelectCommand::doIt(const MArgList& args) {
     }
 
 	setResult(MString(ret.str().c_str()));
+    _profiler.addBytes("output", (double) ret.str().size());
 
 	delete selectionProxy;
-    return MS::kSuccess;
+    return FinishProfile();
 }
 
 MSyntax SelectCommand::newSyntax() {
@@ -145,6 +199,7 @@ MStatus SelectCommand::GatherCommandArguments(const MArgList& args) {
 	for (uint i = 0; i < mAnimData.length(); i++) {
 		_animData.push_back(mAnimData[i]);
 	}
+    _profiler.addBytes("arguments", mAnimData.length() * sizeof(double));
 
 	for (uint i = 0; i < mDimensions.length(); i++) {
 		_dimensions.push_back(mDimensions[i].asChar());
@@ -154,6 +209,105 @@ MStatus SelectCommand::GatherCommandArguments(const MArgList& args) {
         _fixedKeyframes.push_back(mFixedKeyframes[i]);
     }
     
+    // Optionally, a path to write the selections to in binary
+    MString mOutputPath = args.asString(ix, &status);
+    if (status == MS::kSuccess) {
+        _outputPath = mOutputPath.asChar();
+    }
+    ix += 1;
+    
+    // Optionally, the maximum number of keyframes and the error threshold
+    // at which to stop the selection (negative when not used)
+    int maxKeyframes = args.asInt(ix, &status);
+    if (status == MS::kSuccess) {
+        _maxKeyframes = maxKeyframes;
+    }
+    ix += 1;
+    double maxError = args.asDouble(ix, &status);
+    if (status == MS::kSuccess) {
+        _maxError = maxError;
+    }
+    ix += 1;
+    
+    // Optionally, the profiling level: 1 records the time and bytes of each stage
+    // (written next to the output path as JSON), 2 also logs a summary
+    int profile = args.asInt(ix, &status);
+    if (status == MS::kSuccess) {
+        _profile = profile;
+    }
+    ix += 1;
+    
+    return MS::kSuccess;
+}
+
+int SelectCommand::NumberOfSelectionsToReturn(SelectionProxy * selectionProxy) {
+    int nSelections = selectionProxy->numberOfSelections();
+    if (_maxError < 0) {
+        return nSelections;
+    }
+    
+    // Keep selections up to and including the first within the error threshold
+    for (int i = 0; i < nSelections; i++) {
+        if (selectionProxy->getErrorByIndex(i) <= _maxError) {
+            return i + 1;
+        }
+    }
+    return nSelections;
+}
+
+MStatus SelectCommand::WriteSelections(SelectionProxy * selectionProxy, int nSelections) {
+    
+    // The layout matches salient_selections.py: a header (magic, version, number
+    // of selections, and a reserved field that is always 0), then the number of
+    // keyframes in each selection, the errors, and all selections back-to-back.
+    std::ofstream out(_outputPath.c_str(), std::ios::binary);
+    if (!out) {
+        Log::error("Failed to open " + _outputPath + " for writing");
+        return MS::kFailure;
+    }
+    
+    std::vector<int32_t> counts;
+    std::vector<double> errors;
+    std::vector<int32_t> frames;
+    for (int i = 0; i < nSelections; i++) {
+        std::vector<int> selection = selectionProxy->getSelectionByIndex(i);
+        counts.push_back((int32_t) selection.size());
+        errors.push_back((double) selectionProxy->getErrorByIndex(i));
+        frames.insert(frames.end(), selection.begin(), selection.end());
+    }
+    
+    uint32_t version = 1;
+    uint32_t nCounts = (uint32_t) nSelections;
+    uint32_t reserved = 0;
+    out.write("SPSC", 4);
+    out.write((const char *) &version, sizeof(uint32_t));
+    out.write((const char *) &nCounts, sizeof(uint32_t));
+    out.write((const char *) &reserved, sizeof(uint32_t));
+    out.write((const char *) counts.data(), counts.size() * sizeof(int32_t));
+    out.write((const char *) errors.data(), errors.size() * sizeof(double));
+    out.write((const char *) frames.data(), frames.size() * sizeof(int32_t));
+    
+    if (!out) {
+        Log::error("Failed to write selections to " + _outputPath);
+        return MS::kFailure;
+    }
+    _profiler.addBytes("output", (double) out.tellp());
+    return MS::kSuccess;
+}
+
+MStatus SelectCommand::FinishProfile() {
+    _profiler.end();
+    if (_profile <= 0) {
+        return MS::kSuccess;
+    }
+    
+    if (!_outputPath.empty()) {
+        std::ofstream out((_outputPath + ".profile.json").c_str());
+        out << _profiler.asJson();
+    }
+    if (_profile > 1) {
+        _profiler.logSummary(kName);
+    }
     return MS::kSuccess;
 }
 
@@ -8,6 +8,7 @@
 #ifndef SelectCommand_hpp
 #define SelectCommand_hpp
 
+#include <string>
 #include <vector>
 
 #include <maya/MArgList.h>
@@ -15,6 +16,9 @@
 #include <maya/MPxCommand.h>
 #include <maya/MSelectionList.h>
 
+#include "../SalientPosesPerformance/src/SelectionProxy.hpp"
+#include "MayaUtils.hpp"
+
 
 class SelectCommand : public MPxCommand {
 public:
@@ -43,6 +47,10 @@ public:
 	const static char* kDimensionsFlagLong;
 
 	static MString openCLDirectory;
+    static int activePlatformIndex;
+    static int activeDeviceIndex;
+    static double deviceSetupSeconds;
+    static double secondsSaved;
     
 private:
     
@@ -51,9 +59,17 @@ private:
 	std::vector<float> _animData;
     std::vector<int> _fixedKeyframes;
 	std::vector<std::string> _dimensions;
+    std::string _outputPath;
+    int _maxKeyframes = -1;
+    double _maxError = -1.0;
+    int _profile = 0;
+    Profiler _profiler;
     int openCLPlatformIndex;
     int openCLDeviceIndex;
     MStatus GatherCommandArguments(const MArgList& args);
+    int NumberOfSelectionsToReturn(SelectionProxy * selectionProxy);
+    MStatus WriteSelections(SelectionProxy * selectionProxy, int nSelections);
+    MStatus FinishProfile();
 };
 
 
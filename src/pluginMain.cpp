@@ -40,6 +40,10 @@ MStatus uninitializePlugin(MObject obj) {
 
     status = plugin.deregisterCommand(ReduceCommand::kName);
     if (status != MS::kSuccess) { Log::error(std::string(ReduceCommand::kName) + " failed to deregister"); }
+
+    SelectCommand::activePlatformIndex = -1;
+    SelectCommand::activeDeviceIndex = -1;
+    SelectCommand::secondsSaved = 0.0;
     
     return status;
 }
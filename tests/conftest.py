@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+import maya_stand_in
+
+# The modules are imported by name, as Maya does from the scripts directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+# Without Maya, salient_api and the dialog run against an in-memory scene
+maya_stand_in.install()
+
+
+@pytest.fixture
+def scene():
+    maya_stand_in.SCENE.reset()
+    return maya_stand_in.SCENE
@@ -0,0 +1,539 @@
+"""
+An in-memory stand-in for the parts of Maya (and of PySide2) used by
+salient_api, salient_menu, and generate_results, so that their logic can be
+tested without Maya.
+
+The scene holds objects, whose world-space translation is a function of the
+frame, and animation curves, whose keys are kept in internal units
+(centimetres, radians, and seconds for the tangents' x) as Maya keeps them.
+Commands (maya.cmds) read and write in the scene's UI units, as Maya's do,
+while the API (maya.api) works in internal units.
+"""
+import math
+import sys
+import types
+
+# Units are given by their size in internal units (and times by frames per second)
+CENTIMETERS, INCHES, METERS = 1.0, 2.54, 100.0
+RADIANS, DEGREES = 1.0, math.pi / 180.0
+SECONDS, FILM, NTSC = 1.0, 24.0, 30.0
+
+TANGENT_NAMES = ["global", "fixed", "linear", "flat", "spline", "step", "clamped", "plateau", "stepnext", "auto"]
+
+
+class Curve(object):
+    """
+    An animation curve ("TL", "TA", or "TU") with keys ordered by time, where
+    each key is a dictionary of its time (in frames), value, in- and
+    out-tangents (x, y), tangent types, and locks.
+    """
+
+    def __init__(self, kind="TL", weighted=False):
+        self.kind = kind
+        self.weighted = weighted
+        self.keys = []
+
+    def scale(self, scene):
+        return { "TL" : scene.linear_unit, "TA" : scene.angle_unit }.get(self.kind, 1.0)
+
+    def set_keys(self, times, values, in_types=None, out_types=None, in_tangents=None, out_tangents=None, locks=None, weight_locks=None):
+        n = len(times)
+        self.keys = [{
+            "time" : float(times[i]),
+            "value" : float(values[i]),
+            "in_type" : in_types[i] if in_types is not None else 1,
+            "out_type" : out_types[i] if out_types is not None else 1,
+            "in" : tuple(in_tangents[i]) if in_tangents is not None else (1.0, 0.0),
+            "out" : tuple(out_tangents[i]) if out_tangents is not None else (1.0, 0.0),
+            "lock" : bool(locks[i]) if locks is not None else True,
+            "weight_lock" : bool(weight_locks[i]) if weight_locks is not None else True,
+        } for i in range(n)]
+        self.keys.sort(key=lambda key: key["time"])
+
+    def find(self, time):
+        for (i, key) in enumerate(self.keys):
+            if abs(key["time"] - time) < 1e-9:
+                return i
+        raise RuntimeError("No key at %g" % time)
+
+
+class Scene(object):
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.objects = {}
+        self.curves = {}
+        self.connections = {}
+        self.selection = []
+        self.joints = []
+        self.linear_unit = CENTIMETERS
+        self.angle_unit = DEGREES
+        self.fps = FILM
+        self.playback = (1, 1)
+        self.calls = []
+
+    def add_object(self, name, position, joint=False):
+        """
+        Adds an object whose world-space translation is position(frame).
+        """
+        self.objects[name] = position
+        if joint:
+            self.joints.append(name)
+
+    def add_curve(self, channel, curve):
+        """
+        Connects a curve to the channel (e.g. "hips.translateX").
+        """
+        name = channel.replace(".", "_")
+        self.curves[name] = curve
+        self.connections[channel] = name
+        return name
+
+    def curves_of(self, name):
+        if name in self.connections:
+            return [self.connections[name]]
+        return [c for (channel, c) in sorted(self.connections.items()) if channel.split(".")[0] == name]
+
+
+SCENE = Scene()
+
+
+# maya.cmds
+
+def _error(message):
+    raise RuntimeError(message)
+
+
+def _ls(*names, **flags):
+    if flags.get("selection") or flags.get("sl"):
+        return list(SCENE.selection)
+    if flags.get("type") == "joint":
+        return list(SCENE.joints)
+    return list(names)
+
+
+def _select(objects, replace=True):
+    SCENE.selection = list(objects)
+
+
+def _list_connections(name, type=None, source=True, destination=True):
+    curves = SCENE.curves_of(name)
+    return curves if len(curves) > 0 else None
+
+
+def _keys_in(curve, time=None):
+    if time is None:
+        return list(curve.keys)
+    lo, hi = time if isinstance(time, tuple) else (time, time)
+    return [key for key in curve.keys if lo - 1e-9 <= key["time"] <= hi + 1e-9]
+
+
+def _keyframe(name, query=False, time=None, timeChange=False, valueChange=False):
+    SCENE.calls.append("keyframe")
+    curve = SCENE.curves[name]
+    keys = _keys_in(curve, time)
+    if len(keys) == 0:
+        return None
+    if timeChange:
+        return [key["time"] for key in keys]
+    return [key["value"] / curve.scale(SCENE) for key in keys]
+
+
+def _ui_tangent(curve, tangent):
+    x, y = tangent
+    y = y / curve.scale(SCENE)
+    return math.atan2(y, x) / SCENE.angle_unit, math.hypot(x, y)
+
+
+def _key_tangent(name, query=False, **flags):
+    SCENE.calls.append("keyTangent")
+    curve = SCENE.curves[name]
+    if flags.get("weightedTangents"):
+        return [curve.weighted]
+    (flag, _), = flags.items()
+    fields = {
+        "inAngle" : lambda key: _ui_tangent(curve, key["in"])[0],
+        "outAngle" : lambda key: _ui_tangent(curve, key["out"])[0],
+        "inWeight" : lambda key: _ui_tangent(curve, key["in"])[1],
+        "outWeight" : lambda key: _ui_tangent(curve, key["out"])[1],
+        "inTangentType" : lambda key: TANGENT_NAMES[key["in_type"]],
+        "outTangentType" : lambda key: TANGENT_NAMES[key["out_type"]],
+        "lock" : lambda key: key["lock"],
+        "weightLock" : lambda key: key["weight_lock"],
+    }
+    return [fields[flag](key) for key in curve.keys]
+
+
+def _cut_key(name, time=None, clear=False):
+    SCENE.calls.append("cutKey")
+    curve = SCENE.curves[name]
+    if time is None:
+        # As in Maya, clearing every key deletes the curve
+        del SCENE.curves[name]
+        SCENE.connections = dict((c, n) for (c, n) in SCENE.connections.items() if n != name)
+        return
+    ranges = time if isinstance(time, list) else [time]
+    removed = [id(key) for r in ranges for key in _keys_in(curve, r)]
+    curve.keys = [key for key in curve.keys if id(key) not in removed]
+
+
+def _set_keyframe(channel, time=None):
+    name = SCENE.add_curve(channel, Curve("TA" if channel.split(".")[-1].startswith("rotate") else "TL"))
+    SCENE.curves[name].set_keys([time], [0.0])
+
+
+def _playback_options(query=False, minTime=False, maxTime=False):
+    return SCENE.playback[0] if minTime else SCENE.playback[1]
+
+
+def _internal_var(userAppDir=False):
+    import tempfile
+    return tempfile.gettempdir()
+
+
+def _plugin_info(name, query=False, loaded=False):
+    return False
+
+
+# maya.api.OpenMaya
+
+class MTime(object):
+    kSeconds = SECONDS
+    kFilm = FILM
+    kNTSCFrame = NTSC
+
+    def __init__(self, value=0.0, unit=FILM):
+        self.seconds = float(value) / unit
+
+    @staticmethod
+    def uiUnit():
+        return SCENE.fps
+
+    def asUnits(self, unit):
+        return self.seconds * unit
+
+    @property
+    def value(self):
+        return self.seconds * SCENE.fps
+
+
+class MDistance(object):
+    kCentimeters = CENTIMETERS
+    kInches = INCHES
+    kMeters = METERS
+
+    def __init__(self, value=0.0, unit=CENTIMETERS):
+        self.centimeters = float(value) * unit
+
+    @staticmethod
+    def uiUnit():
+        return SCENE.linear_unit
+
+    def asCentimeters(self):
+        return self.centimeters
+
+    def asUnits(self, unit):
+        return self.centimeters / unit
+
+
+class MAngle(object):
+    kRadians = RADIANS
+    kDegrees = DEGREES
+
+    def __init__(self, value=0.0, unit=RADIANS):
+        self.radians = float(value) * unit
+
+    @staticmethod
+    def uiUnit():
+        return SCENE.angle_unit
+
+    def asRadians(self):
+        return self.radians
+
+    def asDegrees(self):
+        return self.radians / DEGREES
+
+    def asUnits(self, unit):
+        return self.radians / unit
+
+
+class MDGContext(object):
+
+    def __init__(self, time):
+        self.time = time
+
+
+class Node(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class MSelectionList(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def getDependNode(self, index):
+        return Node(self.name)
+
+
+class MGlobal(object):
+
+    @staticmethod
+    def getSelectionListByName(name):
+        return MSelectionList(name)
+
+
+class MPlug(object):
+
+    def __init__(self, node, attribute):
+        self.node = node
+        self.attribute = attribute
+
+    def elementByLogicalIndex(self, index):
+        return self
+
+    def asMObject(self, context):
+        frame = context.time.asUnits(SCENE.fps)
+        x, y, z = SCENE.objects[self.node.name](frame)
+        return [1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, x, y, z, 1.0]
+
+
+class MFnDependencyNode(object):
+
+    def __init__(self, node):
+        self.node = node
+
+    def findPlug(self, attribute, want_networked):
+        return MPlug(self.node, attribute)
+
+
+class MFnMatrixData(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def matrix(self):
+        return list(self.data)
+
+
+# maya.api.OpenMayaAnim
+
+class MFnAnimCurve(object):
+    (kTangentGlobal, kTangentFixed, kTangentLinear, kTangentFlat, kTangentSmooth, kTangentStep,
+     kTangentClamped, kTangentPlateau, kTangentStepNext, kTangentAuto) = range(10)
+    kAnimCurveTA, kAnimCurveTL, kAnimCurveTU = "TA", "TL", "TU"
+
+    def __init__(self, node):
+        self.name = node.name
+        self.curve = SCENE.curves[node.name]
+
+    @property
+    def animCurveType(self):
+        return self.curve.kind
+
+    @property
+    def numKeys(self):
+        return len(self.curve.keys)
+
+    def setIsWeighted(self, weighted):
+        self.curve.weighted = bool(weighted)
+
+    def _frames(self, times):
+        return [t.asUnits(SCENE.fps) for t in times]
+
+    def addKeys(self, times, values, tangentInType=kTangentGlobal, tangentOutType=kTangentGlobal, keepExistingKeys=False):
+        SCENE.calls.append("addKeys")
+        self._add(self._frames(times), values, [tangentInType] * len(times), [tangentOutType] * len(times), None, None, None, None,
+            keepExistingKeys)
+
+    def addKeysWithTangents(self, times, values, tangentInType=kTangentGlobal, tangentOutType=kTangentGlobal, tangentInTypeArray=None,
+        tangentOutTypeArray=None, tangentInXArray=None, tangentInYArray=None, tangentOutXArray=None, tangentOutYArray=None,
+        tangentsLockArray=None, weightsLockArray=None, convertUnits=True, keepExistingKeys=False):
+        SCENE.calls.append("addKeysWithTangents")
+        n = len(times)
+        in_types = tangentInTypeArray if tangentInTypeArray is not None else [tangentInType] * n
+        out_types = tangentOutTypeArray if tangentOutTypeArray is not None else [tangentOutType] * n
+
+        # With convertUnits, the tangents' y are in UI units, as Maya takes them
+        scale = self.curve.scale(SCENE) if convertUnits else 1.0
+        in_tangents = [(x, y * scale) for (x, y) in zip(tangentInXArray, tangentInYArray)] if tangentInXArray is not None else None
+        out_tangents = [(x, y * scale) for (x, y) in zip(tangentOutXArray, tangentOutYArray)] if tangentOutXArray is not None else None
+        self._add(self._frames(times), values, in_types, out_types, in_tangents, out_tangents, tangentsLockArray, weightsLockArray,
+            keepExistingKeys)
+
+    def _add(self, frames, values, in_types, out_types, in_tangents, out_tangents, locks, weight_locks, keep):
+        added = Curve(self.curve.kind)
+        added.set_keys(frames, values, in_types, out_types, in_tangents, out_tangents, locks, weight_locks)
+        kept = [k for k in self.curve.keys if keep and all(abs(k["time"] - f) > 1e-9 for f in frames)]
+        self.curve.keys = sorted(kept + added.keys, key=lambda key: key["time"])
+
+    def find(self, time):
+        return self.curve.find(time.asUnits(SCENE.fps))
+
+    def input(self, index):
+        return MTime(self.curve.keys[index]["time"], SCENE.fps)
+
+    def value(self, index):
+        return self.curve.keys[index]["value"]
+
+    def getTangentXY(self, index, isInTangent):
+        return self.curve.keys[index]["in" if isInTangent else "out"]
+
+    def getTangentAngleWeight(self, index, isInTangent):
+        x, y = self.getTangentXY(index, isInTangent)
+        return MAngle(math.atan2(y, x)), math.hypot(x, y)
+
+    def setAngle(self, index, angle, isInTangent):
+        SCENE.calls.append("setAngle")
+        side = "in" if isInTangent else "out"
+        weight = math.hypot(*self.curve.keys[index][side])
+        self.curve.keys[index][side] = (weight * math.cos(angle.asRadians()), weight * math.sin(angle.asRadians()))
+
+    def setWeight(self, index, weight, isInTangent):
+        SCENE.calls.append("setWeight")
+        side = "in" if isInTangent else "out"
+        x, y = self.curve.keys[index][side]
+        angle = math.atan2(y, x)
+        self.curve.keys[index][side] = (weight * math.cos(angle), weight * math.sin(angle))
+
+    def setTangentsLocked(self, index, locked):
+        self.curve.keys[index]["lock"] = bool(locked)
+
+    def setWeightsLocked(self, index, locked):
+        self.curve.keys[index]["weight_lock"] = bool(locked)
+
+
+# PySide2, only as far as defining the dialog's classes needs
+
+class Signal(object):
+    """
+    A signal declared on a class, bound to each instance on access.
+    """
+
+    def __init__(self, *types):
+        self.name = None
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return instance.__dict__.setdefault("_signal_%d" % id(self), BoundSignal())
+
+
+class BoundSignal(object):
+
+    def __init__(self):
+        self.emitted = []
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def emit(self, *args):
+        self.emitted.append(args)
+        for slot in self.slots:
+            slot(*args)
+
+
+class QThread(object):
+
+    def __init__(self, parent=None):
+        self.parent = parent
+
+    def start(self):
+        self.run()
+
+    def wait(self, *args):
+        return True
+
+    def isRunning(self):
+        return False
+
+
+class AnythingType(type):
+
+    def __getattr__(cls, name):
+        # Class attributes (e.g. QFont.Bold) are stand-ins too
+        return Anything()
+
+
+class Anything(object, metaclass=AnythingType):
+    """
+    Stands in for any Qt class or constant that is only referred to.
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return Anything()
+
+    def __call__(self, *args, **kwargs):
+        return Anything()
+
+
+class MayaQWidgetBaseMixin(object):
+    pass
+
+
+class MayaQWidgetDockableMixin(object):
+    pass
+
+
+class QWidget(object):
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+
+def _anything_module(name, **attributes):
+    module = _module(name, **attributes)
+    module.__getattr__ = lambda attribute: Anything
+    return module
+
+
+def install():
+    """
+    Installs the stand-in modules, unless Maya itself can be imported.
+    Returns whether they were installed.
+    """
+    try:
+        import maya.cmds
+        return False
+    except ImportError:
+        pass
+
+    cmds = _module("maya.cmds",
+        error=_error, warning=lambda message: None, ls=_ls, select=_select, listConnections=_list_connections,
+        keyframe=_keyframe, keyTangent=_key_tangent, cutKey=_cut_key, setKeyframe=_set_keyframe, playbackOptions=_playback_options,
+        internalVar=_internal_var, pluginInfo=_plugin_info)
+    om = _module("maya.api.OpenMaya",
+        MTime=MTime, MDistance=MDistance, MAngle=MAngle, MDGContext=MDGContext, MGlobal=MGlobal, MFnDependencyNode=MFnDependencyNode,
+        MFnMatrixData=MFnMatrixData, MTimeArray=list, MDoubleArray=list, MIntArray=list)
+    oma = _module("maya.api.OpenMayaAnim", MFnAnimCurve=MFnAnimCurve)
+    api = _module("maya.api", OpenMaya=om, OpenMayaAnim=oma)
+    mel = _module("maya.mel", eval=lambda command: None)
+    omui = _anything_module("maya.OpenMayaUI")
+    mixin = _module("maya.app.general.mayaMixin", MayaQWidgetBaseMixin=MayaQWidgetBaseMixin, MayaQWidgetDockableMixin=MayaQWidgetDockableMixin)
+    general = _module("maya.app.general", mayaMixin=mixin)
+    app = _module("maya.app", general=general)
+    maya = _module("maya", cmds=cmds, api=api, mel=mel, OpenMayaUI=omui, app=app)
+
+    qt_core = _anything_module("PySide2.QtCore", QThread=QThread, Signal=Signal)
+    qt_gui = _anything_module("PySide2.QtGui")
+    qt_widgets = _anything_module("PySide2.QtWidgets", QWidget=QWidget)
+    pyside = _module("PySide2", QtCore=qt_core, QtGui=qt_gui, QtWidgets=qt_widgets)
+    shiboken = _module("shiboken2", wrapInstance=lambda pointer, cls: None)
+
+    for module in [maya, cmds, api, om, oma, mel, omui, app, general, mixin, pyside, qt_core, qt_gui, qt_widgets, shiboken]:
+        sys.modules[module.__name__] = module
+    return True
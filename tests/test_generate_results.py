@@ -0,0 +1,47 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The results scripts are imported by name, as they are run from their directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "results"))
+
+import generate_results
+
+
+def test_animation_data_is_written_as_csv_and_npy(scene, tmp_path):
+    scene.add_object("hips", lambda frame: (frame, 2.0 * frame, -0.5))
+    scene.add_object("hand", lambda frame: (0.25, frame * frame, 3.0))
+    filepath = str(tmp_path / "clip.csv")
+    generate_results.export_animation_data_as_csv(filepath, ["hips", "hand"], 3, 7, save_npy=True)
+
+    expected = np.array([list(scene.objects["hips"](f)) + list(scene.objects["hand"](f)) for f in range(3, 8)])
+    with open(filepath) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == "hips.x,hips.y,hips.z,hand.x,hand.y,hand.z"
+    assert np.loadtxt(lines[1:], delimiter=",") == pytest.approx(expected)
+
+    table = np.load(str(tmp_path / "clip.npy"))
+    assert table.dtype == np.float64
+    assert table.shape == (5, 6)
+    np.testing.assert_array_equal(table, expected)
+
+
+def test_npy_is_only_written_when_asked_for(scene, tmp_path):
+    scene.add_object("hips", lambda frame: (frame, 0.0, 0.0))
+    generate_results.export_animation_data_as_csv(str(tmp_path / "clip.csv"), ["hips"], 0, 2)
+    assert os.listdir(str(tmp_path)) == ["clip.csv"]
+
+
+@pytest.mark.parametrize("n_rows, n_columns", [(1, 1), (7, 3), (40, 75)])
+def test_npy_header_is_padded_for_any_shape(tmp_path, n_rows, n_columns):
+    import array
+    values = array.array("d", [0.5 * i for i in range(n_rows * n_columns)])
+    filepath = str(tmp_path / "table.npy")
+    generate_results.export_array_as_npy(filepath, values, (n_rows, n_columns))
+
+    with open(filepath, "rb") as f:
+        assert f.read(10)[:8] == b"\x93NUMPY\x01\x00"
+    assert (os.path.getsize(filepath) - 8 * len(values)) % 64 == 0
+    np.testing.assert_array_equal(np.load(filepath, mmap_mode="r"), np.reshape(values, (n_rows, n_columns)))
@@ -0,0 +1,312 @@
+import pytest
+
+import salient_api
+
+
+def orbit(radius, height):
+    import math
+    return lambda frame: (radius * math.cos(0.1 * frame), height + 0.5 * frame, radius * math.sin(0.1 * frame))
+
+
+def test_animation_data_is_sampled_frame_by_frame(scene):
+    scene.add_object("hips", orbit(2.0, 90.0))
+    scene.add_object("hand", orbit(5.0, 120.0))
+    scene.selection = ["hips", "hand"]
+
+    anim_data = salient_api.SalientPoses.get_animation_data(10, 14)
+    assert salient_api.SalientPoses.get_dimensions() == ["time", "hips.tx", "hips.ty", "hips.tz", "hand.tx", "hand.ty", "hand.tz"]
+    assert len(anim_data) == 5 * 7
+    for (i, frame) in enumerate(range(10, 15)):
+        row = anim_data[7 * i:7 * (i + 1)]
+        assert row[0] == frame
+        assert row[1:4] == pytest.approx(scene.objects["hips"](frame))
+        assert row[4:7] == pytest.approx(scene.objects["hand"](frame))
+
+
+def test_animation_data_of_given_objects(scene):
+    scene.add_object("hips", orbit(2.0, 90.0))
+    scene.add_object("hand", orbit(5.0, 120.0))
+    scene.selection = ["hips", "hand"]
+
+    anim_data = salient_api.SalientPoses.get_animation_data(0, 3, ["hand"])
+    assert len(anim_data) == 4 * 4
+    assert anim_data[4:8] == pytest.approx([1.0] + list(scene.objects["hand"](1)))
+
+
+def test_animation_data_follows_the_scene_frame_rate(scene):
+    import maya_stand_in
+    scene.fps = maya_stand_in.NTSC
+    scene.add_object("hips", lambda frame: (frame, 0.0, 0.0))
+    scene.selection = ["hips"]
+    anim_data = salient_api.SalientPoses.get_animation_data(0, 2)
+    assert anim_data[1::4] == pytest.approx([0.0, 1.0, 2.0])
+
+
+def keyed_curve(kind, n_keys):
+    import maya_stand_in
+    curve = maya_stand_in.Curve(kind, weighted=True)
+    curve.set_keys(list(range(n_keys)), [0.3 * i * i - 2.0 for i in range(n_keys)],
+        in_types=[i % 10 for i in range(n_keys)], out_types=[(i + 3) % 10 for i in range(n_keys)],
+        in_tangents=[(0.5 + 0.1 * i, 0.2 * i - 1.0) for i in range(n_keys)],
+        out_tangents=[(0.4 + 0.05 * i, 1.0 - 0.3 * i) for i in range(n_keys)],
+        locks=[i % 2 == 0 for i in range(n_keys)], weight_locks=[i % 3 == 0 for i in range(n_keys)])
+    return curve
+
+
+@pytest.mark.parametrize("linear_unit, angle_unit", [(1.0, 1.0), (2.54, 3.141592653589793 / 180.0), (100.0, 1.0)])
+def test_snapshot_restores_curves_in_any_units(scene, linear_unit, angle_unit):
+    import copy
+    scene.linear_unit, scene.angle_unit = linear_unit, angle_unit
+    scene.add_curve("hips.translateX", keyed_curve("TL", 6))
+    scene.add_curve("hips.rotateY", keyed_curve("TA", 6))
+    scene.add_curve("hips.visibility", keyed_curve("TU", 6))
+    original = dict((name, copy.deepcopy(curve.keys)) for (name, curve) in scene.curves.items())
+
+    snapshot = salient_api.AnimationSnapshot(["hips"])
+    for curve in scene.curves.values():
+        curve.set_keys([0, 5], [7.0, 8.0])
+    scene.calls = []
+    snapshot.restore()
+
+    for (name, keys) in original.items():
+        restored = scene.curves[name].keys
+        assert len(restored) == len(keys)
+        for (key, expected) in zip(restored, keys):
+            for field in ["time", "value"]:
+                assert key[field] == pytest.approx(expected[field])
+            for field in ["in", "out"]:
+                assert key[field] == pytest.approx(expected[field])
+            for field in ["in_type", "out_type", "lock", "weight_lock"]:
+                assert key[field] == expected[field]
+
+    # Each curve is rebuilt in one edit rather than key by key
+    assert scene.calls.count("addKeysWithTangents") == 3
+    assert "setAngle" not in scene.calls and "setWeight" not in scene.calls
+
+
+def test_snapshot_clears_curves_that_had_no_keys(scene):
+    import maya_stand_in
+    scene.add_curve("hips.translateX", maya_stand_in.Curve("TL"))
+    snapshot = salient_api.AnimationSnapshot(["hips"])
+    scene.curves["hips_translateX"].set_keys([0, 1], [1.0, 2.0])
+    snapshot.restore()
+    assert "hips_translateX" not in scene.curves
+
+
+def baked_curve(kind, values):
+    import maya_stand_in
+    curve = maya_stand_in.Curve(kind)
+    curve.set_keys(list(range(len(values))), values)
+    return curve
+
+
+def test_batched_reduction_fits_internal_values(scene):
+    import numpy as np
+    import salient_reduce
+    scene.linear_unit, scene.angle_unit = 2.54, 3.141592653589793 / 180.0
+    frames = np.arange(25)
+    data = np.stack([np.sin(0.3 * frames), 10.0 * np.cos(0.2 * frames)], axis=1)
+    scene.add_curve("hips.rotateX", baked_curve("TA", list(data[:, 0])))
+    scene.add_curve("hips.translateX", baked_curve("TL", list(data[:, 1])))
+    selection = [0, 6, 13, 24]
+
+    salient_api.reduce_curves_batched(["hips"], selection)
+
+    (out_angles, out_weights), (in_angles, in_weights) = salient_reduce.fit_tangents(data[:, [1, 0]], np.array(selection), 1.0 / 24.0)
+    for (k, name) in enumerate(["hips_translateX", "hips_rotateX"]):
+        keys = scene.curves[name].keys
+        assert [key["time"] for key in keys] == selection
+        assert [key["value"] for key in keys] == pytest.approx(list(data[selection, 1 - k]))
+        for i in range(len(selection) - 1):
+            assert keys[i]["out"] == pytest.approx((out_weights[i, k] * np.cos(out_angles[i, k]), out_weights[i, k] * np.sin(out_angles[i, k])))
+            assert keys[i + 1]["in"] == pytest.approx((in_weights[i, k] * np.cos(in_angles[i, k]), in_weights[i, k] * np.sin(in_angles[i, k])))
+
+
+def test_batched_reduction_needs_baked_curves(scene):
+    scene.add_curve("hips.translateX", baked_curve("TL", [0.0, 1.0, 2.0]))
+    with pytest.raises(RuntimeError):
+        salient_api.reduce_curves_batched(["hips"], [0, 5])
+
+
+def test_reduced_curves_are_applied_in_internal_units(scene):
+    import numpy as np
+    import salient_reduce
+    scene.angle_unit = 3.141592653589793 / 180.0
+    scene.add_curve("hips.rotateX", baked_curve("TA", [5.0] * 40))
+    data = np.sin(0.1 * np.arange(30))[:, None] + 0.5
+    reduced = salient_reduce.reduce_channels(data, [10, 20, 39], start=10, channels=["hips.rotateX"])
+
+    salient_api.apply_reduced_curves(reduced)
+    keys = scene.curves["hips_rotateX"].keys
+    assert [key["time"] for key in keys] == list(range(10)) + [10, 20, 39]
+    assert [key["value"] for key in keys[10:]] == pytest.approx(list(data[[0, 10, 29], 0]))
+    assert [key["value"] for key in keys[:10]] == [5.0] * 10
+
+
+def sampled(n_frames, width=6, seed=2):
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    frames = np.concatenate([np.arange(n_frames, dtype=np.float64)[:, None], np.cumsum(rng.normal(size=(n_frames, width)), axis=0)], axis=1)
+    return frames.ravel().tolist(), ["time"] + ["d%d" % i for i in range(width)]
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    import salient_cache
+    monkeypatch.setattr(salient_api, "_cache", salient_cache.SelectionCache(str(tmp_path / "cache")))
+    return salient_api._cache
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"max_keyframes" : 9},
+    {"max_error" : 2.0},
+    {"prune" : True, "min_keyframes" : 4},
+    {"window" : 16, "overlap" : 4},
+    {"pca_variance" : 0.95},
+    {"coarse_factor" : 2},
+])
+def test_streamed_selections_match_select_sampled(options):
+    anim_data, dimensions = sampled(40)
+    selections = salient_api.select_sampled(0, 0, 0, 39, anim_data, dimensions, [8], backend="numpy", use_cache=False, **options)
+    streamed = list(salient_api.iter_selections(0, 0, 0, 39, [8], backend="numpy", use_cache=False,
+        anim_data=anim_data, dimensions=dimensions, **options))
+    assert [n for (n, _, _) in streamed] == list(selections.keys())
+    for (n, error, selection) in streamed:
+        assert error == pytest.approx(selections.get_error(n))
+        assert selection == selections.get_selection(n)
+
+
+def test_streamed_selections_are_cached_for_select_sampled(cache, monkeypatch):
+    import salient_engine
+    anim_data, dimensions = sampled(30)
+    streamed = list(salient_api.iter_selections(0, 0, 0, 29, [], backend="numpy", anim_data=anim_data, dimensions=dimensions))
+    assert len(cache.entries()) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The selections should come from the cache")
+    monkeypatch.setattr(salient_engine, "iter_selections", fail)
+    monkeypatch.setattr(salient_engine, "select", fail)
+
+    again = list(salient_api.iter_selections(0, 0, 0, 29, [], backend="numpy", anim_data=anim_data, dimensions=dimensions))
+    assert again == streamed
+    selections = salient_api.select_sampled(0, 0, 0, 29, anim_data, dimensions, [], backend="numpy")
+    assert [(n, selections.get_error(n), selections.get_selection(n)) for n in selections.keys()] == streamed
+
+
+def test_abandoned_streams_are_not_cached(cache):
+    anim_data, dimensions = sampled(30)
+    stream = salient_api.iter_selections(0, 0, 0, 29, [], backend="numpy", anim_data=anim_data, dimensions=dimensions)
+    next(stream)
+    stream.close()
+    assert cache.entries() == []
+
+
+def test_profile_accumulates_stages():
+    profile = salient_api.Profile()
+    with profile.stage("analysis"):
+        pass
+    profile.add("analysis", seconds=1.5, bytes=800)
+    profile.add("analysis.skipped", entries=12)
+    profile.add("analysis.skipped", entries=3)
+    profile.merge("salientSelect", { "selection" : { "seconds" : 0.25, "bytes" : 16.0, "entries" : 4 } })
+
+    stages = profile.as_dict()
+    assert list(stages) == ["analysis", "analysis.skipped", "salientSelect.selection"]
+    assert stages["analysis"]["seconds"] >= 1.5 and stages["analysis"]["bytes"] == 800
+    assert "entries" not in stages["analysis"] and stages["analysis.skipped"]["entries"] == 15
+    assert stages["salientSelect.selection"] == { "seconds" : 0.25, "bytes" : 16, "entries" : 4 }
+
+    lines = profile.summary().splitlines()
+    assert lines[0].split() == ["stage", "seconds", "bytes", "entries"]
+    assert lines[1].split()[-1] == "-" and lines[2].split()[-1] == "15"
+
+
+def test_profile_level_passed_to_the_commands():
+    assert salient_api.Profile(enabled=False).level() == 0
+    assert salient_api.Profile().level() == 1
+    assert salient_api.Profile(log=True).level() == 2
+
+
+def test_select_sampled_records_each_stage(cache):
+    anim_data, dimensions = sampled(30)
+    profile = salient_api.Profile()
+    salient_api.select_sampled(0, 0, 0, 29, anim_data, dimensions, [], backend="numpy", profile=profile, prune=True)
+    stages = profile.as_dict()
+    assert set(stages) == {"cache", "analysis", "analysis.skipped", "selection", "output"}
+    assert stages["analysis"]["bytes"] == 8 * 30 * 29 // 2
+
+    # A cached result only looks in the cache
+    profile = salient_api.Profile()
+    salient_api.select_sampled(0, 0, 0, 29, anim_data, dimensions, [], backend="numpy", profile=profile, prune=True)
+    assert list(profile.as_dict()) == ["cache"]
+
+
+def test_select_keyframes_records_sampling(scene, cache):
+    scene.add_object("hips", orbit(2.0, 90.0))
+    scene.selection = ["hips"]
+    profile = salient_api.Profile()
+    salient_api.select_keyframes(0, 0, 0, 19, [], backend="numpy", profile=profile)
+    assert profile.as_dict()["sampling"]["bytes"] == 8 * 20 * 4
+
+
+def test_batched_reduction_records_each_stage(scene):
+    scene.add_curve("hips.translateX", baked_curve("TL", [0.5 * i * i for i in range(10)]))
+    profile = salient_api.Profile()
+    salient_api.reduce_curves_batched(["hips"], [0, 4, 9], profile)
+    stages = profile.as_dict()
+    assert list(stages) == ["sampling", "fitting", "apply"]
+    assert stages["sampling"]["bytes"] == 8 * 10
+
+
+def test_projected_selection_meets_max_error_over_every_dimension():
+    import numpy as np
+    import salient_engine
+    anim_data, dimensions = sampled(40, width=12)
+    frames = salient_engine.as_frames(anim_data, dimensions)
+    selections = salient_api.select_sampled(0, 0, 0, 39, anim_data, dimensions, [], backend="numpy", use_cache=False,
+        pca_variance=0.8, max_error=3.0)
+
+    errors = [salient_engine.selection_error(frames, np.asarray(selections.get_selection(n))) for n in selections.keys()]
+    assert [selections.get_error(n) for n in selections.keys()] == pytest.approx(errors)
+    assert errors[-1] <= 3.0 < errors[-2]
+
+
+def test_projection_is_compared_with_the_full_selection():
+    anim_data, dimensions = sampled(30, width=12)
+    report = salient_api.compare_projection(0, 29, [], pca_variance=0.9, anim_data=anim_data, dimensions=dimensions)
+    assert 1 <= report["components"] < report["dimensions"] == 12
+    assert report["explained_variance"] >= 0.9
+    # The full selections are optimal, so the projected ones can only be worse
+    assert report["max_error_drift"] >= report["mean_error_drift"] >= -1e-9
+
+
+def test_windowed_refined_selections_are_reported_as_approximate():
+    anim_data, dimensions = sampled(80)
+    selections = salient_api.select_sampled(0, 0, 0, 79, anim_data, dimensions, [], backend="numpy", use_cache=False,
+        window=30, overlap=6, coarse_factor=3)
+    bounds = [selections.get_error_bound(n) for n in selections.keys()]
+    assert any(lower < upper for (lower, upper) in bounds)
+    for (n, (lower, upper)) in zip(selections.keys(), bounds):
+        assert 0.0 <= lower <= upper == selections.get_error(n)
+
+
+@pytest.mark.parametrize("options", [{}, {"window" : 16, "overlap" : 4}, {"prune" : True}])
+def test_selections_start_at_min_keyframes(options):
+    anim_data, dimensions = sampled(40)
+    selections = salient_api.select_sampled(0, 0, 0, 39, anim_data, dimensions, [], backend="numpy", use_cache=False,
+        min_keyframes=10, **options)
+    assert selections.get_keyframe_range() == (10, 40)
+    everything = salient_api.select_sampled(0, 0, 0, 39, anim_data, dimensions, [], backend="numpy", use_cache=False, **options)
+    for n in selections.keys():
+        assert selections.get_selection(n) == everything.get_selection(n)
+
+
+@pytest.mark.parametrize("min_keyframes", [1, 41])
+def test_min_keyframes_must_be_within_the_range(min_keyframes):
+    anim_data, dimensions = sampled(40)
+    with pytest.raises(ValueError):
+        salient_api.select_sampled(0, 0, 0, 39, anim_data, dimensions, [], backend="numpy", use_cache=False, min_keyframes=min_keyframes)
+    with pytest.raises(ValueError):
+        next(salient_api.iter_selections(0, 0, 0, 39, [], backend="numpy", use_cache=False, anim_data=anim_data, dimensions=dimensions,
+            min_keyframes=min_keyframes))
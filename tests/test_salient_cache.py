@@ -0,0 +1,87 @@
+import os
+import threading
+
+import salient_cache
+import salient_selections
+
+
+SELECTIONS = {
+    2 : { "selection" : [0, 9], "error" : 2.0 },
+    3 : { "selection" : [0, 4, 9], "error" : 1.0 },
+}
+
+
+def make_key(**kwargs):
+    return salient_cache.make_key([0.0, 1.0, 1.0, 2.0], ["time", "x"], 0, 1, [], **kwargs)
+
+
+def test_store_and_load(tmp_path):
+    cache = salient_cache.SelectionCache(str(tmp_path))
+    key = make_key()
+    assert cache.load(key) is None
+    cache.store(key, SELECTIONS)
+    assert cache.load(key).to_dict() == SELECTIONS
+    cache.store(key, salient_selections.SelectionTable.from_dict({ 2 : SELECTIONS[2] }))
+    assert cache.load(key).keys() == [2]
+    assert os.listdir(str(tmp_path)) == [key + ".sel"]
+    cache.clear()
+    assert cache.load(key) is None
+
+
+def test_eviction_keeps_the_size_bounded(tmp_path):
+    cache = salient_cache.SelectionCache(str(tmp_path), max_bytes=1)
+    cache.store(make_key(), SELECTIONS)
+    assert cache.entries() == []
+
+
+def test_entries_removed_by_another_process_are_misses(tmp_path):
+    cache = salient_cache.SelectionCache(str(tmp_path))
+    other = salient_cache.SelectionCache(str(tmp_path))
+    key = make_key()
+    cache.store(key, SELECTIONS)
+    stale = cache.entries()
+    other.clear()
+
+    assert cache.load(key) is None
+    cache.entries = lambda: stale
+    cache.evict()
+    cache.max_bytes = 0
+    cache.evict()
+    cache.clear()
+
+
+def test_concurrent_stores_and_evictions(tmp_path):
+    errors = []
+
+    def work(k):
+        cache = salient_cache.SelectionCache(str(tmp_path), max_bytes=600)
+        try:
+            for i in range(50):
+                key = make_key(max_keyframes=i % 7)
+                cache.store(key, SELECTIONS)
+                loaded = cache.load(key)
+                assert loaded is None or loaded.to_dict() == SELECTIONS
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(k,)) for k in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert not any(name.endswith(".tmp") for name in os.listdir(str(tmp_path)))
+
+
+def test_keys_follow_the_parameters():
+    assert make_key() == make_key()
+    assert make_key() != make_key(max_keyframes=5)
+    assert make_key() != make_key(max_error=0.0)
+    assert make_key() != make_key(min_keyframes=3)
+    assert make_key() != make_key(single_precision=True)
+    assert make_key() != salient_cache.make_key([0.0, 1.0, 1.0, 2.0], ["time", "x"], 0, 1, [1])
+
+
+def test_keys_are_shared_by_backends_of_the_same_precision():
+    assert make_key(backend="numpy") == make_key(backend="multicore")
+    assert make_key(backend="numpy") != make_key(backend="opencl")
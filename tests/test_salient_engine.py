@@ -0,0 +1,290 @@
+import itertools
+import os
+
+import numpy as np
+import pytest
+
+import salient_engine
+
+
+def random_frames(n_frames, width=6, seed=0):
+    rng = np.random.default_rng(seed)
+    positions = np.cumsum(rng.normal(size=(n_frames, width)), axis=0)
+    return np.concatenate([np.arange(n_frames, dtype=np.float64)[:, None], positions], axis=1)
+
+
+def as_anim_data(frames):
+    return frames.ravel().tolist(), ["time"] + ["d%d" % i for i in range(frames.shape[1] - 1)]
+
+
+def dense_errors(frames):
+    n_frames = frames.shape[0]
+    dense = np.full((n_frames, n_frames), np.nan)
+    for s in range(n_frames - 1):
+        dense[s, s + 1:] = salient_engine.segment_errors(frames, s, np.arange(s + 1, n_frames))
+    return dense
+
+
+def brute_force_errors(frames, fixed_keyframes=()):
+    n_frames = frames.shape[0]
+    dense = dense_errors(frames)
+    best = {}
+    for n_interior in range(n_frames - 1):
+        for interior in itertools.combinations(range(1, n_frames - 1), n_interior):
+            if not set(fixed_keyframes) <= set(interior):
+                continue
+            keyframes = (0,) + interior + (n_frames - 1,)
+            error = max(dense[s, e] for (s, e) in zip(keyframes[:-1], keyframes[1:]))
+            best[len(keyframes)] = min(best.get(len(keyframes), np.inf), error)
+    return best
+
+
+@pytest.mark.parametrize("fixed_keyframes", [[], [4], [3, 7]])
+def test_selection_matches_brute_force(fixed_keyframes):
+    frames = random_frames(11)
+    manager = salient_engine.SelectionManager(salient_engine.ErrorTable(frames), fixed_keyframes)
+    manager.increment_until_n_keyframes(frames.shape[0])
+
+    expected = brute_force_errors(frames, fixed_keyframes)
+    selections = manager.as_selections()
+    assert sorted(selections.keys()) == sorted(expected.keys())
+    for (n, error) in expected.items():
+        selection = selections[n]["selection"]
+        assert selections[n]["error"] == pytest.approx(error)
+        assert len(selection) == n and set(fixed_keyframes) <= set(selection)
+        assert salient_engine.selection_error(frames, np.array(selection)) == pytest.approx(error)
+
+
+def test_error_table_matches_segment_errors():
+    frames = random_frames(150)
+    dense = dense_errors(frames)
+    table = salient_engine.ErrorTable(frames).table
+    for s in range(frames.shape[0] - 1):
+        np.testing.assert_allclose(table.row(s), dense[s, s + 1:], rtol=1e-12)
+    for e in range(1, frames.shape[0]):
+        np.testing.assert_allclose(table.column(e), dense[:e, e], rtol=1e-12)
+
+
+def test_segment_errors_measure_distance_to_the_line():
+    # Frames on a straight line (in time too) are interpolated exactly
+    frames = np.array([[0.0, 0.0], [1.0, 2.0], [2.0, 4.0], [3.0, 6.0], [4.0, 0.0]])
+    errors = salient_engine.segment_errors(frames, 0, np.array([2, 3, 4]))
+    assert errors[0] == 0.0 and errors[1] == 0.0 and errors[2] > 0.0
+    assert salient_engine.selection_error(frames, np.array([0, 3, 4])) == 0.0
+
+
+def test_parallel_fill_matches_serial_fill():
+    frames = random_frames(200)
+    serial = salient_engine.ErrorTable(frames)
+    parallel = salient_engine.ErrorTable(frames, workers=2)
+    assert np.array_equal(serial.table.data, parallel.table.data)
+
+
+def test_parallel_selection_matches_serial_selection():
+    frames = random_frames(120)
+    anim_data, dimensions = as_anim_data(frames)
+    serial = salient_engine.select(anim_data, dimensions, 0, 119, [60], reuse=False).as_table()
+    parallel = salient_engine.select(anim_data, dimensions, 0, 119, [60], workers=3, reuse=False).as_table()
+    assert parallel.to_dict() == serial.to_dict()
+
+
+def test_progress_can_cancel_the_selection():
+    anim_data, dimensions = as_anim_data(random_frames(40))
+    reports = []
+
+    def progress(stage, count, total, error):
+        reports.append((stage, count, total))
+        return stage != "selection" or count < 10
+
+    with pytest.raises(salient_engine.Cancelled):
+        salient_engine.select(anim_data, dimensions, 0, 39, [], progress=progress, reuse=False)
+    assert reports[-1] == ("selection", 10, 40)
+    assert [r for r in reports if r[0] == "table"][-1][1:] == (len([r for r in reports if r[0] == "table"]),) * 2
+
+
+@pytest.mark.parametrize("options", [{}, {"max_keyframes" : 7}, {"max_error" : 3.0}, {"min_keyframes" : 5, "prune" : True}])
+def test_streamed_selections_match_select(options):
+    anim_data, dimensions = as_anim_data(random_frames(30, seed=5))
+    manager = salient_engine.select(anim_data, dimensions, 10, 39, [15], reuse=False, **options)
+    streamed = list(salient_engine.iter_selections(anim_data, dimensions, 10, 39, [15], reuse=False, **options))
+
+    expected = [n for n in range(manager.min_keyframes, manager.n_keyframes + 1) if manager.errors[n] != np.inf]
+    assert [n for (n, _, _) in streamed] == expected
+    for (n, error, selection) in streamed:
+        assert error == manager.errors[n]
+        assert selection == [f + 10 for f in manager.get_selection(n)]
+
+
+def test_narrowed_range_reuses_the_previous_table():
+    frames = random_frames(100)
+    previous = salient_engine.ErrorTable(frames)
+    narrowed = salient_engine.ErrorTable(frames[10:90], start=10, previous=previous)
+    assert narrowed.reused_entries == 80 * 79 // 2
+    np.testing.assert_allclose(narrowed.table.data, salient_engine.ErrorTable(frames[10:90]).table.data, rtol=1e-12)
+
+
+def test_widened_range_fills_only_the_new_entries():
+    frames = random_frames(60)
+    previous = salient_engine.ErrorTable(frames[20:40], start=20)
+    widened = salient_engine.ErrorTable(frames, previous=previous)
+    assert widened.reused_entries == 20 * 19 // 2
+    np.testing.assert_allclose(widened.table.data, salient_engine.ErrorTable(frames).table.data, rtol=1e-12)
+
+
+def test_changed_animation_is_not_reused():
+    frames = random_frames(50)
+    previous = salient_engine.ErrorTable(frames)
+    changed = frames.copy()
+    changed[25, 1] += 1.0
+    table = salient_engine.ErrorTable(changed, previous=previous)
+    assert table.reused_entries == 0
+    np.testing.assert_array_equal(table.table.data, salient_engine.ErrorTable(changed).table.data)
+
+
+def test_selections_reuse_the_last_table_until_reset():
+    anim_data, dimensions = as_anim_data(random_frames(40))
+    salient_engine.reset()
+    try:
+        salient_engine.select(anim_data, dimensions, 0, 39, [])
+        refixed = salient_engine.select(anim_data, dimensions, 0, 39, [12, 30])
+        assert refixed.reused_entries == 40 * 39 // 2
+        expected = salient_engine.select(anim_data, dimensions, 0, 39, [12, 30], reuse=False)
+        assert [refixed.get_selection(n) for n in range(4, 41)] == [expected.get_selection(n) for n in range(4, 41)]
+
+        import salient_api
+        salient_api.release_error_table()
+        assert salient_engine._last_table is None
+        assert salient_engine.select(anim_data, dimensions, 0, 39, []).reused_entries == 0
+    finally:
+        salient_engine.reset()
+
+
+def test_principal_components_keep_distances_of_low_rank_poses():
+    rng = np.random.default_rng(6)
+    latent = np.cumsum(rng.normal(size=(50, 2)), axis=0)
+    frames = np.concatenate([np.arange(50.0)[:, None], latent.dot(rng.normal(size=(2, 12))) + 3.0], axis=1)
+    projected, explained = salient_engine.principal_components(frames, 0.99)
+
+    assert projected.shape == (50, 3)
+    assert explained == pytest.approx(1.0)
+    np.testing.assert_array_equal(projected[:, 0], frames[:, 0])
+    np.testing.assert_allclose(dense_errors(projected), dense_errors(frames), atol=1e-9)
+
+
+def test_principal_components_of_still_poses_keep_only_time():
+    frames = np.concatenate([np.arange(10.0)[:, None], np.ones((10, 6))], axis=1)
+    projected, explained = salient_engine.principal_components(frames)
+    np.testing.assert_array_equal(projected, frames[:, :1])
+    assert explained == 1.0
+
+
+def test_rescoring_measures_the_error_on_the_given_frames():
+    frames = random_frames(30)
+    projected, _ = salient_engine.principal_components(frames, 0.6)
+    anim_data, dimensions = as_anim_data(projected)
+    selections = salient_engine.select(anim_data, dimensions, 5, 34, [], reuse=False).as_table(offset=5)
+    rescored = salient_engine.rescore(selections, frames, offset=5)
+
+    dense = dense_errors(frames)
+    assert rescored.keys() == selections.keys()
+    for n in rescored.keys():
+        keyframes = [f - 5 for f in rescored.get_selection(n)]
+        assert rescored.get_selection(n) == selections.get_selection(n)
+        assert rescored.get_error(n) == pytest.approx(max(dense[s, e] for (s, e) in zip(keyframes[:-1], keyframes[1:])))
+
+
+@pytest.mark.parametrize("factor", [2, 4])
+def test_refined_selection_is_bounded_by_the_exact_one(factor):
+    frames = random_frames(120, seed=8)
+    anim_data, dimensions = as_anim_data(frames)
+    exact = salient_engine.select(anim_data, dimensions, 0, 119, [], reuse=False).as_table()
+    refined = salient_engine.select_multiresolution(anim_data, dimensions, 0, 119, [], factor=factor)
+    for n in refined.keys():
+        lower, upper = refined.get_error_bound(n)
+        assert lower <= exact.get_error(n) + 1e-9
+        assert exact.get_error(n) <= upper + 1e-9
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_packed_table_matches_dense(dtype, tmp_path):
+    frames = random_frames(80)
+    dense = dense_errors(frames)
+    for directory in [None, str(tmp_path)]:
+        table = salient_engine.ErrorTable(frames, dtype=dtype, directory=directory).table
+        assert table.dtype == dtype and table.nbytes == np.dtype(dtype).itemsize * 80 * 79 // 2
+        for s in range(frames.shape[0] - 1):
+            np.testing.assert_allclose(table.row(s), dense[s, s + 1:], rtol=1e-6 if dtype == np.float32 else 1e-12)
+        for e in range(1, frames.shape[0]):
+            np.testing.assert_allclose(table.column(e), dense[:e, e], rtol=1e-6 if dtype == np.float32 else 1e-12)
+
+
+def test_memory_mapped_table_is_removed_when_closed(tmp_path):
+    table = salient_engine.ErrorTable(random_frames(20), directory=str(tmp_path)).table
+    assert len(os.listdir(str(tmp_path))) == 1
+    table.close()
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_single_precision_selects_as_double_precision():
+    anim_data, dimensions = as_anim_data(random_frames(60, seed=9))
+    double = salient_engine.select(anim_data, dimensions, 0, 59, [], reuse=False)
+    single = salient_engine.select(anim_data, dimensions, 0, 59, [], reuse=False, dtype=np.float32)
+    for n in range(2, 61):
+        np.testing.assert_allclose(single.errors[n], double.errors[n], rtol=1e-5)
+
+
+def test_reuse_copies_only_tables_of_the_same_precision():
+    frames = random_frames(60)
+    single = salient_engine.ErrorTable(frames, dtype=np.float32)
+    assert salient_engine.ErrorTable(frames, previous=single).reused_entries == 0
+    assert salient_engine.ErrorTable(frames, previous=single, dtype=np.float32).reused_entries == 60 * 59 // 2
+
+
+def assert_same_selections(actual, expected):
+    assert actual.keys() == [n for n in expected.keys() if n >= actual.get_keyframe_range()[0]]
+    for n in actual.keys():
+        assert actual.get_selection(n) == expected.get_selection(n)
+        assert actual.get_error(n) == expected.get_error(n)
+
+
+@pytest.mark.parametrize("fixed_keyframes,min_keyframes", [([], None), ([], 20), ([100, 101, 200], 20)])
+def test_pruned_selection_matches_dense(fixed_keyframes, min_keyframes):
+    frames = random_frames(300, width=30)
+    anim_data, dimensions = as_anim_data(frames)
+    dense = salient_engine.select(anim_data, dimensions, 0, 299, fixed_keyframes, reuse=False).as_table()
+    pruned = salient_engine.select(anim_data, dimensions, 0, 299, fixed_keyframes, reuse=False, prune=True, min_keyframes=min_keyframes)
+
+    assert pruned.skipped_entries == np.count_nonzero(np.isinf(pruned.table.data))
+    if min_keyframes is not None:
+        assert pruned.skipped_entries > 0
+        assert pruned.as_table().get_keyframe_range()[0] == min_keyframes
+    assert_same_selections(pruned.as_table(), dense)
+
+
+def test_pruned_selection_completes_the_table_when_over_the_threshold():
+    frames = random_frames(300, width=30)
+    threshold = 0.3 * salient_engine.pruning_threshold(frames, (), 20)
+    manager = salient_engine.SelectionManager(salient_engine.ErrorTable(frames, threshold=threshold), (), 20)
+    manager.increment_until_n_keyframes(60)
+
+    dense = salient_engine.SelectionManager(salient_engine.ErrorTable(frames), (), 20)
+    dense.increment_until_n_keyframes(60)
+    assert manager.skipped_entries == 0
+    assert_same_selections(manager.as_table(), dense.as_table())
+
+
+def test_reused_table_counts_and_completes_pruned_entries():
+    frames = random_frames(300, width=30)
+    anim_data, dimensions = as_anim_data(frames)
+    salient_engine.reset()
+    try:
+        first = salient_engine.prepare(anim_data, dimensions, 0, 299, [], prune=True, min_keyframes=20)
+        second = salient_engine.prepare(anim_data, dimensions, 0, 299, [150], prune=True, min_keyframes=20)
+        assert second.reused_entries > 0
+        assert second.skipped_entries == np.count_nonzero(np.isinf(second.table.data)) > 0
+
+        dense = salient_engine.prepare(anim_data, dimensions, 0, 299, [120])
+        assert dense.skipped_entries == 0 and dense.error_table.threshold is None
+        assert np.array_equal(dense.table.data, salient_engine.ErrorTable(frames).table.data)
+    finally:
+        salient_engine.reset()
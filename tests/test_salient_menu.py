@@ -0,0 +1,128 @@
+import os
+
+import pytest
+
+import maya_stand_in
+import salient_api
+import salient_menu
+
+
+def keyed_scene(scene, n_keys):
+    for channel in ["hips.translateX", "hips.rotateY"]:
+        curve = maya_stand_in.Curve("TA" if "rotate" in channel else "TL")
+        curve.set_keys(list(range(n_keys)), [0.1 * i for i in range(n_keys)])
+        scene.add_curve(channel, curve)
+
+
+def set_values(scene, value):
+    for curve in scene.curves.values():
+        for key in curve.keys:
+            key["value"] = value
+
+
+def values(scene):
+    return dict((name, [key["value"] for key in curve.keys]) for (name, curve) in scene.curves.items())
+
+
+def test_snapshot_is_written_to_and_read_from_a_file(scene, tmp_path):
+    keyed_scene(scene, 10)
+    snapshot = salient_api.AnimationSnapshot(["hips"])
+    # Ten keys per curve, each of six doubles (time, value, and tangents) and four flags
+    assert snapshot.nbytes() == 2 * 10 * (6 * 8 + 4 * 8)
+
+    expected = values(scene)
+    path = str(tmp_path / "hips.snapshot")
+    snapshot.dump(path)
+    set_values(scene, 3.0)
+    salient_api.AnimationSnapshot.load(path).restore()
+    assert values(scene) == pytest.approx(expected)
+
+
+def test_undo_history_spills_the_oldest_snapshots(scene):
+    keyed_scene(scene, 10)
+    saved = salient_menu.SavedAnimation(["hips"], 0, 9)
+    history = salient_menu.UndoHistory(max_bytes=int(2.5 * saved.nbytes))
+    entries = [saved] + [salient_menu.SavedAnimation(["hips"], 0, 9) for _ in range(3)]
+    for entry in entries:
+        history.push(entry)
+
+    # Only the two newest fit in memory
+    assert [e.snapshot is None for e in entries] == [True, True, False, False]
+    assert all(os.path.isfile(e.path) for e in entries[:2])
+    history.clear()
+    assert all(e.path is None for e in entries)
+    assert os.listdir(history.directory) == []
+
+
+def test_undo_history_reverts_spilled_snapshots_in_order(scene):
+    keyed_scene(scene, 10)
+    history = salient_menu.UndoHistory(max_bytes=0)
+    expected = []
+    for value in [1.0, 2.0, 3.0]:
+        set_values(scene, value)
+        expected.append(values(scene))
+        history.push(salient_menu.SavedAnimation(["hips"], 0, 9))
+    set_values(scene, 4.0)
+
+    # The newest snapshot is always kept in memory
+    assert history.entries[-1].snapshot is not None
+    for value in [3.0, 2.0, 1.0]:
+        entry = history.pop()
+        path = entry.path
+        entry.revert()
+        assert values(scene) == expected[int(value) - 1]
+        assert path is None or not os.path.exists(path)
+    assert len(history) == 0
+
+
+def worker_arguments(n_frames=30):
+    import numpy as np
+    rng = np.random.default_rng(4)
+    frames = np.concatenate([np.arange(n_frames, dtype=np.float64)[:, None], np.cumsum(rng.normal(size=(n_frames, 6)), axis=0)], axis=1)
+    return {
+        "cl_platform_ix" : 0, "cl_device_ix" : 0, "start" : 0, "end" : n_frames - 1, "fixed_keyframes" : [],
+        "backend" : "numpy", "use_cache" : False, "anim_data" : frames.ravel().tolist(), "dimensions" : ["time"] + ["d%d" % i for i in range(6)],
+    }
+
+
+def published(worker):
+    return [result for (batch,) in worker.selected.emitted for result in batch]
+
+
+def test_worker_publishes_every_selection(monkeypatch):
+    import salient_engine
+    monkeypatch.setattr(salient_menu.SelectionWorker, "PUBLISH_INTERVAL", 0.0)
+    arguments = worker_arguments()
+    worker = salient_menu.SelectionWorker(arguments)
+    worker.start()
+
+    assert len(worker.succeeded.emitted) == 1
+    assert worker.failed.emitted == [] and worker.cancelled.emitted == []
+    manager = salient_engine.select(arguments["anim_data"], arguments["dimensions"], 0, 29, [], reuse=False)
+    assert [(n, selection) for (n, _, selection) in published(worker)] == [(n, manager.get_selection(n)) for n in range(2, 31)]
+
+    # The final report of each stage is always emitted
+    stages = [(stage, count, total) for (stage, count, total, _) in worker.progressed.emitted]
+    assert ("selection", 30, 30) in stages
+    assert any(stage == "table" and count == total for (stage, count, total) in stages)
+
+
+def test_worker_cancels_at_the_next_report(monkeypatch):
+    monkeypatch.setattr(salient_menu.SelectionWorker, "PROGRESS_INTERVAL", 0.0)
+    worker = salient_menu.SelectionWorker(worker_arguments())
+    worker.progressed.connect(lambda stage, count, total, error: worker.cancel() if stage == "selection" and count >= 5 else None)
+    worker.start()
+
+    assert len(worker.cancelled.emitted) == 1
+    assert worker.succeeded.emitted == []
+    # Selections yielded before the cancelling report are kept
+    assert [n for (n, _, _) in published(worker)] == list(range(2, 5))
+
+
+def test_worker_reports_failures():
+    arguments = worker_arguments()
+    arguments["end"] = 10
+    worker = salient_menu.SelectionWorker(arguments)
+    worker.start()
+    assert worker.succeeded.emitted == []
+    assert len(worker.failed.emitted) == 1 and "frames" in worker.failed.emitted[0][0]
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import salient_curves
+import salient_reduce
+
+
+def bezier_curves(selection, n_curves=3, seed=0):
+    """
+    Curves sampled at every frame that are cubic Beziers between the keyframes
+    of the selection, with the inner control points at a third and two thirds
+    of the way along in time. Returns the samples and inner control values.
+    """
+    rng = np.random.default_rng(seed)
+    values = rng.normal(size=(len(selection), n_curves))
+    inner_left = rng.normal(size=(len(selection) - 1, n_curves))
+    inner_right = rng.normal(size=(len(selection) - 1, n_curves))
+
+    data = np.empty((selection[-1] + 1, n_curves))
+    for (k, (s, e)) in enumerate(zip(selection[:-1], selection[1:])):
+        controls = np.stack([values[k], inner_left[k], inner_right[k], values[k + 1]])
+        data[s:e + 1] = salient_reduce.bezier_basis(e - s).dot(controls)
+    return data, inner_left, inner_right
+
+
+def test_fit_recovers_bezier_segments():
+    selection = [0, 3, 10, 14, 30]
+    data, inner_left, inner_right = bezier_curves(selection)
+    fitted_left, fitted_right = salient_reduce.fit_segments(data, selection)
+    np.testing.assert_allclose(fitted_left, inner_left, atol=1e-9)
+    np.testing.assert_allclose(fitted_right, inner_right, atol=1e-9)
+
+
+def test_short_segments_are_fitted_by_straight_lines():
+    data = np.array([[0.0], [1.0], [4.0]])
+    inner_left, inner_right = salient_reduce.fit_segments(data, [0, 1, 2])
+    np.testing.assert_allclose(inner_left[:, 0], [1.0 / 3.0, 2.0])
+    np.testing.assert_allclose(inner_right[:, 0], [2.0 / 3.0, 3.0])
+
+
+def test_tangents_reach_the_inner_control_points():
+    selection = [0, 4, 9, 21]
+    data, inner_left, inner_right = bezier_curves(selection)
+    seconds_per_frame = 1.0 / 30.0
+    (out_angles, out_weights), (in_angles, in_weights) = salient_reduce.fit_tangents(data, selection, seconds_per_frame)
+
+    # Handles span a third of each segment in time, reaching the inner control points
+    thirds = np.repeat((np.diff(selection) * seconds_per_frame / 3.0)[:, None], data.shape[1], axis=1)
+    keys = data[selection]
+    np.testing.assert_allclose(out_weights * np.cos(out_angles), thirds)
+    np.testing.assert_allclose(keys[:-1] + out_weights * np.sin(out_angles), inner_left, atol=1e-9)
+    np.testing.assert_allclose(in_weights * np.cos(in_angles), thirds)
+    np.testing.assert_allclose(keys[1:] - in_weights * np.sin(in_angles), inner_right, atol=1e-9)
+
+
+def test_selection_must_be_within_the_data():
+    with pytest.raises(ValueError):
+        salient_reduce.reduce_channels(np.zeros((10, 2)), [5, 15], start=5)
+
+
+def test_reduced_curves_round_trip(tmp_path):
+    selection = [10, 13, 20, 40]
+    data, _, _ = bezier_curves([s - 10 for s in selection])
+    reduced = salient_reduce.reduce_channels(data, selection, start=10, channels=["a.tx", "a.ty", "a.tz"])
+    assert list(reduced.times) == selection and len(reduced) == 3
+
+    path = str(tmp_path / "curves.rc")
+    with open(path, "wb") as f:
+        reduced.write(f)
+    with open(path, "rb") as f:
+        read = salient_curves.ReducedCurves.read(f)
+    assert read.channels == reduced.channels and list(read.times) == selection
+    assert read.seconds_per_frame == reduced.seconds_per_frame
+    for name in reduced.channels:
+        assert read.channel(name) == reduced.channel(name)
+    assert read.channel("a.ty")[0] == list(data[[s - 10 for s in selection], 1])
@@ -0,0 +1,202 @@
+import array
+import io
+import struct
+
+import numpy as np
+import pytest
+
+import salient_engine
+import salient_selections
+
+
+def example_table():
+    return salient_selections.SelectionTable.from_dict({
+        2 : { "selection" : [0, 9], "error" : 4.0 },
+        3 : { "selection" : [0, 5, 9], "error" : 2.5 },
+        4 : { "selection" : [0, 3, 5, 9], "error" : 1.0 },
+        5 : { "selection" : [0, 3, 5, 7, 9], "error" : 0.5 },
+    })
+
+
+def test_table_round_trip():
+    table = example_table()
+    f = io.BytesIO()
+    table.write(f)
+    f.seek(0)
+    assert salient_selections.SelectionTable.read(f).to_dict() == table.to_dict()
+
+
+def test_read_the_layout_written_by_salient_select():
+    # As SelectCommand::WriteSelections writes it
+    f = io.BytesIO()
+    f.write(b"SPSC" + struct.pack("=III", 1, 2, 0))
+    f.write(struct.pack("=ii", 2, 3))
+    f.write(struct.pack("=dd", 1.5, 0.25))
+    f.write(struct.pack("=iiiii", 10, 20, 10, 14, 20))
+    f.seek(0)
+    table = salient_selections.SelectionTable.read(f)
+    assert table.to_dict() == { 2 : { "selection" : [10, 20], "error" : 1.5 }, 3 : { "selection" : [10, 14, 20], "error" : 0.25 } }
+
+
+def test_read_rejects_other_files():
+    with pytest.raises(IOError):
+        salient_selections.SelectionTable.read(io.BytesIO(b"\0" * salient_selections.HEADER.size))
+
+
+def test_table_behaves_like_the_dictionary_of_selections():
+    table = example_table()
+    assert table.keys() == [2, 3, 4, 5] and list(table) == [2, 3, 4, 5]
+    assert len(table) == 4 and 3 in table and 6 not in table
+    assert table[4] == { "selection" : [0, 3, 5, 9], "error" : 1.0 }
+    assert table.get_keyframe_range() == (2, 5)
+    assert salient_selections.SelectionTable.from_dict(table.to_dict()).to_dict() == table.to_dict()
+
+
+def test_selections_are_unpacked_from_numpy_arrays():
+    table = salient_selections.SelectionTable(np.array([2, 3], dtype=np.int32), np.array([1.0, 0.5]),
+        np.array([0, 4, 0, 2, 4], dtype=np.int32))
+    selection = table.get_selection(3)
+    assert selection == [0, 2, 4] and all(type(v) is int for v in selection)
+    assert type(table.get_error(2)) is float
+
+
+def test_error_curve_is_normalised_over_the_keyframe_range():
+    curve = example_table().get_error_curve()
+    assert curve == [(0.0, 1.0), (1.0 / 3.0, 0.625), (2.0 / 3.0, 0.25), (1.0, 0.125)]
+
+
+def test_error_curve_is_thinned_to_max_points():
+    n = 1000
+    table = salient_selections.SelectionTable(array.array("i", range(2, n + 2)), array.array("d", [float(n - i) for i in range(n)]),
+        array.array("i", [0] * sum(range(2, n + 2))))
+    curve = table.get_error_curve(max_points=100)
+    assert len(curve) <= 101
+    assert curve[0] == (0.0, 1.0) and curve[-1][0] == 1.0
+    assert table.get_error_curve(max_points=100) is curve
+
+
+def test_stitching_grows_the_chunk_with_the_largest_error():
+    first = salient_selections.SelectionTable.from_dict({
+        2 : { "selection" : [0, 4], "error" : 3.0 },
+        3 : { "selection" : [0, 2, 4], "error" : 1.0 },
+    })
+    second = salient_selections.SelectionTable.from_dict({
+        2 : { "selection" : [4, 9], "error" : 2.0 },
+        3 : { "selection" : [4, 6, 9], "error" : 1.5 },
+        4 : { "selection" : [4, 6, 8, 9], "error" : 0.5 },
+    })
+    stitched = salient_selections.StitchedSelectionTable([first, second])
+    assert stitched.keys() == [3, 4, 5, 6]
+    assert [stitched.get_error(n) for n in stitched.keys()] == [3.0, 2.0, 1.5, 1.0]
+    assert stitched.get_selection(3) == [0, 4, 9]
+    assert stitched.get_selection(4) == [0, 2, 4, 9]
+    assert stitched.get_selection(6) == [0, 2, 4, 6, 8, 9]
+    assert stitched.to_table().to_dict() == stitched.to_dict()
+
+    assert salient_selections.StitchedSelectionTable([first, second], max_keyframes=4).keys() == [3, 4]
+    assert stitched.lower_bounds is None
+    assert stitched.get_error_bound(4) == (2.0, 2.0)
+
+    # An approximate chunk makes every stitched selection approximate
+    second.lower_bounds = [1.0, 0.5, 0.0]
+    stitched = salient_selections.StitchedSelectionTable([first, second])
+    assert [stitched.get_error_bound(n) for n in stitched.keys()] == [(3.0, 3.0), (1.0, 2.0), (1.0, 1.5), (1.0, 1.0)]
+    assert list(stitched.to_table().lower_bounds) == [3.0, 1.0, 1.0, 1.0]
+
+
+def random_anim_data(n_frames, width=5, seed=0):
+    rng = np.random.default_rng(seed)
+    positions = np.cumsum(rng.normal(size=(n_frames, width - 1)), axis=0)
+    frames = np.concatenate([np.arange(n_frames, dtype=np.float64)[:, None], positions], axis=1)
+    return frames.ravel().tolist(), ["time"] + ["d%d" % i for i in range(width - 1)]
+
+
+def windowed(anim_data, dimensions, start, end, fixed_keyframes, window, max_keyframes=None, max_error=None):
+    width = len(dimensions)
+    calls = []
+
+    def select_range(lo, hi, fixed, range_max_keyframes, range_max_error):
+        calls.append((lo, hi, range_max_keyframes))
+        range_anim_data = anim_data[(lo - start) * width:(hi - start + 1) * width]
+        manager = salient_engine.select(range_anim_data, dimensions, lo, hi, fixed, max_keyframes=range_max_keyframes,
+            max_error=range_max_error, reuse=False)
+        return manager.as_table(offset=lo)
+
+    table = salient_selections.select_windowed(select_range, anim_data, width, start, end, fixed_keyframes, window,
+        max_keyframes=max_keyframes, max_error=max_error)
+    return table, calls
+
+
+def test_windowed_selection_keeps_seams_and_fixed_keyframes():
+    anim_data, dimensions = random_anim_data(100)
+    table, calls = windowed(anim_data, dimensions, 0, 99, [30, 70], 40)
+    seams = [lo for (lo, _, _) in calls[1:]]
+    assert calls[0][0] == 0 and calls[-1][1] == 99
+    for n in table.keys():
+        selection = table.get_selection(n)
+        assert len(selection) == n and selection == sorted(set(selection))
+        assert set(seams + [0, 30, 70, 99]) <= set(selection)
+
+    # The stitched error is the largest of the chunks' errors
+    frames = salient_engine.as_frames(anim_data, dimensions)
+    for n in table.keys()[::10]:
+        assert salient_engine.selection_error(frames, np.array(table.get_selection(n))) == pytest.approx(table.get_error(n))
+
+
+def test_windowed_selection_budgets_each_chunk():
+    anim_data, dimensions = random_anim_data(100)
+    table, calls = windowed(anim_data, dimensions, 0, 99, [], 40, max_keyframes=12)
+    assert table.get_keyframe_range()[1] == 12
+    assert all(range_max_keyframes < 12 for (_, _, range_max_keyframes) in calls)
+
+    unbounded, _ = windowed(anim_data, dimensions, 0, 99, [], 40)
+    for n in table.keys():
+        assert table.get_selection(n) == unbounded.get_selection(n)
+
+    within, _ = windowed(anim_data, dimensions, 0, 99, [], 40, max_error=2.0)
+    assert within.get_error(within.keys()[-1]) <= 2.0
+
+
+def test_up_to_error_ends_at_the_first_selection_within_it():
+    table = example_table()
+    table.lower_bounds = [3.0, 2.0, 0.5, 0.25]
+    cut = table.up_to_error(2.5)
+    assert cut.keys() == [2, 3]
+    assert cut.get_selection(3) == [0, 5, 9]
+    assert cut.get_error_bound(3) == (2.0, 2.5)
+    assert table.up_to_error(0.5) is table
+    assert table.up_to_error(0.1) is table
+
+
+def test_empty_table_has_no_keyframe_range():
+    table = salient_selections.SelectionTable.empty()
+    assert table.get_keyframe_range() is None
+    assert table.get_error_curve() == []
+
+
+def test_at_least_drops_selections_of_fewer_keyframes():
+    table = example_table()
+    table.lower_bounds = [3.0, 2.0, 0.5, 0.25]
+    dropped = table.at_least(4)
+    assert dropped.keys() == [4, 5] and dropped.get_keyframe_range() == (4, 5)
+    assert dropped.get_selection(5) == [0, 3, 5, 7, 9]
+    assert dropped.get_error_bound(4) == (0.5, 1.0)
+    assert table.at_least(2) is table
+    assert len(table.at_least(6)) == 0
+
+
+def test_at_least_keeps_stitched_selections():
+    first = salient_selections.SelectionTable.from_dict({
+        2 : { "selection" : [0, 4], "error" : 3.0 },
+        3 : { "selection" : [0, 2, 4], "error" : 1.0 },
+    })
+    second = salient_selections.SelectionTable.from_dict({
+        2 : { "selection" : [4, 9], "error" : 2.0 },
+        3 : { "selection" : [4, 6, 9], "error" : 1.5 },
+        4 : { "selection" : [4, 6, 8, 9], "error" : 0.5 },
+    })
+    stitched = salient_selections.StitchedSelectionTable([first, second])
+    dropped = stitched.at_least(5)
+    assert dropped.keys() == [5, 6]
+    assert dropped.to_dict() == dict((n, stitched[n]) for n in [5, 6])
+    assert stitched.keys() == [3, 4, 5, 6]